@@ -6,6 +6,8 @@ const API = '';
 let token = localStorage.getItem('vv_token') || '';
 let currentUser = null;
 let selectedAmount = 0;
+let orderCache = [];
+let eventStream = null;
 
 // ====== 初始化 ======
 
@@ -31,6 +33,7 @@ async function loadUser() {
 }
 
 function showLoggedIn(user) {
+  openStream();
   document.getElementById('navGuest').classList.add('hidden');
   document.getElementById('navUser').classList.remove('hidden');
   document.getElementById('heroSection').classList.add('hidden');
@@ -61,6 +64,7 @@ function showLoggedOut() {
   document.getElementById('heroSection').classList.remove('hidden');
   document.getElementById('creditOption').classList.add('hidden');
   currentUser = null;
+  closeStream();
 }
 
 // ====== 认证弹窗 ======
@@ -253,11 +257,21 @@ async function loadOrders() {
   el.innerHTML = '<p class="text-muted">加载中...</p>';
   try {
     const data = await apiFetch('/api/orders');
-    if (!data.orders || data.orders.length === 0) {
-      el.innerHTML = '<p class="text-muted">暂无订单</p>';
-      return;
-    }
-    el.innerHTML = data.orders.map(o => `
+    orderCache = data.orders || [];
+    renderOrders();
+  } catch (e) {
+    el.innerHTML = '<p class="text-danger">加载失败</p>';
+  }
+}
+
+function renderOrders() {
+  const el = document.getElementById('orderList');
+  if (!el) return;
+  if (orderCache.length === 0) {
+    el.innerHTML = '<p class="text-muted">暂无订单</p>';
+    return;
+  }
+  el.innerHTML = orderCache.map(o => `
       <div class="order-item">
         <div>
           <div style="font-weight:600;">${o.phone} · ${o.operator}</div>
@@ -270,9 +284,6 @@ async function loadOrders() {
         </div>
       </div>
     `).join('');
-  } catch (e) {
-    el.innerHTML = '<p class="text-danger">加载失败</p>';
-  }
 }
 
 async function loadCreditInfo() {
@@ -308,29 +319,100 @@ function closeMessages() {
   document.getElementById('messagesModal').classList.remove('active');
 }
 
-async function loadMessages() {
+function renderMessage(m) {
+  return `
+      <div style="padding:12px;border-bottom:1px solid #333;">
+        <div style="font-weight:600;color:${m.type === 'success' ? '#4caf50' : m.type === 'error' ? '#e05252' : '#c9a84c'};">${m.title}</div>
+        ${m.content ? `<div class="text-muted" style="font-size:13px;margin-top:4px;">${m.content}</div>` : ''}
+        <div class="text-muted" style="font-size:11px;margin-top:4px;">${m.created_at.substring(0, 16)}</div>
+      </div>
+    `;
+}
+
+// cursor 为空时加载第一页，否则在列表末尾追加下一页
+async function loadMessages(cursor) {
   const el = document.getElementById('messageList');
   if (!el) return;
-  el.innerHTML = '<p class="text-muted">加载中...</p>';
+  if (!cursor) el.innerHTML = '<p class="text-muted">加载中...</p>';
   try {
-    const data = await apiFetch('/api/messages');
-    if (!data.messages || data.messages.length === 0) {
+    const data = await apiFetch('/api/messages' + (cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''));
+    const more = document.getElementById('msgMore');
+    if (more) more.remove();
+    if (!cursor && (!data.messages || data.messages.length === 0)) {
       el.innerHTML = '<p class="text-muted">暂无消息</p>';
       return;
     }
-    el.innerHTML = data.messages.map(m => `
-      <div style="padding:12px;border-bottom:1px solid #333;">
-        <div style="font-weight:600;color:${m.type === 'success' ? '#4caf50' : m.type === 'error' ? '#e05252' : '#c9a84c'};">${m.title}</div>
-        ${m.content ? `<div class="text-muted" style="font-size:13px;margin-top:4px;">${m.content}</div>` : ''}
-        <div class="text-muted" style="font-size:11px;margin-top:4px;">${m.created_at.substring(0, 16)}</div>
-      </div>
-    `).join('');
-    // 消息已读，清除角标
+    const html = data.messages.map(renderMessage).join('');
+    if (cursor) el.insertAdjacentHTML('beforeend', html);
+    else el.innerHTML = html;
+    if (data.next_cursor) {
+      el.insertAdjacentHTML('beforeend',
+        `<button class="btn btn-secondary btn-sm btn-full" id="msgMore" style="margin-top:8px;">加载更多</button>`);
+      document.getElementById('msgMore').onclick = () => loadMessages(data.next_cursor);
+    }
+    // 本次显示的消息已读，角标显示剩余未读数
     const msgBadge = document.getElementById('msgBadge');
-    if (msgBadge) msgBadge.classList.add('hidden');
+    if (msgBadge) {
+      msgBadge.textContent = data.unread > 99 ? '99+' : data.unread;
+      msgBadge.classList.toggle('hidden', !data.unread);
+    }
   } catch (_) {
-    el.innerHTML = '<p class="text-danger">加载失败</p>';
+    if (!cursor) el.innerHTML = '<p class="text-danger">加载失败</p>';
+  }
+}
+
+// ====== 实时推送 ======
+// 订单状态和站内消息通过 /api/stream 推送，无需轮询
+
+async function openStream() {
+  if (eventStream || !token || !window.EventSource) return;
+  // URL 里只放一次性票据，会话 token 只出现在请求头中
+  let ticket;
+  try {
+    ticket = (await apiFetch('/api/stream/ticket', 'POST')).ticket;
+  } catch (_) {
+    return;
+  }
+  if (eventStream || !token) return;
+  eventStream = new EventSource(`${API}/api/stream?ticket=${encodeURIComponent(ticket)}`);
+  eventStream.addEventListener('order', e => onOrderEvent(JSON.parse(e.data)));
+  eventStream.addEventListener('message', e => onMessageEvent(JSON.parse(e.data)));
+  eventStream.addEventListener('resync', () => {
+    // 客户端处理过慢被服务端断开：重连并全量刷新
+    closeStream();
+    setTimeout(() => { openStream(); if (orderCache.length) loadOrders(); }, 1000);
+  });
+  eventStream.onerror = () => {
+    // 票据已用过，浏览器自动重连会被拒绝：换一张新票据再连
+    closeStream();
+    setTimeout(openStream, 3000);
+  };
+}
+
+function closeStream() {
+  if (eventStream) eventStream.close();
+  eventStream = null;
+}
+
+function onOrderEvent(ev) {
+  const order = orderCache.find(o => o.id === ev.order_id);
+  if (!order) {
+    if (!document.getElementById('ordersSection').classList.contains('hidden')) loadOrders();
+    return;
+  }
+  order.status = ev.status;
+  order.message = ev.message;
+  renderOrders();
+}
+
+function onMessageEvent(msg) {
+  const msgBadge = document.getElementById('msgBadge');
+  if (msgBadge) {
+    const count = (parseInt(msgBadge.textContent, 10) || 0) + 1;
+    msgBadge.textContent = count > 99 ? '99+' : count;
+    msgBadge.classList.remove('hidden');
   }
+  showToast(msg.title, msg.type === 'error' ? 'error' : msg.type === 'success' ? 'success' : 'info');
 }
 
 // ====== API 工具 ======
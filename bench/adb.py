@@ -0,0 +1,53 @@
+"""
+ADB 动作延迟压测（order_bot.AdbSession）：PATH 上放假的 adb，比较每个动作的延迟
+  - spawn (before)：每个动作启动一个 adb 进程（重构前的 adb_cmd）；截图走 /sdcard + adb pull
+  - session (after)：常驻 adb shell 会话；充值表单的 4 个输入一次往返；截图走 exec-out
+
+    python -m bench.adb --repeat 200 --device-delay 0
+"""
+
+import argparse
+
+import order_bot
+from bench import common
+
+FORM = [('tap', 540, 620), ('text', '3331234567'), ('tap', 540, 900), ('text', '10')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--device-delay', type=float, default=0, help="设备端每条命令的模拟耗时（秒）")
+    args = parser.parse_args()
+    common.fake_adb(args.device_delay)
+    adb = 'adb'
+    order_bot.adb_shell(adb, 'true')  # 建立会话，不计入
+
+    def spawn_form():
+        for kind, *values in FORM:
+            cmd = order_bot.tap_command(*values) if kind == 'tap' else order_bot.text_command(*values)
+            order_bot.adb_cmd(adb, 'shell', cmd)
+
+    def session_form_single():
+        for action in FORM:
+            order_bot.adb_input(adb, action)
+
+    def pull_screenshot():
+        order_bot.adb_cmd(adb, 'shell', 'screencap', '-p', '/sdcard/screen.png')
+        order_bot.adb_cmd(adb, 'pull', '/sdcard/screen.png', common.temp_path('screen.png'))
+
+    cases = [
+        ("tap, spawn (before)", lambda: order_bot.adb_cmd(adb, 'shell', order_bot.tap_command(540, 620))),
+        ("tap, session (after)", lambda: order_bot.adb_tap(adb, 540, 620)),
+        ("form x4, spawn (before)", spawn_form),
+        ("form x4, session one by one", session_form_single),
+        ("form x4, session batched (after)", lambda: order_bot.adb_input(adb, *FORM)),
+        ("screenshot, screencap+pull (before)", pull_screenshot),
+        ("screenshot, exec-out (after)", lambda: order_bot.adb_screencap(adb)),
+    ]
+    for label, fn in cases:
+        common.report(label, **common.percentiles(common.timed(fn, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+站内消息归档压测（maintenance.archive_messages / reclaim_space）：--users 个用户、--messages 条消息
+（默认 5000 万，按时间顺序分布在最近 --days 天内；7 天前的消息 98% 已读，近 7 天一半未读），比较归档前后
+  - 数据库文件大小和各表占用（dbstat）
+  - 收件箱第 1 页：重构前的 /api/messages（最新 20 条 + 把该用户全部消息标为已读，before）
+    与当前实现（游标分页 + 只标记本页未读 + inbox_counts 未读数，after）
+  - 收件箱第 --deep-page 页：当前实现（重构前没有翻页）
+每次请求在事务中执行后回滚，数据不变。
+并统计归档 MESSAGE_RETENTION_DAYS 天前已读消息的耗时。
+
+    python -m bench.archive --messages 50000000
+"""
+
+import os
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import queries  # noqa: E402
+import maintenance  # noqa: E402
+from database import connect  # noqa: E402
+from pagination import keyset_page  # noqa: E402
+
+BATCH = 1000000
+TEMPLATES = [
+    ("success", "充值成功", "号码 {phone} 充值 €{amount} 已到账。"),
+    ("info", "订单处理中", "订单 {order} 正在充值，请稍候。"),
+    ("warning", "付款提醒", "订单 {order} 待付款 €{amount}，请尽快完成支付。"),
+    ("error", "充值失败", "号码 {phone} 充值失败，款项将原路退回。"),
+]
+
+
+def seed(db, users, messages, days):
+    ids = common.seed_users(db, users)
+    rng = random.Random(24)
+    now = datetime.now()
+    start = now - timedelta(days=days)
+    step = days * 86400 / max(1, messages)
+    recent = now - timedelta(days=7)
+    for b in range(0, messages, BATCH):
+        rows = []
+        for i in range(b, min(messages, b + BATCH)):
+            created = start + timedelta(seconds=i * step)
+            kind, title, body = rng.choice(TEMPLATES)
+            content = body.format(phone=f"33{rng.randrange(10 ** 8):08d}", amount=rng.choice([5, 10, 20, 50]),
+                                  order=f"{rng.getrandbits(32):08x}")
+            is_read = rng.random() < (0.5 if created > recent else 0.98)
+            rows.append((rng.choice(ids), kind, title, content, int(is_read), created.isoformat()))
+        db.executemany("INSERT INTO site_messages (user_id, type, title, content, is_read, created_at) "
+                       "VALUES (?,?,?,?,?,?)", rows)
+        db.commit()
+    db.execute("ANALYZE")
+    db.commit()
+    return ids
+
+
+# 重构前 server.py /api/messages 的查询
+def legacy_inbox(db, user_id):
+    rows = db.execute(
+        "SELECT * FROM site_messages WHERE user_id=? ORDER BY created_at DESC LIMIT 20",
+        (user_id,)
+    ).fetchall()
+    db.execute("UPDATE site_messages SET is_read=1 WHERE user_id=?", (user_id,))
+    return rows
+
+
+# 当前 server.py /api/messages 的查询
+def inbox(db, user_id, cursor=None):
+    rows, next_cursor = keyset_page(db, queries.INBOX_SELECT, queries.INBOX_WHERE, [user_id], 20, cursor)
+    unread = [r['id'] for r in rows if not r['is_read']]
+    if unread:
+        db.execute(f"UPDATE site_messages SET is_read=1 WHERE id IN ({','.join('?' * len(unread))})", unread)
+    db.execute(queries.INBOX_UNREAD_SQL, (user_id,)).fetchone()
+    return rows, next_cursor
+
+
+def rolled_back(db, fn):
+    db.execute("BEGIN")
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    db.rollback()
+    return elapsed
+
+
+def deep_cursor(db, user_id, page):
+    """逐页翻到第 page 页，返回该页的游标（不计时）；消息不够时返回最后一页的游标"""
+    cursor = None
+    for _ in range(page - 1):
+        _, next_cursor = keyset_page(db, queries.INBOX_SELECT, queries.INBOX_WHERE, [user_id], 20, cursor)
+        if not next_cursor:
+            break
+        cursor = next_cursor
+    return cursor
+
+
+def measure(label, users, samples, deep_page):
+    db = connect(DB_FILE)
+    rng = random.Random(7)
+    picks = [rng.choice(users) for _ in range(samples)]
+    cursors = {user: deep_cursor(db, user, deep_page) for user in set(picks[:max(1, samples // 10)])}
+    legacy, first, deep = [], [], []
+    for user in picks:
+        legacy.append(rolled_back(db, lambda: legacy_inbox(db, user)))
+        first.append(rolled_back(db, lambda: inbox(db, user)))
+    for user, cursor in cursors.items():
+        deep.append(rolled_back(db, lambda: inbox(db, user, cursor)))
+    sizes = maintenance.table_sizes(db)
+    db.close()
+    common.report(f"{label}: size", db_mb=round(os.path.getsize(DB_FILE) / 2 ** 20, 1),
+                  **{f"{table}_mb": round(sizes.get(table, 0) / 2 ** 20, 1)
+                     for table in ('site_messages', 'site_messages_archive')})
+    common.report(f"{label}: page 1, mark all read (before)", **common.percentiles(legacy))
+    common.report(f"{label}: page 1, keyset (after)", **common.percentiles(first))
+    common.report(f"{label}: page {deep_page}, keyset (after)", **common.percentiles(deep))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=50000000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--deep-page', type=int, default=10)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    start = time.perf_counter()
+    users = seed(db, args.users, args.messages, args.days)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+    common.report("seeded", messages=args.messages, seconds=round(time.perf_counter() - start, 1))
+    measure("before archive", users, args.samples, args.deep_page)
+
+    db = connect(DB_FILE)
+    start = time.perf_counter()
+    before = (datetime.now() - timedelta(days=maintenance.MESSAGE_RETENTION_DAYS)).isoformat()
+    archived = maintenance.archive_messages(db, before, time.monotonic() + 86400)
+    archive_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    freed = maintenance.reclaim_space(db, time.monotonic() + 86400, pages=2 ** 31)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    left = db.execute("SELECT COUNT(*) FROM site_messages").fetchone()[0]
+    db.close()
+    common.report("archive", retention_days=maintenance.MESSAGE_RETENTION_DAYS, archived=archived,
+                  seconds=round(archive_seconds, 1), messages_left=left)
+    common.report("reclaim", freed_pages=freed, seconds=round(time.perf_counter() - start, 1))
+    measure("after archive", users, args.samples, args.deep_page)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+批量下单压测（POST /api/orders/bulk）：对运行中的 server.py 提交 --orders 笔订单，比较
+  - individual (before)：逐笔 POST /api/orders（每笔一次鉴权、一个事务、一条管理员通知）
+  - bulk (after)：每 BULK_ORDER_MAX 笔一次 POST /api/orders/bulk（一次鉴权、一个事务、一条汇总通知）
+管理员通知渠道配置为指向本地不可达地址，只登记、不真正发出。
+
+    python -m bench.bulk --orders 1000
+"""
+
+import time
+import argparse
+
+import httpx
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+from database import connect  # noqa: E402
+from server import BULK_ORDER_MAX  # noqa: E402
+
+
+def counts(db_file):
+    db = connect(db_file)
+    try:
+        return [db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('orders', 'order_events', 'notifications')]
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000)
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    env = common.bench_env(TELEGRAM_BOT_TOKEN='bench', TELEGRAM_CHAT_ID='bench',
+                           TELEGRAM_API_BASE=f"http://127.0.0.1:{common.free_port()}")
+    server = common.Server(env=env)
+    orders = [dict(common.ORDER, phone=f"33{i:08d}") for i in range(args.orders)]
+    samples, runs = [], []
+    with httpx.Client(base_url=server.base, timeout=60) as client:
+        headers = common.register(client)
+
+        start, snapshot = time.perf_counter(), counts(DB_FILE)
+        for order in orders:
+            t = time.perf_counter()
+            client.post('/api/orders', json=order, headers=headers).raise_for_status()
+            samples.append(time.perf_counter() - t)
+        runs.append(("individual (before)", time.perf_counter() - start, len(orders), snapshot, counts(DB_FILE)))
+
+        start, snapshot, requests = time.perf_counter(), counts(DB_FILE), 0
+        for i in range(0, len(orders), BULK_ORDER_MAX):
+            r = client.post('/api/orders/bulk', json={'orders': orders[i:i + BULK_ORDER_MAX]}, headers=headers)
+            r.raise_for_status()
+            assert r.json()['rejected'] == 0, r.text[:300]
+            requests += 1
+        runs.append(("bulk (after)", time.perf_counter() - start, requests, snapshot, counts(DB_FILE)))
+    server.stop()
+
+    for label, elapsed, requests, before, after in runs:
+        orders_added, events_added, notifications_added = (a - b for a, b in zip(after, before))
+        common.report(label, seconds=round(elapsed, 2), requests=requests, orders=orders_added,
+                      orders_per_s=round(orders_added / elapsed, 1), events=events_added,
+                      notifications=notifications_added)
+    common.report("individual request latency", **common.percentiles(samples))
+
+
+if __name__ == '__main__':
+    main()
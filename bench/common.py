@@ -0,0 +1,215 @@
+"""
+压测脚本公共部分：临时数据库、批量造数、子进程启动服务/机器人、延迟分位数统计。
+
+所有脚本都在仓库根目录以模块方式运行，数据库放在临时目录，结束后删除：
+    python -m bench.pool --orders 2000
+"""
+
+import os
+import sys
+import time
+import uuid
+import atexit
+import random
+import shutil
+import socket
+import logging
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_PASSWORD = os.environ.get("RECHARGE_ADMIN_PWD", "recharge2025")
+
+_tmpdir = tempfile.mkdtemp(prefix='recharge-bench-')
+atexit.register(shutil.rmtree, _tmpdir, True)
+
+# 压测只关心耗时，不让每笔订单的 INFO 日志拖慢结果
+logging.disable(logging.INFO)
+
+
+def temp_path(name):
+    return os.path.join(_tmpdir, name)
+
+
+def use_temp_db(name='bench.db'):
+    """把 RECHARGE_DB_FILE 指向临时库；必须在导入 database / server 之前调用"""
+    path = temp_path(name)
+    os.environ['RECHARGE_DB_FILE'] = path
+    # 压测流量全部来自 127.0.0.1，普通接口的单 IP 限额放开
+    os.environ.setdefault('RATE_LIMIT_DEFAULT', '100000000/60')
+    return path
+
+
+def fresh_db(path):
+    """打开并迁移一个新库"""
+    from database import connect
+    from migrations import migrate
+    db = connect(path)
+    migrate(db)
+    return db
+
+
+# ====== 造数 ======
+
+STATUSES = ['charged', 'processing', 'paying', 'completed', 'failed', 'awaiting_payment', 'holding']
+OPERATORS = ['TIM', 'Vodafone', 'WindTre', 'Iliad']
+
+
+def seed_users(db, count, prefix='user'):
+    now = datetime.now().isoformat()
+    db.executemany(
+        "INSERT INTO users (id, email, phone, password_hash, created_at) VALUES (?,?,?,?,?)",
+        ((f"{prefix}-{i:07d}", f"{prefix}{i}@bench.local", f"33{i:08d}", 'x', now) for i in range(count)))
+    db.commit()
+    return [f"{prefix}-{i:07d}" for i in range(count)]
+
+
+def seed_orders(db, count, users, statuses=STATUSES, start=None, step_seconds=30, batch=100000, seed=1):
+    """按时间顺序批量插入 count 笔订单；状态、运营商、金额随机"""
+    rng = random.Random(seed)
+    start = start or datetime.now() - timedelta(seconds=count * step_seconds)
+    for b in range(0, count, batch):
+        rows = []
+        for i in range(b, min(count, b + batch)):
+            created = (start + timedelta(seconds=i * step_seconds)).isoformat()
+            status = rng.choice(statuses)
+            amount = rng.choice([5, 10, 20, 50])
+            rows.append((str(uuid.UUID(int=rng.getrandbits(128))), rng.choice(users), f"33{rng.randrange(10 ** 8):08d}",
+                         rng.choice(OPERATORS), amount, 0, amount, '', status, 0, created,
+                         '' if status == 'charged' else created))
+        db.executemany("""
+            INSERT INTO orders (id, user_id, phone, operator, amount, bonus, total, payment, status, is_credit,
+                                created_at, updated_at)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+        """, rows)
+        db.commit()
+
+
+# ====== 假 adb ======
+
+FAKE_ADB = """#!/bin/sh
+[ "$2" = "bad" ] && exit 1
+[ "$1" = "-s" ] && shift 2
+case "$1" in
+  get-state) echo device ;;
+  shell) shift; if [ $# -eq 0 ]; then exec /bin/sh; else sh -c "$*"; fi ;;
+  exec-out) printf 'PNGDATA' ;;
+esac
+exit 0
+"""
+DEVICE_COMMAND = """#!/bin/sh
+[ -n "$FAKE_DEVICE_DELAY" ] && sleep "$FAKE_DEVICE_DELAY"
+exit 0
+"""
+
+
+def fake_adb(device_delay=None):
+    """在临时目录放一个假的 adb 和设备端的 monkey / input / screencap 命令并加到 PATH 前面；
+    device_delay 秒模拟设备端每条命令的执行时间"""
+    bin_dir = temp_path('bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in (('adb', FAKE_ADB), *((cmd, DEVICE_COMMAND) for cmd in ('monkey', 'input', 'screencap'))):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    if device_delay is not None:
+        os.environ['FAKE_DEVICE_DELAY'] = str(device_delay)
+    return bin_dir
+
+
+# ====== 统计 ======
+
+def percentiles(samples):
+    """samples 为秒；返回毫秒的 p50/p90/p99/max"""
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+    return {"n": len(ordered), "p50": round(pick(0.50), 3), "p90": round(pick(0.90), 3),
+            "p99": round(pick(0.99), 3), "max": round(ordered[-1] * 1000, 3)}
+
+
+def timed(fn, repeat=1):
+    """执行 repeat 次，返回每次耗时（秒）的列表"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, **fields):
+    print(f"{label:<40} " + "  ".join(f"{k}={v}" for k, v in fields.items()), flush=True)
+
+
+# ====== 子进程 ======
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_env(**extra):
+    env = dict(os.environ)
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+
+class Process:
+    """在仓库根目录启动一个入口脚本（server.py / dispatcher.py / ...），退出时结束"""
+
+    def __init__(self, script, *args, env=None):
+        self.proc = subprocess.Popen([sys.executable, script, *args], cwd=ROOT, env=env or bench_env(),
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+class Server(Process):
+    """python server.py --workers N，等到 /api/ready 返回 200"""
+
+    def __init__(self, workers=1, env=None):
+        import httpx
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        super().__init__('server.py', '--host', '127.0.0.1', '--port', str(self.port),
+                         '--workers', str(workers), env=env)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server.py exited with {self.proc.returncode}")
+            try:
+                if httpx.get(self.base + '/api/ready', timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("server.py not ready after 60s")
+
+
+def register(client, email='bench@bench.local', password='bench-pass-1'):
+    """注册一个用户并返回 Authorization 头；client 为 httpx.Client 或 TestClient"""
+    r = client.post('/api/register', json={'email': email, 'password': password})
+    r.raise_for_status()
+    return {'Authorization': 'Bearer ' + r.json()['token']}
+
+
+def admin_login(client):
+    r = client.post('/api/admin/login', json={'password': ADMIN_PASSWORD})
+    r.raise_for_status()
+    return {'Authorization': 'Bearer ' + r.json()['token']}
+
+
+ORDER = {'phone': '3331234567', 'operator': 'TIM', 'amount': 10}
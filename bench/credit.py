@@ -0,0 +1,185 @@
+"""
+信用积分压测（credit.record_order / get_credit_level / recompute_all）：--users 个用户，账本中 --events 条完成订单
+（随机分布在用户上），比较
+  - 单笔计分：重构前的 update_credit_score（读整行、Python 计算、写七列，before）
+    与 record_order（追加账本 + 增量更新，after）；各 --orders 笔，在事务中执行后回滚
+  - 等级查找：重构前逐级线性扫描（before）与 bisect（after），每次调用的纳秒数
+  - 规则调整后全量重算：recompute_all 一条聚合 SQL（after）；重构前没有批量重算，
+    只能对每条账本记录调用一次 update_credit_score 回放，只回放 --legacy-events 条并按吞吐推算全量耗时（before）
+  - check_all：只读对比全部用户
+
+    python -m bench.credit --users 1000000 --events 5000000
+"""
+
+import time
+import random
+import timeit
+import argparse
+from unittest import mock
+from datetime import datetime
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import credit  # noqa: E402
+from database import connect  # noqa: E402
+
+BATCH = 1000000
+AMOUNTS = [5, 10, 15, 20, 30, 50]
+
+
+# 重构前 server.py 的实现（日志省略）
+def legacy_get_credit_level(score):
+    level = credit.CREDIT_LEVELS[0]
+    for lv in credit.CREDIT_LEVELS:
+        if score >= lv["min_score"]:
+            level = lv
+    return level
+
+
+def legacy_update_credit_score(db, user_id, order_amount, is_credit_order=False):
+    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not user:
+        return
+    user = dict(user)
+
+    score = user.get('credit_score', 0) or 0
+    total = user.get('total_spent', 0) or 0
+    streak = user.get('consecutive_success', 0) or 0
+    m100 = user.get('milestone_100', 0) or 0
+    m300 = user.get('milestone_300', 0) or 0
+
+    if order_amount >= 30:
+        points = 20
+    elif order_amount >= 15:
+        points = 10
+    else:
+        points = 5
+
+    if is_credit_order:
+        points += 15
+
+    streak += 1
+    if streak >= 3 and streak % 3 == 0:
+        points += 30
+
+    score += points
+    total += order_amount
+
+    if total >= 100 and not m100:
+        score += 50
+        m100 = 1
+    if total >= 300 and not m300:
+        score += 100
+        m300 = 1
+
+    new_level = legacy_get_credit_level(score)
+
+    db.execute("""
+        UPDATE users SET credit_score = ?, credit_level = ?, total_spent = ?,
+        consecutive_success = ?, milestone_100 = ?, milestone_300 = ?,
+        credit_amount = ?
+        WHERE id = ?
+    """, (score, new_level["name"], total, streak, m100, m300,
+          new_level["credit_limit"], user_id))
+    return {"points_added": points, "new_score": score, "new_level": new_level}
+
+
+def seed(db, users, events):
+    """造用户和账本，再用 recompute_all 把 users 上的积分状态对齐到账本"""
+    ids = common.seed_users(db, users)
+    rng = random.Random(25)
+    now = datetime.now().isoformat()
+    for b in range(0, events, BATCH):
+        db.executemany("""
+            INSERT INTO credit_events (user_id, order_id, amount, is_credit, points, created_at)
+            VALUES (?,?,?,?,0,?)
+        """, ((rng.choice(ids), f"order-{n:09d}", rng.choice(AMOUNTS), int(rng.random() < 0.3), now)
+              for n in range(b, min(events, b + BATCH))))
+        db.commit()
+    credit.recompute_all(db)
+    db.commit()
+    db.execute("ANALYZE")
+    db.commit()
+    return ids
+
+
+def scoring(db, users, orders):
+    rng = random.Random(7)
+    picks = [(rng.choice(users), rng.choice(AMOUNTS), rng.random() < 0.3) for _ in range(orders)]
+    for label, fn in (("update_credit_score (before)",
+                       lambda user, amount, is_credit, n: legacy_update_credit_score(db, user, amount, is_credit)),
+                      ("record_order (after)",
+                       lambda user, amount, is_credit, n: credit.record_order(db, user, f"bench-{n}", amount,
+                                                                              is_credit))):
+        samples = []
+        for n, (user, amount, is_credit) in enumerate(picks):
+            db.execute("BEGIN")
+            start = time.perf_counter()
+            fn(user, amount, is_credit, n)
+            samples.append(time.perf_counter() - start)
+            db.rollback()
+        common.report(f"score one order: {label}", **common.percentiles(samples))
+
+
+def level_lookup(repeat=200000):
+    for score in (0, 120, 450, 900):
+        before = timeit.timeit(lambda: legacy_get_credit_level(score), number=repeat) / repeat * 1e9
+        after = timeit.timeit(lambda: credit.get_credit_level(score), number=repeat) / repeat * 1e9
+        common.report(f"level lookup score={score}", linear_ns=round(before), bisect_ns=round(after))
+
+
+def legacy_replay(db, events, total_events):
+    """重构前只能逐条回放：对前 events 条账本记录各调用一次 update_credit_score，回滚后按吞吐推算全量"""
+    rows = db.execute("SELECT user_id, amount, is_credit FROM credit_events ORDER BY id LIMIT ?",
+                      (events,)).fetchall()
+    db.execute("BEGIN")
+    start = time.perf_counter()
+    for row in rows:
+        legacy_update_credit_score(db, row['user_id'], row['amount'], bool(row['is_credit']))
+    elapsed = time.perf_counter() - start
+    db.rollback()
+    common.report("rule change: replay update_credit_score (before)", events=len(rows),
+                  seconds=round(elapsed, 2),
+                  projected_seconds=round(elapsed / max(1, len(rows)) * total_events, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--events', type=int, default=5000000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--legacy-events', type=int, default=200000)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    start = time.perf_counter()
+    users = seed(db, args.users, args.events)
+    common.report("seeded", users=args.users, events=args.events, seconds=round(time.perf_counter() - start, 1))
+    db.close()
+
+    db = connect(DB_FILE)
+    scoring(db, users, args.orders)
+    level_lookup()
+
+    start = time.perf_counter()
+    problems = credit.check_all(db)
+    common.report("check_all", mismatches=len(problems), seconds=round(time.perf_counter() - start, 1))
+    legacy_replay(db, args.legacy_events, args.events)
+    with mock.patch.object(credit, 'STREAK_POINTS', credit.STREAK_POINTS + 10):
+        start = time.perf_counter()
+        db.execute("BEGIN")
+        updated = credit.recompute_all(db)
+        db.commit()
+        common.report("rule change: recompute_all (after)", users_updated=updated,
+                      seconds=round(time.perf_counter() - start, 1))
+        start = time.perf_counter()
+        updated = credit.recompute_all(db)
+        db.commit()
+        common.report("recompute_all again, nothing changed", users_updated=updated,
+                      seconds=round(time.perf_counter() - start, 1))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
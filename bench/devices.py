@@ -0,0 +1,70 @@
+"""
+多设备吞吐压测（order_bot.DeviceWorker + order_queue 租约协议）：PATH 上放假的 adb，
+N 个设备线程同时按租约领取同一队列的订单，测每小时处理的订单数。
+1 台设备即重构前的单线程顺序处理；充值各阶段的等待按 --scale 缩短（默认 1/50），结果按比例换算回实际时长。
+
+    python -m bench.devices --orders 200 --devices 1,2,4,8
+"""
+
+import time
+import argparse
+import threading
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+common.fake_adb()
+
+import order_bot  # noqa: E402
+from database import get_db  # noqa: E402
+
+
+def run_devices(count, orders, cfg):
+    with get_db() as db:
+        db.execute("DELETE FROM orders")
+        common.seed_orders(db, orders, ['user'], statuses=['processing'])
+    workers = [order_bot.DeviceWorker(cfg, serial=f"device-{i}") for i in range(count)]
+
+    def drain(worker):
+        while worker.process_one():
+            pass
+
+    threads = [threading.Thread(target=drain, args=(w,)) for w in workers]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    with get_db() as db:
+        done = db.execute("SELECT COUNT(*) FROM orders WHERE status='completed'").fetchone()[0]
+    return elapsed, done, [w.completed for w in workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--devices', default='1,2,4,8')
+    parser.add_argument('--scale', type=float, default=50, help="充值各阶段等待时间缩短的倍数")
+    args = parser.parse_args()
+    defaults = order_bot.load_config()
+    cfg = {
+        'accounts': [{'username': 'bench'}],
+        'page_load_wait': defaults.get('page_load_wait', 3) / args.scale,
+        'action_delay_min': defaults.get('action_delay_min', 2) / args.scale,
+        'action_delay_max': defaults.get('action_delay_max', 5) / args.scale,
+        'payment_result_wait': defaults.get('payment_result_wait', 10) / args.scale,
+    }
+    common.fresh_db(DB_FILE).close()
+
+    baseline = None
+    for count in (int(n) for n in args.devices.split(',')):
+        elapsed, done, per_device = run_devices(count, args.orders, cfg)
+        per_hour = done / (elapsed * args.scale) * 3600
+        baseline = baseline or per_hour
+        common.report(f"{count} device(s)", completed=done, orders_per_hour=round(per_hour, 1),
+                      speedup=round(per_hour / baseline, 2), per_device=per_device)
+
+
+if __name__ == '__main__':
+    main()
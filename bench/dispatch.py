@@ -0,0 +1,81 @@
+"""
+调度延迟压测（dispatcher.py / events.py）：逐笔写入 charged 订单并按 server.py 的方式发出唤醒，
+测量订单变为 processing 的延迟。
+  - polling (before)：唤醒端口被占用，调度器按 poll_interval 轮询（重构前的固定间隔轮询）
+  - event-driven (after)：UDP 唤醒后立即处理
+
+    python -m bench.dispatch --orders 20 --poll-interval 10
+"""
+
+import time
+import uuid
+import socket
+import random
+import argparse
+import multiprocessing
+from datetime import datetime
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+from database import connect  # noqa: E402
+from events import publish_order_event, notify_dispatcher  # noqa: E402
+
+
+def run_dispatcher(port, poll_interval):
+    import events
+    import dispatcher
+    events.NOTIFY_PORT = port
+    cfg = dict(dispatcher.load_config(), poll_interval=poll_interval, reconcile_interval=3600,
+               maintenance_in_dispatcher=False)
+    dispatcher.load_config = lambda: cfg
+    dispatcher.run()
+
+
+def measure(db, port, orders, gap):
+    samples = []
+    rng = random.Random(5)
+    for _ in range(orders):
+        order_id = str(uuid.uuid4())
+        db.execute("INSERT INTO orders (id, user_id, phone, operator, amount, status, created_at) "
+                   "VALUES (?,?,?,?,?,?,?)",
+                   (order_id, 'user', '3331234567', 'TIM', 10, 'charged', datetime.now().isoformat()))
+        publish_order_event(db, order_id, 'charged')
+        db.commit()
+        start = time.perf_counter()
+        notify_dispatcher(port)
+        while db.execute("SELECT status FROM orders WHERE id=?", (order_id,)).fetchone()[0] == 'charged':
+            time.sleep(0.001)
+        samples.append(time.perf_counter() - start)
+        # 订单随机到达：相对轮询时刻的相位均匀分布
+        time.sleep(rng.uniform(0, gap))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=20)
+    parser.add_argument('--poll-interval', type=float, default=10, help="轮询模式的间隔（bot_config.json 默认 10）")
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    db = connect(DB_FILE)
+
+    port = common.free_port(socket.SOCK_DGRAM)
+    blocker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for label, blocked in (("polling (before)", True), ("event-driven (after)", False)):
+        if blocked:
+            blocker.bind(('127.0.0.1', port))
+        proc = multiprocessing.Process(target=run_dispatcher, args=(port, args.poll_interval), daemon=True)
+        proc.start()
+        time.sleep(1)
+        samples = measure(db, port, args.orders, args.poll_interval if blocked else 0.05)
+        proc.terminate()
+        proc.join()
+        if blocked:
+            blocker.close()
+        common.report(f"charged → processing, {label}", **common.percentiles(samples))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+事件循环阻塞压测（db_call / DBExecutor）：并发请求 /api/orders，同时另一个客户端反复请求统计接口，
+比较 /api/orders 的延迟分布：
+  - idle：没有统计请求
+  - inline (before)：重构前的写法，在 async 路由里直接同步执行六条全表聚合
+  - offloaded (after)：同样六条聚合经 db_call 放到数据库线程池
+  - /api/admin/stats：当前实现（汇总表）
+
+应用在本进程内通过 ASGI 调用，与 uvicorn 单 worker 一样只有一个事件循环。
+
+    python -m bench.event_loop --orders 300000 --seconds 5
+"""
+
+import time
+import asyncio
+import argparse
+from datetime import datetime
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import httpx  # noqa: E402
+from fastapi import Request  # noqa: E402
+
+import server  # noqa: E402
+from database import get_db  # noqa: E402
+
+# 重构前 admin_stats 的六条聚合
+LEGACY_STATS_SQL = [
+    ("SELECT COUNT(*) FROM users", ()),
+    ("SELECT COUNT(*) FROM orders", ()),
+    ("SELECT COUNT(*) FROM orders WHERE status='completed'", ()),
+    ("SELECT COUNT(*) FROM orders WHERE status IN ('pending','charged','processing')", ()),
+    ("SELECT COALESCE(SUM(amount),0) FROM orders WHERE status='completed'", ()),
+    ("SELECT COUNT(*) FROM orders WHERE created_at LIKE ?", (datetime.now().strftime('%Y-%m-%d') + '%',)),
+]
+
+
+def legacy_stats(db):
+    return [db.execute(sql, params).fetchone()[0] for sql, params in LEGACY_STATS_SQL]
+
+
+@server.app.get("/bench/stats-inline")
+async def stats_inline(request: Request):
+    with get_db() as db:
+        return legacy_stats(db)
+
+
+@server.app.get("/bench/stats-offloaded")
+async def stats_offloaded(request: Request):
+    return await server.db_call(legacy_stats, timeout=server.DB_TIMEOUT_ADMIN)
+
+
+async def run_case(client, headers, admin, stats_path, seconds, concurrency):
+    samples = []
+    stop = time.monotonic() + seconds
+
+    async def reader():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            r = await client.get('/api/orders', headers=headers)
+            r.raise_for_status()
+            samples.append(time.perf_counter() - start)
+
+    async def stats():
+        calls = 0
+        while stats_path and time.monotonic() < stop:
+            (await client.get(stats_path, headers=admin)).raise_for_status()
+            calls += 1
+        return calls
+
+    results = await asyncio.gather(stats(), *[reader() for _ in range(concurrency)])
+    return samples, results[0]
+
+
+async def run(seconds, concurrency):
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.lifespan(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            r = await client.post('/api/register', json={'email': 'bench@bench.local', 'password': 'bench-pass-1'})
+            headers = {'Authorization': 'Bearer ' + r.json()['token']}
+            r = await client.post('/api/admin/login', json={'password': common.ADMIN_PASSWORD})
+            admin = {'Authorization': 'Bearer ' + r.json()['token']}
+            for label, path in (("idle", None),
+                                ("inline full-scan stats (before)", "/bench/stats-inline"),
+                                ("offloaded full-scan stats (after)", "/bench/stats-offloaded"),
+                                ("/api/admin/stats rollups (current)", "/api/admin/stats")):
+                samples, calls = await run_case(client, headers, admin, path, seconds, concurrency)
+                common.report(f"/api/orders, {label}", stats_calls=calls, **common.percentiles(samples))
+            common.report("db executor", **server.db_stats()['executor'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=300000, help="订单表行数（决定全表聚合的耗时）")
+    parser.add_argument('--seconds', type=float, default=5, help="每种场景的持续时间")
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    with get_db() as db:
+        users = common.seed_users(db, 1000)
+        common.seed_orders(db, args.orders, users)
+    asyncio.run(run(args.seconds, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
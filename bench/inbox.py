@@ -0,0 +1,118 @@
+"""
+/api/me 延迟压测（inbox_counts 维护型未读数）：一个用户有 --messages 条站内消息（--unread 比例未读），
+其他用户另有 --other-messages 条；同一进程内通过 ASGI 各请求 --requests 次，比较
+  - COUNT(*) per request (before)：重构前的 /api/me（会话 JOIN + 按用户 COUNT 未读消息）
+  - inbox_counts (after)：当前的 /api/me（会话缓存 + 一次主键查询）
+
+    python -m bench.inbox --messages 100000
+"""
+
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import httpx  # noqa: E402
+from fastapi import HTTPException, Request  # noqa: E402
+
+import server  # noqa: E402
+from database import get_db  # noqa: E402
+
+
+# 重构前 server.py 的实现
+def legacy_get_user_from_token(token, db):
+    if not token:
+        return None
+    row = db.execute(
+        "SELECT s.user_id, u.* FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = ? AND s.expires_at > ?",
+        (token, datetime.now().isoformat())
+    ).fetchone()
+    return dict(row) if row else None
+
+
+@server.app.get("/bench/legacy/me")
+async def legacy_get_me(request: Request):
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    with get_db() as db:
+        user = legacy_get_user_from_token(token, db)
+        if not user:
+            raise HTTPException(401, "未登录")
+        unread = db.execute(
+            "SELECT COUNT(*) as c FROM site_messages WHERE user_id=? AND is_read=0",
+            (user['id'],)
+        ).fetchone()['c']
+        score = user.get('credit_score', 0) or 0
+        level = server.get_credit_level(score)
+        next_lv = server.get_next_level(score)
+    return {
+        "id": user['id'],
+        "email": user.get('email'),
+        "phone": user.get('phone'),
+        "nickname": user.get('nickname', ''),
+        "credit_amount": user.get('credit_amount', 0),
+        "credit_used": user.get('credit_used', 0),
+        "credit_score": score,
+        "credit_level": level,
+        "next_level": next_lv,
+        "unread_messages": unread,
+    }
+
+
+def seed(messages, unread, other_messages):
+    db = common.fresh_db(DB_FILE)
+    users = common.seed_users(db, 1000)
+    user = users[0]
+    rng = random.Random(23)
+    start = datetime.now() - timedelta(days=30)
+    rows = [(user if i < messages else rng.choice(users[1:]), 'info', f"消息 {i}", int(rng.random() >= unread),
+             (start + timedelta(seconds=i)).isoformat()) for i in range(messages + other_messages)]
+    rng.shuffle(rows)
+    db.executemany("INSERT INTO site_messages (user_id, type, title, is_read, created_at) VALUES (?,?,?,?,?)", rows)
+    token = uuid.uuid4().hex
+    now = datetime.now()
+    db.execute("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)",
+               (token, user, now.isoformat(), (now + timedelta(days=30)).isoformat()))
+    db.commit()
+    db.execute("ANALYZE")
+    db.close()
+    return token
+
+
+async def run(token, requests):
+    transport = httpx.ASGITransport(app=server.app)
+    headers = {'Authorization': 'Bearer ' + token}
+    async with server.lifespan(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', headers=headers) as client:
+            results = {}
+            for label, path in (("COUNT(*) per request (before)", '/bench/legacy/me'),
+                                ("inbox_counts (after)", '/api/me')):
+                samples = []
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    r = await client.get(path)
+                    r.raise_for_status()
+                    samples.append(time.perf_counter() - start)
+                results[label] = r.json()['unread_messages']
+                common.report(label, unread=results[label], **common.percentiles(samples))
+            common.report("same unread count", ok=len(set(results.values())) == 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--unread', type=float, default=0.5, help="未读消息比例")
+    parser.add_argument('--other-messages', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+    token = seed(args.messages, args.unread, args.other_messages)
+    asyncio.run(run(token, args.requests))
+
+
+if __name__ == '__main__':
+    main()
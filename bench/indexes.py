@@ -0,0 +1,106 @@
+"""
+索引压测（migrations.py 的二级索引）：在 1M 订单的库上测热点查询的延迟，
+然后删掉订单、会话、用户、站内消息、验证码上的二级索引（重构前的结构）再测一次。
+语句取自 queries.py / dispatcher.py / order_queue.py / payment_bot.py，与线上一致。
+
+    python -m bench.indexes --orders 1000000
+"""
+
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import queries  # noqa: E402
+import dispatcher  # noqa: E402
+import payment_bot  # noqa: E402
+from database import connect  # noqa: E402
+from pagination import keyset_sql, encode_cursor  # noqa: E402
+
+INDEXED_TABLES = ('orders', 'sessions', 'users', 'site_messages', 'sms_codes')
+
+
+def seed(db, orders, users):
+    ids = common.seed_users(db, users)
+    common.seed_orders(db, orders, ids)
+    now = datetime.now()
+    rng = random.Random(7)
+    db.executemany("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)",
+                   ((f"token-{i}", ids[i % users], now.isoformat(), (now + timedelta(days=30)).isoformat())
+                    for i in range(users * 3)))
+    db.executemany("INSERT INTO site_messages (user_id, type, title, is_read, created_at) VALUES (?,?,?,?,?)",
+                   ((rng.choice(ids), 'info', 'm', 1, (now - timedelta(seconds=i)).isoformat()) for i in range(orders)))
+    db.executemany("INSERT INTO sms_codes (phone, code, purpose, ip, created_at) VALUES (?,?,?,?,?)",
+                   ((f"33{i:08d}", '123456', 'register', '10.0.0.1', now.isoformat()) for i in range(users)))
+    db.commit()
+    db.execute("ANALYZE")
+    db.commit()
+    return ids
+
+
+def cases(db, user_id, orders):
+    now = datetime.now().isoformat()
+    # 后台翻到第 5000 页左右的位置
+    deep = db.execute("SELECT created_at, id FROM orders ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+                      (min(orders // 2, 100000),)).fetchone()
+    cursor = encode_cursor(*deep) if deep else None
+    token = db.execute("SELECT token FROM sessions WHERE user_id=? LIMIT 1", (user_id,)).fetchone()[0]
+    where, params = queries.admin_order_filters(status='processing')
+    return {
+        "session lookup": (queries.SESSION_USER_SQL, (token, now)),
+        "user order list": (queries.USER_ORDERS_SQL, (user_id,)),
+        "unpaid credit order": (queries.UNPAID_CREDIT_SQL, (user_id,)),
+        "sms code": (queries.SMS_CODE_SQL, ('3300000001', '123456', 'register', '2000')),
+        "register ip": (queries.REGISTER_IP_SQL, ('10.0.0.1', '2000')),
+        "inbox page": keyset_sql(queries.INBOX_SELECT, queries.INBOX_WHERE, [user_id], 20),
+        "admin orders, deep cursor": keyset_sql(queries.ADMIN_ORDERS_SELECT, [], [], 20, cursor, 'o'),
+        "admin orders by status": keyset_sql(queries.ADMIN_ORDERS_SELECT, where, params, 20, None, 'o'),
+        "processing timeout": (dispatcher.STALE_STATUS_SQL, ('processing', '2000', '2000')),
+        "next processing order": ("SELECT id FROM orders WHERE status='processing' ORDER BY created_at ASC LIMIT 1", ()),
+        "due reminders": (payment_bot.DUE_REMINDERS_SQL, ('2000', payment_bot.SWEEP_LIMIT)),
+    }
+
+
+def measure(db, queries_, repeat):
+    results = {}
+    for name, (sql, params) in queries_.items():
+        samples = common.timed(lambda: db.execute(sql, params).fetchall(), repeat)
+        results[name] = common.percentiles(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    start = time.perf_counter()
+    ids = seed(db, args.orders, args.users)
+    common.report("seed", orders=args.orders, users=args.users, seconds=round(time.perf_counter() - start, 1))
+    workload = cases(db, ids[len(ids) // 2], args.orders)
+    after = measure(db, workload, args.repeat)
+
+    dropped = [row[0] for row in db.execute(
+        f"SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({','.join('?' * len(INDEXED_TABLES))})", INDEXED_TABLES)]
+    for name in dropped:
+        db.execute(f"DROP INDEX {name}")
+    db.commit()
+    db.close()
+    db = connect(DB_FILE)
+    before = measure(db, workload, max(1, args.repeat // 5))
+    common.report("dropped indexes", count=len(dropped))
+
+    for name in workload:
+        common.report(name, before_p50_ms=before[name]['p50'], after_p50_ms=after[name]['p50'],
+                      after_p99_ms=after[name]['p99'])
+
+
+if __name__ == '__main__':
+    main()
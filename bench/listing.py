@@ -0,0 +1,86 @@
+"""
+后台订单列表分页压测（pagination.keyset_page / row_count）：--orders 笔订单，第 1 页 vs 第 --deep-page 页（超出页数时取最后一页），
+不筛选和按状态筛选各测一次，每页 20 条，含 total。
+  - LIMIT/OFFSET + COUNT(*) (before)：重构前 admin_orders 的查询
+  - keyset + row_counts (after)：当前的游标分页 + 触发器维护的计数
+深页的游标取自第 deep_page - 1 页最后一行（不计时），与管理员一路翻过去拿到的游标相同。
+
+    python -m bench.listing --orders 1000000 --deep-page 5000
+"""
+
+import argparse
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import queries  # noqa: E402
+from database import connect  # noqa: E402
+from pagination import keyset_page, row_count, encode_cursor  # noqa: E402
+
+PER_PAGE = 20
+
+
+# 重构前 admin_orders 的查询
+def legacy_page(db, status, page):
+    offset = (page - 1) * PER_PAGE
+    if status:
+        rows = db.execute(
+            "SELECT o.*, u.email, u.phone as user_phone FROM orders o LEFT JOIN users u ON o.user_id=u.id WHERE o.status=? ORDER BY o.created_at DESC LIMIT ? OFFSET ?",
+            (status, PER_PAGE, offset)
+        ).fetchall()
+        total = db.execute("SELECT COUNT(*) as c FROM orders WHERE status=?", (status,)).fetchone()['c']
+    else:
+        rows = db.execute(
+            "SELECT o.*, u.email, u.phone as user_phone FROM orders o LEFT JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT ? OFFSET ?",
+            (PER_PAGE, offset)
+        ).fetchall()
+        total = db.execute("SELECT COUNT(*) as c FROM orders").fetchone()['c']
+    return rows, total
+
+
+def keyset(db, status, cursor):
+    where, params = queries.admin_order_filters(status)
+    rows, _ = keyset_page(db, queries.ADMIN_ORDERS_SELECT, where, params, PER_PAGE, cursor, alias='o')
+    return rows, row_count(db, f"orders:{status}" if status else "orders")
+
+
+def cursor_before(db, status, page):
+    """第 page 页的游标：第 page - 1 页最后一行"""
+    if page <= 1:
+        return None
+    where = "WHERE status=?" if status else ""
+    row = db.execute(f"SELECT created_at, id FROM orders {where} ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+                     ([status] if status else []) + [(page - 1) * PER_PAGE - 1]).fetchone()
+    return encode_cursor(row['created_at'], row['id'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--deep-page', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    common.seed_orders(db, args.orders, common.seed_users(db, args.users))
+    db.execute("ANALYZE")
+    db.close()
+
+    db = connect(DB_FILE)
+    for status in ('', 'completed'):
+        pages = -(-row_count(db, f"orders:{status}" if status else "orders") // PER_PAGE)
+        for page in (1, min(args.deep_page, pages)):
+            cursor = cursor_before(db, status, page)
+            legacy_rows, legacy_total = legacy_page(db, status, page)
+            rows, total = keyset(db, status, cursor)
+            same = [r['id'] for r in legacy_rows] == [r['id'] for r in rows] and legacy_total == total
+            for label, fn in (("LIMIT/OFFSET + COUNT(*) (before)", lambda: legacy_page(db, status, page)),
+                              ("keyset + row_counts (after)", lambda: keyset(db, status, cursor))):
+                common.report(f"{status or 'all'} page {page}: {label}", same=same,
+                              **common.percentiles(common.timed(fn, args.repeat)))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+登录吞吐压测（passwords.PasswordService）：为选择哈希成本参数提供数据。
+  - 单线程 KDF：每种参数一次验证的耗时和每核每秒可验证次数，含重构前的 salt$sha256（before）
+  - /api/login 端到端：同一进程内通过 ASGI 以 --concurrency 个并发发 --logins 次登录
+    （每次登录换一个客户端 IP，不触发登录限速），统计 logins/s、每核 logins/s、延迟分位数，
+    以及同时请求 /api/health 的延迟（KDF 在独立线程池中执行，不应阻塞事件循环）
+
+    python -m bench.login --logins 100 --concurrency 16
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import secrets
+import argparse
+from datetime import datetime
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from database import get_db  # noqa: E402
+from passwords import PasswordService, PasswordHasher, ScryptHasher, Pbkdf2Hasher  # noqa: E402
+
+PASSWORD = 'bench-pass-1'
+CORES = os.cpu_count() or 1
+
+SETTINGS = [
+    ("scrypt n=2^13", lambda: ScryptHasher(n=2 ** 13)),
+    ("scrypt n=2^14 (default)", lambda: ScryptHasher(n=2 ** 14)),
+    ("scrypt n=2^15", lambda: ScryptHasher(n=2 ** 15)),
+    ("pbkdf2 210000", lambda: Pbkdf2Hasher(210000)),
+    ("pbkdf2 600000", lambda: Pbkdf2Hasher(600000)),
+]
+
+
+# 重构前 server.py 的实现
+def hash_pw(pw):
+    salt = secrets.token_hex(16)
+    hashed = hashlib.sha256((salt + pw).encode()).hexdigest()
+    return f"{salt}${hashed}"
+
+
+def verify_pw(pw, stored_hash):
+    if '$' in stored_hash:
+        salt, hashed = stored_hash.split('$', 1)
+        return hashlib.sha256((salt + pw).encode()).hexdigest() == hashed
+    return hashlib.sha256(pw.encode()).hexdigest() == stored_hash
+
+
+def kdf_report(label, verify, stored, repeat):
+    samples = common.timed(lambda: verify(PASSWORD, stored), repeat)
+    per_verify = sorted(samples)[len(samples) // 2]
+    common.report(f"kdf {label}", ms_per_verify=round(per_verify * 1000, 3),
+                  verifies_per_s_per_core=round(1 / per_verify, 1))
+
+
+def seed_accounts(count, stored_hash):
+    now = datetime.now().isoformat()
+    accounts = [f"login-{uuid.uuid4().hex[:12]}@bench.local" for _ in range(count)]
+    with get_db() as db:
+        db.executemany("INSERT INTO users (id, email, password_hash, created_at) VALUES (?,?,?,?)",
+                       [(str(uuid.uuid4()), email, stored_hash, now) for email in accounts])
+    return accounts
+
+
+async def login_load(accounts, logins, concurrency):
+    counter = iter(range(logins))
+    samples, health = [], []
+    done = asyncio.Event()
+
+    async def worker():
+        for i in counter:
+            ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+            transport = httpx.ASGITransport(app=server.app, client=(ip, 40000))
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+                start = time.perf_counter()
+                r = await client.post('/api/login', json={'account': accounts[i % len(accounts)],
+                                                          'password': PASSWORD})
+                r.raise_for_status()
+                samples.append(time.perf_counter() - start)
+
+    async def probe():
+        transport = httpx.ASGITransport(app=server.app, client=('10.255.255.254', 40000))
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            while not done.is_set():
+                start = time.perf_counter()
+                (await client.get('/api/health')).raise_for_status()
+                health.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+    prober = asyncio.create_task(probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await prober
+    return elapsed, samples, health
+
+
+async def run(args):
+    async with server.lifespan(server.app):
+        for label, make in SETTINGS:
+            hasher = PasswordHasher(make())
+            server.passwords = PasswordService(hasher)
+            accounts = seed_accounts(args.users, hasher.hash(PASSWORD))
+            elapsed, samples, health = await login_load(accounts, args.logins, args.concurrency)
+            stats = common.percentiles(samples)
+            common.report(f"login {label}", logins_per_s=round(len(samples) / elapsed, 1),
+                          per_core=round(len(samples) / elapsed / CORES, 1),
+                          p50=stats['p50'], p99=stats['p99'],
+                          health_p99=common.percentiles(health)['p99'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20, help="单线程 KDF 每种参数的验证次数")
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    common.report("cores", n=CORES)
+    kdf_report("salt$sha256 (before)", verify_pw, hash_pw(PASSWORD), args.repeat)
+    for label, make in SETTINGS:
+        hasher = PasswordHasher(make())
+        kdf_report(label, hasher.verify, hasher.hash(PASSWORD), args.repeat)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+通知投递吞吐压测（notify.NotificationService）：本地 HTTP 服务模拟 Telegram（每个请求 --latency 秒），
+积压 --messages 条通知，比较
+  - per-message (before)：重构前每条消息同步 urllib 请求一次
+  - outbox + digest (after)：发件箱领取、摘要合并、keep-alive 连接池
+Telegram 对同一会话约 1 条/秒的限制下，请求数直接决定积压清空所需时间。
+
+    python -m bench.notify --messages 1000 --latency 0.05
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import notify  # noqa: E402
+from database import get_db  # noqa: E402
+
+CREDENTIALS = {'telegram': {'token': 'bench', 'chat_id': 'chat'}}
+
+
+def start_server(latency):
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+            requests.append(1)
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests
+
+
+def legacy_send_telegram(base, token, chat_id, msg):
+    data = json.dumps({"chat_id": chat_id, "text": msg, "parse_mode": "HTML"}).encode('utf-8')
+    req = urllib.request.Request(f"{base}/bot{token}/sendMessage", data=data,
+                                 headers={"Content-Type": "application/json"})
+    urllib.request.urlopen(req, timeout=5)
+
+
+def enqueue(count):
+    with get_db() as db:
+        for i in range(count):
+            notify.enqueue_alert(db, CREDENTIALS, f"✅ 充值完成\n订单: {i:08d}\n号码: 3331234567\n金额: €10", "充值成功")
+
+
+async def drain(service):
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+    async with httpx.AsyncClient(timeout=10, limits=limits) as client:
+        while await service.deliver_once(client):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help="模拟服务端每个请求的处理时间（秒）")
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    server, requests = start_server(args.latency)
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        legacy_send_telegram(base, 'bench', 'chat', f"✅ 充值完成\n订单: {i:08d}\n号码: 3331234567\n金额: €10")
+    elapsed = time.perf_counter() - start
+    common.report("per-message (before)", messages=args.messages, requests=len(requests),
+                  seconds=round(elapsed, 2), msgs_per_s=round(args.messages / elapsed, 1))
+
+    requests.clear()
+    notify.TELEGRAM_API = base
+    enqueue(args.messages)
+    service = notify.NotificationService(CREDENTIALS, 'bench')
+    # 只测投递本身，不受渠道令牌桶限速
+    service.buckets = {c: notify.TokenBucket(1e9, 1e9) for c in service.channels}
+    start = time.perf_counter()
+    asyncio.run(drain(service))
+    elapsed = time.perf_counter() - start
+    common.report("outbox + digest (after)", messages=service.messages, requests=len(requests),
+                  seconds=round(elapsed, 2), msgs_per_s=round(service.messages / elapsed, 1))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+号码校验压测（phones.py）：生成 --numbers 个号码（带 +39/空格、位数不对、非 3 开头的混合），
+比较规范化 + 运营商识别的总耗时，并先抽样核对结果一致。
+  - per-number (before)：重构前 server.py 的 validate_italian_phone + 遍历 OPERATOR_PREFIXES 找运营商
+  - per-number, prefix index：当前的单个号码接口
+  - validate_batch (after)：当前的批量接口
+
+    python -m bench.phones --numbers 1000000
+"""
+
+import re
+import time
+import random
+import argparse
+
+from bench import common
+from phones import OPERATOR_PREFIXES, validate_italian_phone, operator_index, validate_batch, summarize_batch
+
+
+# 重构前 server.py 的实现
+def legacy_validate(phone):
+    phone = re.sub(r'\D', '', phone)
+    if len(phone) == 12 and phone.startswith('39'):
+        phone = phone[2:]
+    if len(phone) == 13 and phone.startswith('+39'):
+        phone = phone[3:]
+    if len(phone) != 10:
+        return None, "号码必须是10位数字"
+    if not phone.startswith('3'):
+        return None, "意大利手机号必须3开头"
+    return phone, None
+
+
+def legacy_operator(phone):
+    prefix3 = phone[:3]
+    for op, prefixes in OPERATOR_PREFIXES.items():
+        if prefix3 in prefixes:
+            return op
+    return None
+
+
+def legacy_loop(numbers):
+    results = []
+    for raw in numbers:
+        phone, error = legacy_validate(raw)
+        results.append((None, None, error) if error else (phone, legacy_operator(phone), None))
+    return results
+
+
+def indexed_loop(numbers):
+    results = []
+    for raw in numbers:
+        phone, error = validate_italian_phone(raw)
+        if error:
+            results.append((None, None, error))
+        else:
+            ops = operator_index.lookup(phone)
+            results.append((phone, ops[0] if ops else None, None))
+    return results
+
+
+def generate(count, seed=14):
+    rng = random.Random(seed)
+    numbers = []
+    for _ in range(count):
+        n = '3' + ''.join(rng.choice('0123456789') for _ in range(9))
+        r = rng.random()
+        if r < 0.2:
+            n = f"+39 {n[:3]} {n[3:]}"
+        elif r < 0.25:
+            n = n[:7]
+        elif r < 0.3:
+            n = '0' + n[1:]
+        numbers.append(n)
+    return numbers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--numbers', type=int, default=1000000)
+    args = parser.parse_args()
+    numbers = generate(args.numbers)
+    sample = numbers[:50000]
+    common.report("same results on sample", ok=legacy_loop(sample) == validate_batch(sample) == indexed_loop(sample),
+                  n=len(sample))
+
+    baseline = None
+    for label, fn in (("per-number (before)", legacy_loop), ("per-number, prefix index", indexed_loop),
+                      ("validate_batch (after)", validate_batch)):
+        start = time.perf_counter()
+        results = fn(numbers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        common.report(label, seconds=round(elapsed, 3), numbers_per_s=int(len(numbers) / elapsed),
+                      speedup=round(baseline / elapsed, 2), valid=summarize_batch(results)['valid'])
+
+
+if __name__ == '__main__':
+    main()
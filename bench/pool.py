@@ -0,0 +1,111 @@
+"""
+连接层压测（database.py）：
+  1. 单进程：每次操作新开连接（旧 get_db，默认 rollback 日志）vs 连接池借出的 WAL 连接
+  2. 端到端：server.py 与 dispatcher.py、payment_bot.py 同时运行，并发下单的吞吐和 p50/p99
+
+    python -m bench.pool --ops 2000 --orders 2000 --concurrency 16
+"""
+
+import time
+import asyncio
+import sqlite3
+import argparse
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+from database import get_db  # noqa: E402
+
+
+def insert_order(db, n):
+    db.execute("INSERT INTO orders (id, user_id, phone, operator, amount, status, created_at) VALUES (?,?,?,?,?,?,?)",
+               (f"order-{n}", 'user', '3331234567', 'TIM', 10, 'charged', '2026-01-01T00:00:00'))
+    db.execute("SELECT * FROM orders WHERE user_id=? ORDER BY created_at DESC LIMIT 50", ('user',)).fetchall()
+
+
+def bench_connections(ops):
+    legacy_file = common.temp_path('legacy.db')
+    db = sqlite3.connect(legacy_file)
+    db.executescript("""
+        CREATE TABLE orders (id TEXT PRIMARY KEY, user_id TEXT, phone TEXT, operator TEXT, amount REAL,
+                             status TEXT, created_at TEXT);
+    """)
+    db.close()
+
+    def legacy(n):
+        # 重构前：每次请求 sqlite3.connect(DB_FILE)，rollback 日志 + synchronous=FULL
+        conn = sqlite3.connect(legacy_file)
+        conn.row_factory = sqlite3.Row
+        try:
+            insert_order(conn, n)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def pooled(n):
+        with get_db() as conn:
+            insert_order(conn, n)
+
+    for label, fn in (("new connection per op (before)", legacy), ("pooled WAL connection (after)", pooled)):
+        samples = []
+        for n in range(ops):
+            start = time.perf_counter()
+            fn(n)
+            samples.append(time.perf_counter() - start)
+        common.report(label, ops_per_s=round(ops / sum(samples)), **common.percentiles(samples))
+    with get_db() as conn:
+        conn.execute("DELETE FROM orders")
+
+
+async def create_orders(base, headers, total, concurrency):
+    import httpx
+    samples = []
+    async with httpx.AsyncClient(base_url=base, headers=headers,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker(count):
+            for _ in range(count):
+                start = time.perf_counter()
+                r = await client.post('/api/orders', json=common.ORDER)
+                r.raise_for_status()
+                samples.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(total // concurrency) for _ in range(concurrency)])
+        return samples, time.perf_counter() - start
+
+
+def bench_end_to_end(total, concurrency, workers):
+    import httpx
+    env = common.bench_env(RECHARGE_DB_FILE=DB_FILE, DISPATCHER_NOTIFY_PORT=common.free_port())
+    server = common.Server(workers, env=env)
+    bots = [common.Process('dispatcher.py', env=env), common.Process('payment_bot.py', env=env)]
+    try:
+        with httpx.Client(base_url=server.base) as client:
+            headers = common.register(client)
+        samples, elapsed = asyncio.run(create_orders(server.base, headers, total, concurrency))
+        common.report(f"POST /api/orders with bots, {workers} worker(s)",
+                      orders_per_s=round(len(samples) / elapsed), **common.percentiles(samples))
+        with get_db() as db:
+            moved = db.execute("SELECT COUNT(*) FROM orders WHERE status != 'charged'").fetchone()[0]
+        common.report("orders advanced by dispatcher", count=moved)
+    finally:
+        for proc in bots:
+            proc.stop()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=2000, help="单进程对比的操作次数")
+    parser.add_argument('--orders', type=int, default=2000, help="端到端下单总数")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=1, help="server.py worker 数")
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    bench_connections(args.ops)
+    bench_end_to_end(args.orders, args.concurrency, args.workers)
+
+
+if __name__ == '__main__':
+    main()
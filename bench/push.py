@@ -0,0 +1,178 @@
+"""
+实时推送压测（stream.StreamHub）：--clients 个已登录用户同时在线，另一个进程（这里是独立连接的写线程）
+每秒更新 --events-per-s 笔订单状态并登记 order_events，统计服务端每秒执行的 SQL 语句数。
+服务在本进程的线程里运行（uvicorn），数据库连接加 trace 回调计数；写线程的连接不计入。
+  - polling (before)：客户端每 --poll-interval 秒重新拉取 /api/orders 和 /api/messages
+  - SSE stream (after)：客户端用一次性票据连接 /api/stream，由每进程一个轮询任务分发
+每个用户有 --orders-per-user 笔订单，事件随机落在这些订单上。
+轮询时 requests_per_s 低于 clients × 2 / poll_interval 说明服务端已饱和，语句数只是下限。
+
+    python -m bench.push --clients 1000 --seconds 20
+"""
+
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import database  # noqa: E402
+
+statements = [0]
+_connect = database.connect
+
+
+def traced_connect(db_file=None):
+    conn = _connect(db_file)
+
+    def trace(sql):
+        if not sql.lstrip().upper().startswith(('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA')):
+            statements[0] += 1
+
+    conn.set_trace_callback(trace)
+    return conn
+
+
+database.connect = traced_connect
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import server  # noqa: E402
+from events import publish_order_event  # noqa: E402
+
+
+def seed(clients, orders_per_user):
+    db = common.fresh_db(DB_FILE)
+    users = common.seed_users(db, clients)
+    common.seed_orders(db, clients * orders_per_user, users)
+    now = datetime.now()
+    tokens = [uuid.uuid4().hex for _ in users]
+    db.executemany("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)",
+                   [(token, user, now.isoformat(), (now + timedelta(days=1)).isoformat())
+                    for token, user in zip(tokens, users)])
+    db.commit()
+    order_ids = [r[0] for r in db.execute("SELECT id FROM orders")]
+    db.close()
+    return tokens, order_ids
+
+
+def writer(order_ids, per_second, stop, counter):
+    """模拟机器人进程：按固定速率更新订单状态并登记事件"""
+    db = _connect(DB_FILE)
+    rng = random.Random(19)
+    interval = 1 / per_second
+    next_at = time.monotonic()
+    while not stop.is_set():
+        order_id = rng.choice(order_ids)
+        status = rng.choice(common.STATUSES)
+        db.execute("UPDATE orders SET status=?, updated_at=? WHERE id=?",
+                   (status, datetime.now().isoformat(), order_id))
+        publish_order_event(db, order_id, status)
+        db.commit()
+        counter[0] += 1
+        next_at += interval
+        time.sleep(max(0, next_at - time.monotonic()))
+    db.close()
+
+
+async def poll_client(base, token, interval, deadline, counter):
+    await asyncio.sleep(random.random() * interval)
+    async with httpx.AsyncClient(base_url=base, headers={'Authorization': 'Bearer ' + token}, timeout=60) as client:
+        while time.monotonic() < deadline:
+            for path in ('/api/orders', '/api/messages'):
+                (await client.get(path)).raise_for_status()
+                counter[0] += 1
+            await asyncio.sleep(interval)
+
+
+async def stream_client(base, token, connected, received):
+    async with httpx.AsyncClient(base_url=base, timeout=httpx.Timeout(60, read=None)) as client:
+        r = await client.post('/api/stream/ticket', headers={'Authorization': 'Bearer ' + token})
+        r.raise_for_status()
+        async with client.stream('GET', '/api/stream', params={'ticket': r.json()['ticket']}) as response:
+            response.raise_for_status()
+            connected[0] += 1
+            async for line in response.aiter_lines():
+                if line.startswith('event: '):
+                    received[0] += 1
+
+
+async def measure(label, seconds, events_per_s, order_ids, counter):
+    stop = threading.Event()
+    written = [0]
+    thread = threading.Thread(target=writer, args=(order_ids, events_per_s, stop, written))
+    before, polls = statements[0], server.stream_hub.polls
+    start = time.monotonic()
+    thread.start()
+    await asyncio.sleep(seconds)
+    stop.set()
+    thread.join()
+    elapsed = time.monotonic() - start
+    return label, elapsed, statements[0] - before, written[0], counter, server.stream_hub.polls - polls
+
+
+async def run(base, tokens, order_ids, args):
+    # before：轮询
+    requests = [0]
+    deadline = time.monotonic() + args.seconds + args.poll_interval
+    pollers = [asyncio.create_task(poll_client(base, t, args.poll_interval, deadline, requests)) for t in tokens]
+    await asyncio.sleep(args.poll_interval)
+    requests[0] = 0
+    results = [await measure("polling (before)", args.seconds, args.events_per_s, order_ids, requests)]
+    await asyncio.gather(*pollers)
+
+    # after：SSE
+    connected, received = [0], [0]
+    streams = [asyncio.create_task(stream_client(base, t, connected, received)) for t in tokens]
+    while connected[0] < len(tokens):
+        failed = [s for s in streams if s.done()]
+        if failed:
+            failed[0].result()
+        await asyncio.sleep(0.2)
+    await asyncio.sleep(2)
+    received[0] = 0
+    results.append(await measure("SSE stream (after)", args.seconds, args.events_per_s, order_ids, received))
+    for s in streams:
+        s.cancel()
+    await asyncio.gather(*streams, return_exceptions=True)
+
+    for label, elapsed, executed, written, counter, polls in results:
+        extra = ({'requests_per_s': round(counter[0] / elapsed, 1)} if label.startswith('polling')
+                 else {'events_delivered': counter[0], 'hub_polls': polls})
+        common.report(label, clients=len(tokens), events_written=written,
+                      statements_per_s=round(executed / elapsed, 1), **extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--poll-interval', type=float, default=10, help="轮询客户端的刷新间隔（秒）")
+    parser.add_argument('--events-per-s', type=float, default=20)
+    parser.add_argument('--orders-per-user', type=int, default=5)
+    args = parser.parse_args()
+    tokens, order_ids = seed(args.clients, args.orders_per_user)
+
+    port = common.free_port()
+    uv = uvicorn.Server(uvicorn.Config(server.app, host='127.0.0.1', port=port, log_level='warning',
+                                       backlog=args.clients * 2))
+    thread = threading.Thread(target=uv.run, daemon=True)
+    thread.start()
+    while not uv.started:
+        time.sleep(0.1)
+    try:
+        asyncio.run(run(f"http://127.0.0.1:{port}", tokens, order_ids, args))
+    finally:
+        uv.should_exit = True
+        thread.join(10)
+
+
+if __name__ == '__main__':
+    main()
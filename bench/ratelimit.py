@@ -0,0 +1,123 @@
+"""
+限速中间件开销压测（ratelimit.py / server.rate_limit_middleware）：--ips 个客户端 IP 随机发请求，
+直接调用中间件（call_next 立即返回），测每个请求在中间件里花的时间和限速表占用的内存。
+  - timestamp lists (before)：重构前每个 IP 一个时间戳列表，每次请求过滤整张列表
+  - token bucket memory (after)：进程内令牌桶 + LRU（默认后端）
+  - token bucket sqlite：所有请求走共享 SQLite 后端（RATE_LIMIT_BACKEND=sqlite）
+普通接口按线上默认 100 次/60 秒限速。
+
+    python -m bench.ratelimit --ips 10000 --requests 300000
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+os.environ.setdefault('RATE_LIMIT_DEFAULT', '100/60')
+
+from bench import common  # noqa: E402
+
+DB_FILE = common.use_temp_db()
+
+import server  # noqa: E402
+from ratelimit import create_limiter  # noqa: E402
+from database import get_db  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import JSONResponse, Response  # noqa: E402
+
+
+def legacy_middleware():
+    rate_limit_store = defaultdict(list)
+
+    async def middleware(request, call_next):
+        client_ip = request.client.host if request.client else "unknown"
+        now = time.time()
+        rate_limit_store[client_ip] = [t for t in rate_limit_store[client_ip] if now - t < 60]
+        if len(rate_limit_store[client_ip]) >= 100:
+            return JSONResponse(status_code=429, content={"detail": "请求过于频繁，请稍后再试"})
+        rate_limit_store[client_ip].append(now)
+        return await call_next(request)
+
+    return middleware
+
+
+def make_request(ip):
+    return Request({'type': 'http', 'method': 'GET', 'path': '/api/operators', 'headers': [],
+                    'query_string': b'', 'client': (ip, 40000)})
+
+
+async def call_next(request):
+    return Response(b'')
+
+
+async def measure(middleware, ips):
+    samples, rejected = [], 0
+    for ip in ips:
+        request = make_request(ip)
+        start = time.perf_counter()
+        response = await middleware(request, call_next)
+        samples.append(time.perf_counter() - start)
+        rejected += response.status_code == 429
+    return samples, rejected
+
+
+async def replay(middleware, ips):
+    for ip in ips:
+        await middleware(make_request(ip), call_next)
+
+
+def store_size(make_middleware, ips):
+    """单独重放一遍只统计限速表本身占用的内存（不含延迟样本）"""
+    tracemalloc.start()
+    middleware = make_middleware()
+    asyncio.run(replay(middleware, ips))
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return round(current / 2 ** 20, 2)
+
+
+def memory_middleware():
+    server.rate_limiter = create_limiter('memory')
+    return server.rate_limit_middleware
+
+
+def sqlite_middleware():
+    with get_db() as db:
+        db.execute("DELETE FROM rate_limits")
+    server.rate_limiter = create_limiter('sqlite')
+    return server.rate_limit_middleware
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ips', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=300000)
+    parser.add_argument('--sqlite-requests', type=int, default=30000, help="sqlite 后端较慢，只跑前 N 个请求")
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    rng = random.Random(11)
+    pool = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(args.ips)]
+    workloads = {
+        # 全部 IP 随机访问，大多数 IP 远低于限额
+        "uniform": [rng.choice(pool) for _ in range(args.requests)],
+        # 1/10 的 IP 持续打满限额（每个 IP 的时间戳列表保持 100 条）
+        "saturated": [rng.choice(pool[:max(1, args.ips // 10)]) for _ in range(args.requests)],
+    }
+    cases = [
+        ("timestamp lists (before)", legacy_middleware, args.requests),
+        ("token bucket memory (after)", memory_middleware, args.requests),
+        ("token bucket sqlite", sqlite_middleware, args.sqlite_requests),
+    ]
+    for workload, ips in workloads.items():
+        for label, make_middleware, requests in cases:
+            samples, rejected = asyncio.run(measure(make_middleware(), ips[:requests]))
+            common.report(f"{workload}: {label}", rejected=rejected,
+                          store_mb=store_size(make_middleware, ips[:requests]), **common.percentiles(samples))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+付款提醒扫描压测（payment_bot.process_payment_reminders）：每个规模单独建库，造 N 笔 awaiting_payment 订单
+（创建时间均匀分布在最近 --max-age-hours 小时内），提醒状态停在一分钟前的进度，只有这一分钟内跨过阈值的订单到期；
+另有 --stale 笔已完成订单的旧提醒状态待清理。比较一次扫描的耗时：
+  - JSON file (before)：重构前读整个 payment_reminders.json、扫描全部 awaiting_payment 订单、
+    清理时对每个状态重建一次订单 id 列表（O(状态数 × 订单数)），最后整文件重写
+  - reminder table (after)：当前按 next_remind_at 的范围查询，逐行条件更新
+旧实现的代价按平方增长，只在 --legacy-sizes 上运行；新实现另跑 --orders。通知凭据留空，只测扫描本身；
+两次扫描先后执行，sent 会因中间跨过阈值的订单而略有差别。
+
+    python -m bench.reminders --orders 100000 --legacy-sizes 500,1000,2000
+"""
+
+import os
+import json
+import uuid
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import payment_bot  # noqa: E402
+from database import connect  # noqa: E402
+
+REMINDERS_FILE = common.temp_path('payment_reminders.json')
+# 未配置短信凭据时每条提醒一条 WARNING
+logging.getLogger('payment_bot').setLevel(logging.ERROR)
+
+
+# 重构前 payment_bot.py 的实现（send_telegram 在未配置凭据时直接返回，这里省略；日志省略）
+def load_reminders():
+    if os.path.exists(REMINDERS_FILE):
+        with open(REMINDERS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_reminders(data):
+    with open(REMINDERS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def legacy_process_payment_reminders(db, cfg):
+    reminders = load_reminders()
+    rows = db.execute(
+        "SELECT o.*, u.phone as user_phone, u.email FROM orders o "
+        "LEFT JOIN users u ON o.user_id=u.id "
+        "WHERE o.status='awaiting_payment' ORDER BY o.created_at ASC"
+    ).fetchall()
+    changed = False
+    for row in rows:
+        order = dict(row)
+        oid = order['id']
+        created = datetime.fromisoformat(order['created_at'])
+        state = reminders.get(oid, {"level": 0, "last_sent": None})
+        current_level = state["level"]
+        if current_level >= len(payment_bot.REMINDER_SCHEDULE):
+            continue
+        hours_elapsed = (datetime.now() - created).total_seconds() / 3600
+        next_remind_at = sum(payment_bot.REMINDER_SCHEDULE[:current_level + 1])
+        if hours_elapsed >= next_remind_at:
+            level = current_level + 1
+            if order.get('user_phone'):
+                payment_bot.send_sms_reminder(cfg, order['user_phone'], oid, order['amount'], level)
+            state["level"] = level
+            state["last_sent"] = datetime.now().isoformat()
+            reminders[oid] = state
+            changed = True
+    if changed:
+        save_reminders(reminders)
+    cleanup_ids = [oid for oid in reminders if oid not in [dict(r)['id'] for r in rows]]
+    if cleanup_ids:
+        for oid in cleanup_ids:
+            completed = db.execute(
+                "SELECT status FROM orders WHERE id=?", (oid,)
+            ).fetchone()
+            if completed and completed['status'] not in ('awaiting_payment',):
+                del reminders[oid]
+                changed = True
+    if changed:
+        save_reminders(reminders)
+
+
+def level_at(age):
+    """在订单年龄 age 时已发送的提醒级数"""
+    level, threshold = 0, timedelta()
+    for hours in payment_bot.REMINDER_SCHEDULE:
+        threshold += timedelta(hours=hours)
+        if age < threshold:
+            break
+        level += 1
+    return level
+
+
+def seed(db_file, count, stale, max_age_hours):
+    """返回造数时刻；此后发送的提醒 last_sent 都晚于它"""
+    db = common.fresh_db(db_file)
+    users = common.seed_users(db, 100)
+    rng = random.Random(20)
+    now = datetime.now()
+    orders, states, levels = [], {}, []
+    for i in range(count + stale):
+        oid = str(uuid.UUID(int=rng.getrandbits(128)))
+        age = timedelta(seconds=rng.uniform(0, max_age_hours * 3600))
+        created = now - age
+        status = 'awaiting_payment' if i < count else 'completed'
+        orders.append((oid, rng.choice(users), f"33{rng.randrange(10 ** 8):08d}", 'TIM', 10, status, 1,
+                       created.isoformat()))
+        level = level_at(age - timedelta(minutes=1))
+        if level:
+            states[oid] = {"level": level, "last_sent": (now - timedelta(minutes=1)).isoformat()}
+            if status == 'awaiting_payment':
+                levels.append((level, payment_bot.next_remind_at(created, level), oid))
+    db.executemany("""
+        INSERT INTO orders (id, user_id, phone, operator, amount, status, is_credit, created_at)
+        VALUES (?,?,?,?,?,?,?,?)
+    """, orders)
+    db.executemany("UPDATE payment_reminders SET level=?, next_remind_at=? WHERE order_id=?", levels)
+    db.execute("ANALYZE")
+    db.commit()
+    db.close()
+    save_reminders(states)
+    return now.isoformat()
+
+
+def sweep(db_file, fn):
+    db = connect(db_file)
+    try:
+        samples = common.timed(lambda: fn(db, {}))
+        db.commit()
+        return samples[0]
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--legacy-sizes', default='500,1000,2000')
+    parser.add_argument('--stale', type=int, default=100, help="已完成订单残留的提醒状态数")
+    parser.add_argument('--max-age-hours', type=float, default=120)
+    args = parser.parse_args()
+    legacy_sizes = [int(n) for n in args.legacy_sizes.split(',') if n]
+    for count in sorted(set(legacy_sizes + [args.orders])):
+        db_file = common.temp_path(f'reminders-{count}.db')
+        seeded_at = seed(db_file, count, args.stale, args.max_age_hours)
+        if count in legacy_sizes:
+            file_kb = round(os.path.getsize(REMINDERS_FILE) / 1024, 1)
+            elapsed = sweep(db_file, legacy_process_payment_reminders)
+            states = load_reminders()
+            sent = sum(1 for state in states.values() if state['last_sent'] > seeded_at)
+            common.report(f"{count} orders: JSON file (before)", sent=sent, ms=round(elapsed * 1000, 1),
+                          json_kb=file_kb)
+        elapsed = sweep(db_file, payment_bot.process_payment_reminders)
+        db = connect(db_file)
+        sent = db.execute("SELECT COUNT(*) FROM payment_reminders WHERE last_sent > ?", (seeded_at,)).fetchone()[0]
+        db.close()
+        common.report(f"{count} orders: reminder table (after)", sent=sent, ms=round(elapsed * 1000, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+统计汇总表压测（stats.dashboard / stats.daily_report）：--orders 笔订单（最后一笔在今天），比较
+  - aggregate scans (before)：重构前 /api/admin/stats 和 payment_bot 每日报告的 COUNT/SUM 全表扫描
+  - rollup tables (after)：当前只读触发器维护的汇总表
+并核对两者结果一致；另测 --transitions 次单笔状态更新在有无汇总触发器时的耗时（写入端的代价），
+触发器在事务内删除、测完回滚，不影响库内容。
+
+    python -m bench.rollups --orders 1000000
+"""
+
+import random
+import argparse
+from datetime import datetime
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import stats  # noqa: E402
+from database import connect  # noqa: E402
+
+ROLLUP_TRIGGERS = ('trg_orders_rollup_insert', 'trg_orders_rollup_delete', 'trg_orders_rollup_update')
+
+
+# 重构前 admin_stats 的查询
+def legacy_dashboard(db, today):
+    total_users = db.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
+    total_orders = db.execute("SELECT COUNT(*) as c FROM orders").fetchone()['c']
+    completed = db.execute("SELECT COUNT(*) as c FROM orders WHERE status='completed'").fetchone()['c']
+    pending = db.execute("SELECT COUNT(*) as c FROM orders WHERE status IN ('pending','charged','processing')").fetchone()['c']
+    revenue = db.execute("SELECT COALESCE(SUM(amount),0) as s FROM orders WHERE status='completed'").fetchone()['s']
+    today_orders = db.execute(
+        "SELECT COUNT(*) as c FROM orders WHERE created_at LIKE ?",
+        (today + '%',)
+    ).fetchone()['c']
+    return {
+        "total_users": total_users,
+        "total_orders": total_orders,
+        "completed_orders": completed,
+        "pending_orders": pending,
+        "total_revenue": revenue,
+        "today_orders": today_orders,
+    }
+
+
+# 重构前 payment_bot.generate_daily_report 的查询
+def legacy_daily_report(db, today):
+    report = {}
+    report['total_orders'] = db.execute(
+        "SELECT COUNT(*) as c FROM orders WHERE created_at LIKE ?", (today + '%',)
+    ).fetchone()['c']
+    report['completed'] = db.execute(
+        "SELECT COUNT(*) as c FROM orders WHERE status='completed' AND updated_at LIKE ?", (today + '%',)
+    ).fetchone()['c']
+    report['awaiting_payment'] = db.execute(
+        "SELECT COUNT(*) as c FROM orders WHERE status='awaiting_payment'"
+    ).fetchone()['c']
+    report['revenue'] = db.execute(
+        "SELECT COALESCE(SUM(amount),0) as s FROM orders WHERE status='completed' AND updated_at LIKE ?",
+        (today + '%',)
+    ).fetchone()['s']
+    return report
+
+
+def transitions(db, ids, drop_triggers):
+    """在一个事务里逐笔更新订单状态，测完回滚"""
+    rng = random.Random(18)
+    db.execute("BEGIN")
+    try:
+        if drop_triggers:
+            for name in ROLLUP_TRIGGERS:
+                db.execute(f"DROP TRIGGER {name}")
+        now = datetime.now().isoformat()
+        return common.timed(lambda: db.execute(
+            "UPDATE orders SET status=?, updated_at=? WHERE id=?",
+            (rng.choice(common.STATUSES), now, rng.choice(ids))), len(ids))
+    finally:
+        db.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--transitions', type=int, default=10000)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    common.seed_orders(db, args.orders, common.seed_users(db, args.users))
+    db.execute("ANALYZE")
+    db.close()
+
+    db = connect(DB_FILE)
+    today = datetime.now().strftime('%Y-%m-%d')
+    for name, legacy, current in (("admin stats", legacy_dashboard, stats.dashboard),
+                                  ("daily report", legacy_daily_report, stats.daily_report)):
+        expected = legacy(db, today)
+        same = expected == current(db, today)
+        for label, fn in (("aggregate scans (before)", legacy), ("rollup tables (after)", current)):
+            common.report(f"{name}: {label}", same=same,
+                          **common.percentiles(common.timed(lambda: fn(db, today), args.repeat)))
+    common.report(f"daily report {today}", **expected)
+
+    ids = [r[0] for r in db.execute("SELECT id FROM orders ORDER BY random() LIMIT ?", (args.transitions,))]
+    for label, drop in (("status update, no rollup triggers", True), ("status update, rollup triggers", False)):
+        common.report(label, **common.percentiles(transitions(db, ids, drop)))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
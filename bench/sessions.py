@@ -0,0 +1,111 @@
+"""
+会话表清理压测（maintenance.purge_expired / reclaim_space）：--users 个用户各一个有效会话，
+另有 --stale 个过期会话（默认 1000 万，随机分布在这些用户上），比较清理前后
+  - session lookup：queries.SESSION_USER_SQL（每个需要登录的请求在会话缓存未命中时执行）
+  - unknown token：不存在的 token（伪造或已删除的会话）
+  - login session trim：maintenance.TRIM_USER_SESSIONS_SQL（每次登录执行；在事务中执行后回滚）
+的延迟分位数，以及清理耗时、数据库文件大小。每轮测量使用新连接。
+
+    python -m bench.sessions --stale 10000000
+"""
+
+import os
+import time
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import queries  # noqa: E402
+import maintenance  # noqa: E402
+from database import connect  # noqa: E402
+
+BATCH = 1000000
+
+
+def seed(db, users, stale):
+    ids = common.seed_users(db, users)
+    now = datetime.now()
+    rng = random.Random(22)
+    tokens = [uuid.uuid4().hex for _ in ids]
+    db.executemany("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)",
+                   [(token, user, now.isoformat(), (now + timedelta(days=30)).isoformat())
+                    for token, user in zip(tokens, ids)])
+    db.commit()
+    for start in range(0, stale, BATCH):
+        rows = []
+        for i in range(start, min(stale, start + BATCH)):
+            created = now - timedelta(days=31, seconds=rng.randrange(365 * 86400))
+            rows.append((f"stale-{i:09d}", rng.choice(ids), created.isoformat(),
+                         (created + timedelta(days=30)).isoformat()))
+        db.executemany("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)", rows)
+        db.commit()
+    db.execute("ANALYZE")
+    db.commit()
+    return list(zip(tokens, ids))
+
+
+def measure(label, sessions, samples):
+    db = connect(DB_FILE)
+    rng = random.Random(7)
+    picks = [rng.choice(sessions) for _ in range(samples)]
+    now = datetime.now().isoformat()
+    lookup = []
+    for token, _ in picks:
+        start = time.perf_counter()
+        assert db.execute(queries.SESSION_USER_SQL, (token, now)).fetchone()
+        lookup.append(time.perf_counter() - start)
+    unknown = common.timed(lambda: db.execute(queries.SESSION_USER_SQL, (uuid.uuid4().hex, now)).fetchone(),
+                           samples)
+    trim = []
+    for _, user_id in picks[:max(1, samples // 10)]:
+        db.execute("BEGIN")
+        start = time.perf_counter()
+        maintenance.trim_user_sessions(db, user_id)
+        trim.append(time.perf_counter() - start)
+        db.rollback()
+    db.close()
+    for name, values in (("session lookup", lookup), ("unknown token", unknown), ("login session trim", trim)):
+        common.report(f"{label}: {name}", **common.percentiles(values))
+
+
+def size_mb():
+    return round(sum(os.path.getsize(DB_FILE + s) for s in ('', '-wal') if os.path.exists(DB_FILE + s)) / 2 ** 20, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--stale', type=int, default=10000000)
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    start = time.perf_counter()
+    sessions = seed(db, args.users, args.stale)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+    common.report("seeded", sessions=args.users + args.stale, seconds=round(time.perf_counter() - start, 1),
+                  db_mb=size_mb())
+    measure("stale rows (before)", sessions, args.samples)
+
+    db = connect(DB_FILE)
+    start = time.perf_counter()
+    purged = maintenance.purge_expired(db, time.monotonic() + 3600)
+    purge_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    freed = maintenance.reclaim_space(db, time.monotonic() + 3600, pages=2 ** 31)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    common.report("purge", sessions=purged['sessions'], seconds=round(purge_seconds, 1),
+                  batches=-(-purged['sessions'] // maintenance.BATCH_SIZE))
+    common.report("reclaim", freed_pages=freed, seconds=round(time.perf_counter() - start, 1), db_mb=size_mb(),
+                  sessions_left=db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0])
+    db.close()
+    measure("purged (after)", sessions, args.samples)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+settings 读取压测（cache.SettingsCache）：同一进程内通过 ASGI 交替请求 /api/promotions 和 /api/online-count，
+统计每个请求触发的 settings 查询数、失效记录轮询数和 req/s。
+  - per-request query (before)：重构前每个请求查一次 settings 表
+  - snapshot cache (after)：当前的快照缓存，每 INVALIDATION_POLL 秒轮询一次失效记录
+  - snapshot cache + writes：同上，每 --write-every 个请求由管理员切换一次春节活动（写入后重新加载）
+
+    python -m bench.settings --requests 20000
+"""
+
+import time
+import asyncio
+import argparse
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import database  # noqa: E402
+
+counts = {'settings': 0, 'invalidations': 0}
+_connect = database.connect
+
+
+def traced_connect(db_file=None):
+    """统计连接上执行的 settings / cache_invalidations 读语句"""
+    conn = _connect(db_file)
+
+    def trace(sql):
+        if sql.lstrip().upper().startswith('SELECT'):
+            if 'FROM settings' in sql:
+                counts['settings'] += 1
+            elif 'cache_invalidations' in sql:
+                counts['invalidations'] += 1
+
+    conn.set_trace_callback(trace)
+    return conn
+
+
+database.connect = traced_connect
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from database import get_db  # noqa: E402
+
+
+# 重构前的路由
+@server.app.get("/bench/legacy/promotions")
+async def legacy_promotions():
+    with get_db() as db:
+        cny = db.execute("SELECT value FROM settings WHERE key='cny_active'").fetchone()
+    return {
+        "cny_active": cny['value'] == '1' if cny else False,
+        "bonuses": {"50": 20, "20": 10}
+    }
+
+
+@server.app.get("/bench/legacy/online-count")
+async def legacy_online_count():
+    with get_db() as db:
+        row = db.execute("SELECT value FROM settings WHERE key='online_count'").fetchone()
+    return {"count": int(row['value']) if row else 0}
+
+
+async def run(requests, write_every):
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.lifespan(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            r = await client.post('/api/admin/login', json={'password': common.ADMIN_PASSWORD})
+            r.raise_for_status()
+            admin = {'Authorization': 'Bearer ' + r.json()['token']}
+            cases = (("per-request query (before)", '/bench/legacy', 0),
+                     ("snapshot cache (after)", '/api', 0),
+                     ("snapshot cache + writes", '/api', write_every))
+            for label, prefix, every in cases:
+                before, writes = dict(counts), 0
+                start = time.perf_counter()
+                for i in range(requests):
+                    if every and i % every == every - 1:
+                        (await client.post('/api/admin/toggle-cny', headers=admin)).raise_for_status()
+                        writes += 1
+                    path = '/promotions' if i % 2 else '/online-count'
+                    (await client.get(prefix + path)).raise_for_status()
+                elapsed = time.perf_counter() - start
+                settings_queries = counts['settings'] - before['settings']
+                common.report(label, writes=writes, settings_queries=settings_queries,
+                              queries_per_request=round(settings_queries / requests, 4),
+                              invalidation_polls=counts['invalidations'] - before['invalidations'],
+                              req_per_s=round(requests / elapsed, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--write-every', type=int, default=1000)
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    asyncio.run(run(args.requests, args.write_every))
+
+
+if __name__ == '__main__':
+    main()
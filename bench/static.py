@@ -0,0 +1,108 @@
+"""
+首页传输量与吞吐压测（static.py）：同一进程内通过 ASGI 访问首页 + style.css + app.js，
+统计首次访问和再次访问（浏览器带 If-None-Match、指纹 URL 走本地缓存）传输的响应体字节数，以及首页 req/s。
+  - per-request file read (before)：重构前每次读文件、不压缩、不做条件请求
+  - in-memory precompressed (after)：当前的内存缓存 + 预压缩 + ETag / immutable 指纹 URL
+
+    python -m bench.static --requests 2000
+"""
+
+import os
+import re
+import time
+import asyncio
+import argparse
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import httpx  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from fastapi.responses import HTMLResponse, FileResponse  # noqa: E402
+
+import server  # noqa: E402
+
+ACCEPT = {'Accept-Encoding': 'gzip, deflate, br'}
+
+
+# 重构前的页面和静态资源路由
+@server.app.get("/bench/legacy/", response_class=HTMLResponse)
+async def legacy_index():
+    f = os.path.join(server.BASE_DIR, "index.html")
+    if os.path.exists(f):
+        return HTMLResponse(open(f, encoding='utf-8').read())
+    return HTMLResponse("<h1>VeloceVoce</h1>")
+
+
+@server.app.get("/bench/legacy/app.js")
+async def legacy_appjs():
+    f = os.path.join(server.BASE_DIR, "app.js")
+    if os.path.exists(f):
+        return FileResponse(f, media_type="application/javascript")
+    raise HTTPException(404)
+
+
+@server.app.get("/bench/legacy/style.css")
+async def legacy_css():
+    f = os.path.join(server.BASE_DIR, "style.css")
+    if os.path.exists(f):
+        return FileResponse(f, media_type="text/css")
+    raise HTTPException(404)
+
+
+async def visit(client, page, cache):
+    """模拟浏览器访问一次页面；cache 保存上次的 ETag 和 immutable 资源，返回传输的响应体字节数"""
+    downloaded = 0
+
+    async def fetch(url):
+        nonlocal downloaded
+        entry = cache.get(url)
+        if entry and 'immutable' in entry.get('cache-control', ''):
+            return entry['body']
+        headers = dict(ACCEPT)
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        r = await client.get(url, headers=headers)
+        downloaded += r.num_bytes_downloaded
+        if r.status_code == 304:
+            return entry['body']
+        r.raise_for_status()
+        cache[url] = {'etag': r.headers.get('etag'), 'cache-control': r.headers.get('cache-control', ''),
+                      'body': r.text}
+        return r.text
+
+    html = await fetch(page)
+    base = page.rsplit('/', 1)[0]
+    for asset in re.findall(r'(?:href|src)="(/(?:style\.css|app\.js)[^"]*)"', html):
+        await fetch(base + asset if base else asset)
+    return downloaded
+
+
+async def run(requests):
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.lifespan(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for label, page in (("per-request file read (before)", '/bench/legacy/'),
+                                ("in-memory precompressed (after)", '/')):
+                cache = {}
+                first = await visit(client, page, cache)
+                repeat = await visit(client, page, cache)
+                start = time.perf_counter()
+                for _ in range(requests):
+                    (await client.get(page, headers=ACCEPT)).raise_for_status()
+                elapsed = time.perf_counter() - start
+                common.report(label, first_visit_bytes=first, repeat_visit_bytes=repeat,
+                              index_req_per_s=round(requests / elapsed, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    common.fresh_db(DB_FILE).close()
+    asyncio.run(run(args.requests))
+
+
+if __name__ == '__main__':
+    main()
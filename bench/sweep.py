@@ -0,0 +1,97 @@
+"""
+调度扫描压测（dispatcher.process_charged_orders / release_holding_orders）：
+50k 笔 charged 订单 + 一批 holding 订单，比较重构前的逐行 UPDATE + 逐行提交（holding 每单一次 COUNT）
+与当前的集合式 UPDATE … RETURNING 单事务。提交次数用 trace 回调统计：每次 COMMIT 都是一次 WAL 写入，
+synchronous=FULL 或 rollback 日志下就是一次 fsync。
+
+    python -m bench.sweep --orders 50000
+"""
+
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+import dispatcher  # noqa: E402
+from database import connect  # noqa: E402
+
+
+def legacy_process_charged(db):
+    rows = db.execute("SELECT * FROM orders WHERE status='charged' ORDER BY created_at ASC").fetchall()
+    for row in rows:
+        status = 'awaiting_payment' if row['is_credit'] else 'processing'
+        db.execute("UPDATE orders SET status=?, updated_at=? WHERE id=?", (status, datetime.now().isoformat(), row['id']))
+        db.commit()
+
+
+def legacy_release_holding(db):
+    for row in db.execute("SELECT * FROM orders WHERE status='holding' ORDER BY created_at ASC").fetchall():
+        in_progress = db.execute(
+            "SELECT COUNT(*) as c FROM orders WHERE user_id=? AND status IN ('processing','paying') AND id!=?",
+            (row['user_id'], row['id'])
+        ).fetchone()['c']
+        if in_progress == 0:
+            db.execute("UPDATE orders SET status='processing', updated_at=? WHERE id=?",
+                       (datetime.now().isoformat(), row['id']))
+            db.commit()
+
+
+def seed(db, orders, users):
+    ids = common.seed_users(db, users)
+    buyers, waiting = ids[:users // 2], ids[users // 2:]
+    common.seed_orders(db, orders, buyers, statuses=['charged'] * 9 + ['completed'])
+    db.execute("UPDATE orders SET is_credit = 1 WHERE rowid % 5 = 0")
+    # 另一半用户每人约两笔 holding，其中一半用户已有充值中的订单，不能放行
+    common.seed_orders(db, len(waiting) * 2, waiting, statuses=['holding'], seed=2)
+    common.seed_orders(db, len(waiting) // 2, waiting[:len(waiting) // 2], statuses=['paying'], seed=3)
+    db.commit()
+
+
+def run(path, charged, holding):
+    db = connect(path)
+    commits = []
+    db.set_trace_callback(lambda sql: sql == 'COMMIT' and commits.append(1))
+    start = time.perf_counter()
+    charged(db)
+    middle = time.perf_counter()
+    holding(db)
+    db.commit()
+    end = time.perf_counter()
+    db.set_trace_callback(None)
+    state = dict(db.execute("SELECT status, COUNT(*) FROM orders GROUP BY status").fetchall())
+    db.close()
+    return middle - start, end - middle, len(commits), state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=50000, help="charged 订单数")
+    parser.add_argument('--users', type=int, default=5000)
+    args = parser.parse_args()
+    db = common.fresh_db(DB_FILE)
+    seed(db, args.orders, args.users)
+    copies = {}
+    for name in ('before', 'after'):
+        copies[name] = common.temp_path(f"{name}.db")
+        with sqlite3.connect(copies[name]) as target:
+            db.backup(target)
+    db.close()
+
+    results = {
+        "row-by-row (before)": run(copies['before'], legacy_process_charged, legacy_release_holding),
+        "set-based (after)": run(copies['after'], lambda d: dispatcher.process_charged_orders(d, {}),
+                                 lambda d: dispatcher.release_holding_orders(d, {})),
+    }
+    for label, (charged_s, holding_s, commits, state) in results.items():
+        common.report(label, charged_ms=round(charged_s * 1000, 1), holding_ms=round(holding_s * 1000, 1),
+                      commits=commits)
+    states = [r[3] for r in results.values()]
+    common.report("same final state", ok=states[0] == states[1], statuses=states[1])
+
+
+if __name__ == '__main__':
+    main()
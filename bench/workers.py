@@ -0,0 +1,91 @@
+"""
+多 worker 扩展压测（server.py --workers N）：每个 worker 数启动一次服务，
+--clients 个压测进程（各 --concurrency 个并发连接）发混合流量，测总 req/s 和延迟分位数。
+流量构成：订单列表 40%、/api/me 30%、首页 20%、下单 10%。
+压测进程与服务共用 CPU，核数少的机器上扩展比例会被压测端拉低。
+
+    python -m bench.workers --workers 1,2,4 --seconds 10
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import multiprocessing
+
+import httpx
+
+from bench import common
+
+DB_FILE = common.use_temp_db()
+
+MIX = [('GET', '/api/orders', 40), ('GET', '/api/me', 30), ('GET', '/', 20), ('POST', '/api/orders', 10)]
+
+
+def load_client(base, headers, seconds, concurrency, seed, results):
+    async def run():
+        samples, errors = [], 0
+        deadline = time.monotonic() + seconds
+        rng = random.Random(seed)
+        routes = [(method, path) for method, path, weight in MIX for _ in range(weight)]
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base, headers=headers, limits=limits, timeout=30) as client:
+            async def worker():
+                nonlocal errors
+                while time.monotonic() < deadline:
+                    method, path = rng.choice(routes)
+                    start = time.perf_counter()
+                    if method == 'POST':
+                        r = await client.post(path, json=common.ORDER)
+                    else:
+                        r = await client.get(path)
+                    samples.append(time.perf_counter() - start)
+                    errors += r.status_code >= 400
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, errors
+
+    results.put(asyncio.run(run()))
+
+
+def run_workers(workers, args):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DB_FILE + suffix):
+            os.remove(DB_FILE + suffix)
+    server = common.Server(workers)
+    try:
+        with httpx.Client(base_url=server.base) as client:
+            headers = common.register(client)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=load_client,
+                                         args=(server.base, headers, args.seconds, args.concurrency, n, results))
+                 for n in range(args.clients)]
+        for p in procs:
+            p.start()
+        collected = [results.get(timeout=args.seconds + 120) for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        server.stop()
+    samples = [s for part, _ in collected for s in part]
+    errors = sum(e for _, e in collected)
+    return len(samples) / args.seconds, errors, common.percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=2, help="压测进程数")
+    parser.add_argument('--concurrency', type=int, default=16, help="每个压测进程的并发连接数")
+    args = parser.parse_args()
+    baseline = None
+    for workers in (int(n) for n in args.workers.split(',')):
+        rps, errors, stats = run_workers(workers, args)
+        baseline = baseline or rps
+        common.report(f"{workers} worker(s)", req_per_s=round(rps, 1), speedup=round(rps / baseline, 2),
+                      errors=errors, **stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+VeloceVoce 惟落雀 - 进程内缓存
+  - TTLCache：带过期时间的 LRU 缓存，统计命中/未命中
+  - 失效日志：写入方在 cache_invalidations 表登记变更，
+    各进程按固定间隔拉取新记录，保证多进程（多 worker + 机器人）下的缓存在有限延迟内失效
+  - SettingsCache：settings 表的类型化快照，通过失效日志在各进程间同步
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 每次删除都会递增；读库前记下 generation，写回时若已变化说明期间发生过失效，放弃写回
+        self.generation = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires = item
+            if expires <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self.generation += 1
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def remove_where(self, predicate):
+        """删除 value 满足条件的所有条目（用于按用户失效，条目数受 maxsize 限制）"""
+        with self._lock:
+            self.generation += 1
+            keys = [k for k, (v, _) in self._data.items() if predicate(v)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# ====== 跨进程失效 ======
+
+def publish_invalidation(db, kind, key=""):
+    """在当前事务中登记一条失效记录，随事务一起提交"""
+    db.execute(
+        "INSERT INTO cache_invalidations (kind, key, created_at) VALUES (?,?,?)",
+        (kind, key, datetime.now().isoformat())
+    )
+
+
+class InvalidationListener:
+    """按 interval 秒拉取 cache_invalidations 新记录并分发给对应 kind 的处理函数"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._handlers = {}
+        self._last_id = None
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+
+    def subscribe(self, kind, handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def due(self):
+        return time.monotonic() >= self._next_poll
+
+    def poll(self, db, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return
+        with self._lock:
+            if not force and now < self._next_poll:
+                return
+            self._next_poll = now + self.interval
+            if self._last_id is None:
+                # 进程启动前的记录与本进程缓存无关
+                row = db.execute("SELECT COALESCE(MAX(id), 0) FROM cache_invalidations").fetchone()
+                self._last_id = row[0]
+                return
+            rows = db.execute(
+                "SELECT id, kind, key FROM cache_invalidations WHERE id > ? ORDER BY id",
+                (self._last_id,)
+            ).fetchall()
+            if rows:
+                self._last_id = rows[-1][0]
+        for _, kind, key in rows:
+            for handler in self._handlers.get(kind, ()):
+                handler(key)
+
+
+class SettingsCache:
+    """settings 表的类型化快照。
+    schema: {key: (类型, 默认值)}；写入走 set()，同时登记 'settings' 失效记录，
+    其他进程在下一次 poll（最多 listener.interval 秒）后重新加载。
+    失效只把快照标记为过期，重新加载完成前 get() 继续返回上一份快照，不会退回 schema 默认值"""
+
+    def __init__(self, schema, listener):
+        self.schema = schema
+        self.listener = listener
+        self._values = None
+        self._stale = True
+        # 每次失效递增；加载期间发生失效时，加载结果照常使用但仍保持过期
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        listener.subscribe('settings', self._mark_stale)
+
+    def _mark_stale(self, key=""):
+        with self._lock:
+            self._generation += 1
+            self._stale = True
+
+    def _parse(self, key, raw):
+        kind, default = self.schema[key]
+        if raw is None:
+            return default
+        if kind is bool:
+            return raw == '1'
+        try:
+            return kind(raw)
+        except ValueError:
+            return default
+
+    def _load(self, db):
+        generation = self._generation
+        rows = dict(db.execute("SELECT key, value FROM settings").fetchall())
+        values = {key: self._parse(key, rows.get(key)) for key in self.schema}
+        with self._lock:
+            self._values = values
+            if generation == self._generation:
+                self._stale = False
+            self.loads += 1
+
+    def needs_refresh(self):
+        return self._stale or self.listener.due()
+
+    def refresh(self, db):
+        self.listener.poll(db)
+        if self._stale:
+            self._load(db)
+
+    def get(self, key):
+        values = self._values
+        if values is None:
+            raise RuntimeError("settings 尚未加载，先调用 refresh()")
+        return values[key]
+
+    def set(self, db, key, value):
+        """写入并提交当前事务，提交后才让本进程的快照过期：
+        提交前失效的话，其他线程可能把旧值重新加载为最新快照"""
+        kind, _ = self.schema[key]
+        raw = ('1' if value else '0') if kind is bool else str(value)
+        db.execute("INSERT INTO settings (key, value) VALUES (?, ?) "
+                   "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, raw))
+        publish_invalidation(db, 'settings', key)
+        db.commit()
+        self._mark_stale()
+
+    def stats(self):
+        return {"loaded": self._values is not None, "stale": self._stale, "loads": self.loads}
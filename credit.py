@@ -0,0 +1,225 @@
+"""
+VeloceVoce 惟落雀 - 信用积分
+  - 每笔完成订单追加一条 credit_events 记录（只增不改，order_id 唯一，同一订单只计一次分），
+    并在同一事务中增量更新 users 上的积分状态
+  - 等级查找用 bisect，按 min_score 二分
+  - 规则调整后用 recompute_all 从 credit_baseline（账本启用前的状态）+ credit_events
+    一条聚合 SQL 批量重算所有用户，不逐个用户在 Python 中回放
+
+积分规则（与原 update_credit_score 一致）：
+  - 订单金额 ≥30 得 20 分，≥15 得 10 分，其余 5 分；信用订单额外 +15
+  - 每累计 3 笔成功订单额外 +30
+  - 累计消费首次达到 €100 / €300 时各奖励 50 / 100 分
+
+命令行：
+  python credit.py check        # 对比 users 上的积分状态与账本重算结果，列出不一致（只读；库未迁移到最新版本时报错退出）
+  python credit.py recompute    # 先执行迁移，再按当前规则从账本重算所有用户
+"""
+
+import sys
+import logging
+from bisect import bisect_right
+from datetime import datetime
+
+from database import get_db
+from migrations import migrate, schema_ready, current_version, LATEST_VERSION
+from cache import publish_invalidation
+
+logger = logging.getLogger('credit')
+
+CREDIT_LEVELS = [
+    {"name": "新手", "icon": "🌱", "min_score": 0,   "credit_limit": 10,  "discount": 1.0, "bonus": 0},
+    {"name": "铜牌", "icon": "🥉", "min_score": 50,  "credit_limit": 15,  "discount": 1.0, "bonus": 0},
+    {"name": "银牌", "icon": "🥈", "min_score": 150, "credit_limit": 25,  "discount": 1.0, "bonus": 5},
+    {"name": "金牌", "icon": "🥇", "min_score": 300, "credit_limit": 50,  "discount": 0.9, "bonus": 0},
+    {"name": "钻石", "icon": "💎", "min_score": 500, "credit_limit": 100, "discount": 0.8, "bonus": 10},
+]
+_LEVEL_MINS = [lv["min_score"] for lv in CREDIT_LEVELS]
+
+# (金额下限, 积分)，从高到低
+AMOUNT_POINTS = ((30, 20), (15, 10), (0, 5))
+CREDIT_ORDER_POINTS = 15
+STREAK_EVERY = 3
+STREAK_POINTS = 30
+MILESTONES = ((100, 50), (300, 100))
+
+STATE_COLUMNS = ('credit_score', 'total_spent', 'consecutive_success', 'milestone_100', 'milestone_300')
+
+
+def get_credit_level(score):
+    i = bisect_right(_LEVEL_MINS, score)
+    return CREDIT_LEVELS[i - 1] if i else CREDIT_LEVELS[0]
+
+
+def get_next_level(score):
+    i = bisect_right(_LEVEL_MINS, score)
+    return CREDIT_LEVELS[i] if i < len(CREDIT_LEVELS) else None
+
+
+def order_points(amount, is_credit):
+    for threshold, points in AMOUNT_POINTS:
+        if amount >= threshold:
+            break
+    return points + (CREDIT_ORDER_POINTS if is_credit else 0)
+
+
+def apply_event(state, amount, is_credit):
+    """state 为 STATE_COLUMNS 顺序的元组；返回 (新状态, 本次加分, 触发的奖励说明列表)"""
+    score, total, streak, m100, m300 = state
+    points = order_points(amount, is_credit)
+    notes = []
+    streak += 1
+    if streak % STREAK_EVERY == 0:
+        points += STREAK_POINTS
+        notes.append(f"streak={streak} bonus +{STREAK_POINTS}")
+    score += points
+    total += amount
+    flags = [m100, m300]
+    for i, (threshold, bonus) in enumerate(MILESTONES):
+        if total >= threshold and not flags[i]:
+            score += bonus
+            flags[i] = 1
+            notes.append(f"milestone {threshold}€ bonus +{bonus}")
+    return (score, total, streak, flags[0], flags[1]), points, notes
+
+
+def load_state(db, user_id):
+    row = db.execute(f"SELECT {', '.join(STATE_COLUMNS)} FROM users WHERE id = ?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    return tuple(row[col] or 0 for col in STATE_COLUMNS)
+
+
+def record_order(db, user_id, order_id, amount, is_credit):
+    """记录一笔完成订单并增量更新积分；用户不存在或该订单已计过分时返回 None。由调用方提交和失效缓存"""
+    state = load_state(db, user_id)
+    if state is None:
+        return None
+    new_state, points, notes = apply_event(state, amount, is_credit)
+    inserted = db.execute("""
+        INSERT OR IGNORE INTO credit_events (user_id, order_id, amount, is_credit, points, created_at)
+        VALUES (?,?,?,?,?,?)
+    """, (user_id, order_id, amount, int(bool(is_credit)), points, datetime.now().isoformat())).rowcount
+    if not inserted:
+        logger.info(f"[CREDIT] user={user_id} order={order_id[:8]} already scored, skipped")
+        return None
+    old_level = get_credit_level(state[0])
+    new_level = get_credit_level(new_state[0])
+    db.execute(f"""
+        UPDATE users SET {', '.join(f'{col} = ?' for col in STATE_COLUMNS)}, credit_level = ?, credit_amount = ?
+        WHERE id = ?
+    """, (*new_state, new_level["name"], new_level["credit_limit"], user_id))
+    for note in notes:
+        logger.info(f"[CREDIT] user={user_id} {note}")
+    if new_level["name"] != old_level["name"] and new_level["bonus"] > 0:
+        logger.info(f"[CREDIT] user={user_id} LEVEL UP: {old_level['name']} → {new_level['name']}, bonus €{new_level['bonus']}")
+    logger.info(f"[CREDIT] user={user_id} +{points}pts, total={new_state[0]}, level={new_level['name']}")
+    return {"points_added": points, "new_score": new_state[0], "new_level": new_level}
+
+
+def _case(expr, field):
+    """按等级表生成 CASE 表达式，取 expr 分数对应等级的 field"""
+    whens = ' '.join(f"WHEN {expr} >= {lv['min_score']} THEN {lv[field]!r}" for lv in reversed(CREDIT_LEVELS))
+    return f"CASE {whens} ELSE {CREDIT_LEVELS[0][field]!r} END"
+
+
+def _points_sql():
+    amount = ' '.join(f"WHEN amount >= {t} THEN {p}" for t, p in AMOUNT_POINTS[:-1])
+    return f"CASE {amount} ELSE {AMOUNT_POINTS[-1][1]} END + is_credit * {CREDIT_ORDER_POINTS}"
+
+
+def _milestone_sql(i):
+    threshold, bonus = MILESTONES[i]
+    flag = f"x.b_m{i}"
+    reached = f"x.b_total + x.total >= {threshold}"
+    return f"MAX({flag}, {reached})", f"(CASE WHEN {flag} = 0 AND {reached} THEN {bonus} ELSE 0 END)"
+
+
+def recomputed_sql():
+    """每个有账本记录的用户按当前规则重算出的状态：(user_id, STATE_COLUMNS...)。
+    连胜只增不减、累计消费单调递增，所以整段历史可以直接聚合，不需要逐条回放"""
+    m100, m100_bonus = _milestone_sql(0)
+    m300, m300_bonus = _milestone_sql(1)
+    streak_bonus = f"((x.b_streak + x.n) / {STREAK_EVERY} - x.b_streak / {STREAK_EVERY}) * {STREAK_POINTS}"
+    return f"""
+        SELECT x.user_id,
+               x.b_score + x.points + {streak_bonus} + {m100_bonus} + {m300_bonus} AS credit_score,
+               x.b_total + x.total AS total_spent,
+               x.b_streak + x.n AS consecutive_success,
+               {m100} AS milestone_100,
+               {m300} AS milestone_300
+        FROM (
+            SELECT e.*,
+                   COALESCE(c.score, 0) AS b_score, COALESCE(c.total_spent, 0) AS b_total,
+                   COALESCE(c.streak, 0) AS b_streak,
+                   COALESCE(c.milestone_100, 0) AS b_m0, COALESCE(c.milestone_300, 0) AS b_m1
+            FROM (
+                SELECT user_id, COUNT(*) AS n, SUM(amount) AS total, SUM({_points_sql()}) AS points
+                FROM credit_events GROUP BY user_id
+            ) e LEFT JOIN credit_baseline c ON c.user_id = e.user_id
+        ) x
+    """
+
+
+def recompute_all(db):
+    """规则调整后按账本重算所有用户的积分、等级和额度，返回被更新的用户数；由调用方提交"""
+    db.execute("DROP TABLE IF EXISTS temp.credit_recomputed")
+    db.execute(f"CREATE TEMP TABLE credit_recomputed AS {recomputed_sql()}")
+    sets = ', '.join(f"{col} = r.{col}" for col in STATE_COLUMNS)
+    updated = db.execute(f"""
+        UPDATE users SET {sets},
+            credit_level = {_case('r.credit_score', 'name')},
+            credit_amount = {_case('r.credit_score', 'credit_limit')}
+        FROM temp.credit_recomputed r
+        WHERE users.id = r.user_id
+          AND ((users.credit_score, users.total_spent, users.consecutive_success,
+                users.milestone_100, users.milestone_300)
+               IS NOT (r.credit_score, r.total_spent, r.consecutive_success, r.milestone_100, r.milestone_300)
+               OR users.credit_level IS NOT {_case('r.credit_score', 'name')})
+    """).rowcount
+    db.execute("DROP TABLE temp.credit_recomputed")
+    return updated
+
+
+def check_all(db):
+    """返回 [(user_id, 存储状态, 重算状态)]"""
+    problems = []
+    for row in db.execute(f"""
+        SELECT r.*, {', '.join(f'u.{col} AS u_{col}' for col in STATE_COLUMNS)}
+        FROM ({recomputed_sql()}) r JOIN users u ON u.id = r.user_id
+    """):
+        stored = tuple(row[f'u_{col}'] or 0 for col in STATE_COLUMNS)
+        expected = tuple(row[col] for col in STATE_COLUMNS)
+        if stored != expected:
+            problems.append((row['user_id'], stored, expected))
+    return problems
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    command = argv[1] if len(argv) > 1 else 'check'
+    with get_db() as db:
+        if command == 'recompute':
+            migrate(db)
+            db.execute("BEGIN IMMEDIATE")
+            updated = recompute_all(db)
+            # 会话缓存中的用户行全部作废
+            publish_invalidation(db, 'user', '*')
+            logger.info(f"[CREDIT] recomputed, {updated} users changed")
+            return 0
+        if command == 'check':
+            if not schema_ready(db):
+                logger.error(f"[CREDIT] schema version {current_version(db)} < {LATEST_VERSION}, "
+                             f"run migrations (or `python credit.py recompute`) first")
+                return 2
+            problems = check_all(db)
+            for user_id, stored, expected in problems[:100]:
+                logger.warning(f"[CREDIT] {user_id}: stored={stored} ledger={expected}")
+            logger.info(f"[CREDIT] {len(problems)} mismatches")
+            return 1 if problems else 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
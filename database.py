@@ -0,0 +1,237 @@
+"""
+VeloceVoce 惟落雀 - 数据库连接层
+server.py / dispatcher.py / order_bot.py / payment_bot.py 共用：
+  - 进程内有界连接池（复用连接，避免每次请求/轮询重新打开数据库）
+  - WAL 日志模式，读写互不阻塞
+  - 调优 PRAGMA：synchronous / busy_timeout / cache_size / mmap_size
+  - 每个连接自带预编译语句缓存（sqlite3 cached_statements）
+  - 供 async 路由使用的专用数据库线程池（超时 + 队列深度统计）
+"""
+
+import os
+import queue
+import asyncio
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger('database')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.environ.get("RECHARGE_DB_FILE", os.path.join(BASE_DIR, "recharge.db"))
+
+POOL_SIZE = int(os.environ.get("RECHARGE_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = 10          # 等待空闲连接的最长秒数
+BUSY_TIMEOUT_MS = 5000     # 写锁冲突时的等待时间
+CACHE_SIZE_KB = 16384      # 每连接页缓存 16MB
+MMAP_SIZE = 128 * 1024 * 1024
+STATEMENT_CACHE = 256      # 每连接预编译语句缓存条数
+
+PRAGMAS = [
+    # 只对尚未建表的新库生效；旧库用 python maintenance.py vacuum 切换
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size={MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+]
+
+
+def connect(db_file=None):
+    """打开一个已应用调优 PRAGMA 的新连接"""
+    conn = sqlite3.connect(
+        db_file or DB_FILE,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """有界连接池：最多 size 个连接，用完归还，空闲连接后进先出复用"""
+
+    def __init__(self, db_file=None, size=POOL_SIZE):
+        self.db_file = db_file or DB_FILE
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.created = 0
+
+    def _check_fork(self):
+        # fork 之后父进程的连接不能在子进程中继续使用
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def acquire(self, timeout=POOL_TIMEOUT):
+        self._check_fork()
+        if not self._slots.acquire(timeout=timeout):
+            raise sqlite3.OperationalError("数据库连接池已满，请稍后再试")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = connect(self.db_file)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        if self._pid != os.getpid():
+            return
+        if discard:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        return {"size": self.size, "idle": self._idle.qsize(), "created": self.created}
+
+
+_pool = ConnectionPool()
+
+
+def get_pool():
+    return _pool
+
+
+@contextmanager
+def get_db():
+    """从连接池借出连接；正常退出时提交，异常时回滚，最后归还连接"""
+    conn = _pool.acquire()
+    discard = False
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        raise
+    finally:
+        _pool.release(conn, discard)
+
+
+# ====== 事件循环外执行 ======
+# server.py 的路由是 async 的，同步 sqlite3 调用必须放到专用线程池中执行，
+# 线程数与连接池大小一致，保证每个工作线程都能拿到连接。
+
+class DBTimeout(Exception):
+    pass
+
+
+class DBExecutor:
+    def __init__(self, workers=POOL_SIZE):
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='db')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, task, fn, args):
+        with self._lock:
+            if task["abandoned"]:
+                return None
+            task["started"] = True
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    async def submit(self, fn, *args, timeout=None, label=None):
+        task = {"started": False, "abandoned": False}
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(), self._run, task, fn, args)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+                # 还在排队的任务直接放弃；已开始执行的只能等它自己结束
+                if not task["started"]:
+                    task["abandoned"] = True
+                    self.queued -= 1
+            raise DBTimeout(f"{label or getattr(fn, '__qualname__', fn)} timed out after {timeout}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "active": self.active,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+            }
+
+
+_executor = DBExecutor()
+
+
+def _with_db(fn, *args):
+    with get_db() as db:
+        return fn(db, *args)
+
+
+async def run_blocking(fn, *args, timeout=None):
+    """在数据库线程池中执行任意阻塞函数"""
+    return await _executor.submit(fn, *args, timeout=timeout)
+
+
+async def run_db(fn, *args, timeout=None):
+    """借出连接并在数据库线程池中执行 fn(db, *args)，事务语义与 get_db() 相同"""
+    label = getattr(fn, '__qualname__', None)
+    return await _executor.submit(_with_db, fn, *args, timeout=timeout, label=label)
+
+
+def db_stats():
+    return {"pool": _pool.stats(), "executor": _executor.stats()}
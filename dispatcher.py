@@ -4,17 +4,27 @@ VeloceVoce 惟落雀 - 订单调度器
   charged → awaiting_payment (信用) 或 processing (标准)
   holding → processing (前序订单完成后释放)
   processing 超时预警
-  paying 状态监控
+  paying 状态监控，回收租约过期（worker 崩溃）的 paying 订单；已发起支付的不退回队列，告警转人工核对
+  后台线程每 MAINTENANCE_INTERVAL 秒清理过期会话/验证码并回收空间（maintenance.py），不阻塞主循环
+由 order_events 发件箱 + 本地 UDP 唤醒驱动，新订单立即推进；
+每 reconcile_interval 秒做一次完整对账扫描，兜底处理丢失的唤醒。
 """
 
 import time
 import json
-import sqlite3
 import logging
 import os
-import urllib.request
+import asyncio
+import threading
 from datetime import datetime, timedelta
 
+from database import get_db
+from events import (EventWaiter, publish_order_events, fetch_order_events,
+                    latest_event_id, purge_order_events)
+from order_queue import reclaim_expired_leases, hold_paid_expired_leases, make_worker_id
+from notify import NotificationService, enqueue_alert, channel_credentials, purge_notifications
+from maintenance import start_background as start_maintenance
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s'
@@ -22,7 +32,6 @@ logging.basicConfig(
 logger = logging.getLogger('dispatcher')
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, 'recharge.db')
 CONFIG_FILE = os.path.join(BASE_DIR, 'bot_config.json')
 
 def load_config():
@@ -31,145 +40,147 @@ def load_config():
             return json.load(f)
     return {}
 
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def send_pushplus(token, title, content, topic=""):
-    if not token:
-        return
-    try:
-        data = json.dumps({
-            "token": token,
-            "title": title,
-            "content": content,
-            "topic": topic,
-            "template": "html"
-        }).encode('utf-8')
-        req = urllib.request.Request(
-            "http://www.pushplus.plus/send",
-            data=data,
-            headers={"Content-Type": "application/json"}
-        )
-        urllib.request.urlopen(req, timeout=5)
-    except Exception as e:
-        logger.error(f"[PUSHPLUS] {e}")
+def start_notification_service(cfg):
+    """在后台线程中运行通知投递服务（Telegram + PushPlus）"""
+    service = NotificationService(channel_credentials(cfg), make_worker_id('dispatcher'))
+    thread = threading.Thread(target=asyncio.run, args=(service.run_forever(),),
+                              name='notify', daemon=True)
+    thread.start()
+    return service
 
-def send_telegram(token, chat_id, msg):
-    if not token or not chat_id:
-        return
-    try:
-        data = json.dumps({
-            "chat_id": chat_id,
-            "text": msg,
-            "parse_mode": "HTML"
-        }).encode('utf-8')
-        req = urllib.request.Request(
-            f"https://api.telegram.org/bot{token}/sendMessage",
-            data=data,
-            headers={"Content-Type": "application/json"}
-        )
-        urllib.request.urlopen(req, timeout=5)
-    except Exception as e:
-        logger.error(f"[TELEGRAM] {e}")
+# 调度 SQL（tests/test_query_plans.py 检查其执行计划）
+PROCESS_CHARGED_SQL = """
+    UPDATE orders
+    SET status = CASE WHEN is_credit THEN 'awaiting_payment' ELSE 'processing' END,
+        updated_at = ?
+    WHERE status = 'charged'
+    RETURNING id, status, created_at
+"""
+RELEASE_HOLDING_SQL = """
+    UPDATE orders
+    SET status = 'processing', updated_at = ?
+    WHERE id IN (
+        SELECT h.id FROM (
+            SELECT id, user_id,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at, id) AS rn
+            FROM orders WHERE status = 'holding'
+        ) h
+        WHERE h.rn = 1
+          AND NOT EXISTS (
+              SELECT 1 FROM orders p
+              WHERE p.user_id = h.user_id AND p.status IN ('processing', 'paying')
+          )
+    )
+    RETURNING id
+"""
+STALE_STATUS_SQL = "SELECT * FROM orders WHERE status=? AND (updated_at < ? OR (updated_at='' AND created_at < ?))"
 
 def process_charged_orders(db, cfg):
-    """将 charged 状态的订单推进到下一步"""
-    rows = db.execute(
-        "SELECT * FROM orders WHERE status='charged' ORDER BY created_at ASC"
-    ).fetchall()
+    """将 charged 状态的订单推进到下一步（单条 UPDATE，单次提交）
+    信用订单 → awaiting_payment，标准订单 → processing
+    返回被推进的订单 ID 列表"""
+    now = datetime.now()
+    rows = db.execute(PROCESS_CHARGED_SQL, (now.isoformat(),)).fetchall()
+    if not rows:
+        return []
+    publish_order_events(db, [(row['id'], row['status']) for row in rows])
+    db.commit()
     for row in rows:
-        order = dict(row)
-        now = datetime.now().isoformat()
-        if order.get('is_credit'):
-            # 信用订单 → 等待付款
-            db.execute(
-                "UPDATE orders SET status='awaiting_payment', updated_at=? WHERE id=?",
-                (now, order['id'])
-            )
-            logger.info(f"[DISPATCH] {order['id'][:8]} charged → awaiting_payment (credit)")
-        else:
-            # 标准订单 → 检查是否有前序 holding 订单
-            db.execute(
-                "UPDATE orders SET status='processing', updated_at=? WHERE id=?",
-                (now, order['id'])
-            )
-            logger.info(f"[DISPATCH] {order['id'][:8]} charged → processing")
-        db.commit()
+        latency = (now - datetime.fromisoformat(row['created_at'])).total_seconds()
+        logger.info(f"[DISPATCH] {row['id'][:8]} charged → {row['status']} latency={latency:.3f}s")
+    return [row['id'] for row in rows]
 
 def release_holding_orders(db, cfg):
-    """将 holding 状态的订单释放为 processing（当前序订单完成后）"""
-    holding = db.execute(
-        "SELECT * FROM orders WHERE status='holding' ORDER BY created_at ASC"
-    ).fetchall()
-    for row in holding:
-        order = dict(row)
-        user_id = order['user_id']
-        # 检查该用户是否有进行中的 processing 订单
-        in_progress = db.execute(
-            "SELECT COUNT(*) as c FROM orders WHERE user_id=? AND status IN ('processing','paying') AND id!=?",
-            (user_id, order['id'])
-        ).fetchone()['c']
-        if in_progress == 0:
-            now = datetime.now().isoformat()
-            db.execute(
-                "UPDATE orders SET status='processing', updated_at=? WHERE id=?",
-                (now, order['id'])
-            )
-            db.commit()
-            logger.info(f"[DISPATCH] {order['id'][:8]} holding → processing (slot available)")
+    """将 holding 状态的订单释放为 processing（当前序订单完成后）
+    每个用户同一时间只放行一单：该用户没有 processing/paying 订单时，释放其最早的 holding 订单
+    返回被释放的订单 ID 列表"""
+    now = datetime.now().isoformat()
+    rows = db.execute(RELEASE_HOLDING_SQL, (now,)).fetchall()
+    if not rows:
+        return []
+    ids = [row['id'] for row in rows]
+    publish_order_events(db, [(order_id, 'processing') for order_id in ids])
+    db.commit()
+    for order_id in ids:
+        logger.info(f"[DISPATCH] {order_id[:8]} holding → processing (slot available)")
+    return ids
 
 def check_processing_timeout(db, cfg, timeout_minutes=30):
     """检查 processing 超时订单"""
     threshold = (datetime.now() - timedelta(minutes=timeout_minutes)).isoformat()
-    rows = db.execute(
-        "SELECT * FROM orders WHERE status='processing' AND (updated_at < ? OR (updated_at='' AND created_at < ?))",
-        (threshold, threshold)
-    ).fetchall()
+    rows = db.execute(STALE_STATUS_SQL, ('processing', threshold, threshold)).fetchall()
     for row in rows:
         order = dict(row)
         logger.warning(f"[TIMEOUT] order={order['id'][:8]} processing for >{timeout_minutes}min")
-        token = cfg.get('pushplus_token', '')
-        tg_token = cfg.get('telegram_bot_token', '')
-        tg_chat = cfg.get('telegram_chat_id', '')
         msg = (f"⚠️ 充值超时\n订单: {order['id'][:8]}\n"
                f"号码: {order['phone']}\n运营商: {order['operator']}\n"
                f"金额: €{order['amount']}\n超时: {timeout_minutes}分钟")
-        send_pushplus(token, "充值超时预警", msg)
-        send_telegram(tg_token, tg_chat, msg)
+        enqueue_alert(db, channel_credentials(cfg), msg, "充值超时预警")
+
+def hold_paid_orders(db, cfg):
+    """已发起支付但租约过期（worker 卡死或失联）的订单不退回队列，告警转人工核对"""
+    for order in hold_paid_expired_leases(db):
+        msg = (f"⚠️ 支付后租约过期，请人工核对\n订单: {order['id'][:8]}\n"
+               f"号码: {order['phone']}\n金额: €{order['amount']}\n"
+               f"设备: {order['claimed_by']}\n发起支付: {order['payment_submitted_at'][:19]}")
+        enqueue_alert(db, channel_credentials(cfg), msg, "充值待核对")
+    db.commit()
 
 def check_paying_status(db, cfg, timeout_minutes=60):
     """检查 paying 状态超时"""
     threshold = (datetime.now() - timedelta(minutes=timeout_minutes)).isoformat()
-    rows = db.execute(
-        "SELECT * FROM orders WHERE status='paying' AND (updated_at < ? OR (updated_at='' AND created_at < ?))",
-        (threshold, threshold)
-    ).fetchall()
+    rows = db.execute(STALE_STATUS_SQL, ('paying', threshold, threshold)).fetchall()
     for row in rows:
         order = dict(row)
         logger.warning(f"[PAYING_TIMEOUT] order={order['id'][:8]}")
-        tg_token = cfg.get('telegram_bot_token', '')
-        tg_chat = cfg.get('telegram_chat_id', '')
         msg = (f"⚠️ 支付超时\n订单: {order['id'][:8]}\n"
                f"号码: {order['phone']}\n金额: €{order['amount']}")
-        send_telegram(tg_token, tg_chat, msg)
+        enqueue_alert(db, channel_credentials(cfg), msg, channels=('telegram',))
+
+def reconcile(db, cfg, event_retention_hours=24, notification_retention_days=7):
+    """完整对账扫描：回收过期租约 + 状态推进 + 超时检查 + 清理过期事件和通知"""
+    reclaim_expired_leases(db)
+    hold_paid_orders(db, cfg)
+    process_charged_orders(db, cfg)
+    release_holding_orders(db, cfg)
+    check_processing_timeout(db, cfg)
+    check_paying_status(db, cfg)
+    before = (datetime.now() - timedelta(hours=event_retention_hours)).isoformat()
+    purge_order_events(db, before)
+    before = (datetime.now() - timedelta(days=notification_retention_days)).isoformat()
+    purge_notifications(db, before)
 
 def run():
     cfg = load_config()
-    poll_interval = cfg.get('poll_interval', 10)
-    logger.info(f"[DISPATCHER] started, poll_interval={poll_interval}s")
+    reconcile_interval = cfg.get('reconcile_interval', 60)
+    waiter = EventWaiter(poll_interval=cfg.get('poll_interval', 10))
+    start_notification_service(cfg)
+    if cfg.get('maintenance_in_dispatcher', True):
+        start_maintenance()
+    mode = f"polling every {waiter.poll_interval}s" if waiter.polling else "event-driven"
+    logger.info(f"[DISPATCHER] started ({mode}), reconcile_interval={reconcile_interval}s")
+    last_event_id = None
+    next_reconcile = 0
     while True:
         try:
-            db = get_db()
-            process_charged_orders(db, cfg)
-            release_holding_orders(db, cfg)
-            check_processing_timeout(db, cfg)
-            check_paying_status(db, cfg)
-            db.close()
+            with get_db() as db:
+                if last_event_id is None:
+                    last_event_id = latest_event_id(db)
+                    events = []
+                else:
+                    events = fetch_order_events(db, last_event_id)
+                    if events:
+                        last_event_id = events[-1]['id']
+                if time.monotonic() >= next_reconcile:
+                    reconcile(db, cfg)
+                    next_reconcile = time.monotonic() + reconcile_interval
+                elif events:
+                    process_charged_orders(db, cfg)
+                    release_holding_orders(db, cfg)
         except Exception as e:
             logger.error(f"[DISPATCHER] error: {e}")
-        time.sleep(poll_interval)
+            next_reconcile = time.monotonic() + reconcile_interval
+        waiter.wait(max(0, next_reconcile - time.monotonic()))
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,106 @@
+"""
+VeloceVoce 惟落雀 - 订单事件通道
+  - order_events 发件箱表：订单状态变更与业务写入在同一事务中登记，崩溃不丢事件
+  - 本地 UDP 唤醒：事务提交后向调度器发送一个数据报，调度器立即处理，无需等待轮询
+调度器离线时数据报直接丢弃，事件仍留在发件箱中，由下一次对账扫描处理。
+"""
+
+import os
+import time
+import socket
+import select
+import logging
+from datetime import datetime
+
+logger = logging.getLogger('events')
+
+NOTIFY_HOST = '127.0.0.1'
+NOTIFY_PORT = int(os.environ.get("DISPATCHER_NOTIFY_PORT", "8765"))
+
+_sender = None
+
+
+def publish_order_event(db, order_id, status):
+    """在当前事务中登记订单状态事件"""
+    db.execute(
+        "INSERT INTO order_events (order_id, status, created_at) VALUES (?,?,?)",
+        (order_id, status, datetime.now().isoformat())
+    )
+
+
+def publish_order_events(db, items):
+    """批量登记 (order_id, status) 事件"""
+    now = datetime.now().isoformat()
+    db.executemany(
+        "INSERT INTO order_events (order_id, status, created_at) VALUES (?,?,?)",
+        [(order_id, status, now) for order_id, status in items]
+    )
+
+
+def notify_dispatcher(port=None):
+    """事务提交后调用；不阻塞、不抛异常"""
+    global _sender
+    try:
+        if _sender is None:
+            _sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _sender.setblocking(False)
+        _sender.sendto(b'order', (NOTIFY_HOST, port or NOTIFY_PORT))
+    except OSError as e:
+        _sender = None
+        logger.debug(f"[EVENTS] notify failed: {e}")
+
+
+def fetch_order_events(db, after_id, limit=1000):
+    return db.execute(
+        "SELECT id, order_id, status, created_at FROM order_events WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id, limit)
+    ).fetchall()
+
+
+def latest_event_id(db):
+    return db.execute("SELECT COALESCE(MAX(id), 0) FROM order_events").fetchone()[0]
+
+
+def purge_order_events(db, before):
+    return db.execute("DELETE FROM order_events WHERE created_at < ?", (before,)).rowcount
+
+
+class EventWaiter:
+    """调度器端：绑定唤醒端口，wait() 在收到通知或超时后返回。
+    端口绑定失败时退化为轮询：每次最多等待 poll_interval 秒，按发件箱推进新订单"""
+
+    def __init__(self, port=None, poll_interval=10):
+        self.port = port or NOTIFY_PORT
+        self.poll_interval = poll_interval
+        self.sock = None
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((NOTIFY_HOST, self.port))
+            sock.setblocking(False)
+            self.sock = sock
+        except OSError as e:
+            logger.warning(f"[EVENTS] cannot bind {NOTIFY_HOST}:{self.port} ({e}); "
+                           f"dispatcher is in polling mode, new orders wait up to {poll_interval}s")
+
+    @property
+    def polling(self):
+        return self.sock is None
+
+    def wait(self, timeout):
+        """返回 True 表示被唤醒；同时清空积压的数据报，一次唤醒处理一批事件"""
+        if self.sock is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return False
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return False
+        while True:
+            try:
+                self.sock.recv(64)
+            except OSError:
+                break
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,298 @@
+"""
+VeloceVoce 惟落雀 - 数据库维护
+  - 分批删除过期的 sessions / admin_sessions / stream_tickets、过期或已使用的 sms_codes、旧的 cache_invalidations，
+    每批单独提交，不长时间占用写锁
+  - 每个用户最多保留 MAX_SESSIONS_PER_USER 个会话（登录时也会裁剪，这里处理存量）
+  - 超过 MESSAGE_RETENTION_DAYS 天的已读站内消息每 BATCH_SIZE 条一块，zlib 压缩 JSON 后移入 site_messages_archive
+  - 增量回收空闲页（auto_vacuum=INCREMENTAL）并用抽样 ANALYZE 更新统计
+  - 报告各表行数（维护型计数或 ANALYZE 统计估计，不 COUNT(*)）和数据库文件大小
+每一步都受同一个 TIME_BUDGET 限制，做不完的下次继续。
+调度器启动后台线程（start_background）每 MAINTENANCE_INTERVAL 秒执行一次，使用独立连接，
+不阻塞调度主循环；也可以单独运行：
+  python maintenance.py            # 执行一次维护并输出报告
+  python maintenance.py loop       # 作为独立进程定期维护（bot_config.json 中 maintenance_in_dispatcher 设为 false）
+  python maintenance.py report     # 只输出报告，并用 dbstat 统计各表占用空间（扫描全库）
+  python maintenance.py archive     # 不限时归档全部到期消息（首次启用保留期时清理存量）
+  python maintenance.py vacuum     # 旧库切换为 auto_vacuum=INCREMENTAL（完整 VACUUM，需停机）
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from database import get_db
+from cache import publish_invalidation
+
+logger = logging.getLogger('maintenance')
+
+MAINTENANCE_INTERVAL = 600
+BATCH_SIZE = 5000
+TIME_BUDGET = 5.0             # 单次维护的最长秒数，剩余的下次继续
+MAX_SESSIONS_PER_USER = int(os.environ.get("MAX_SESSIONS_PER_USER", "10"))
+SMS_CODE_RETENTION = timedelta(days=1)
+INVALIDATION_RETENTION = timedelta(hours=1)
+VACUUM_PAGES = 2000           # 每次最多回收的空闲页
+VACUUM_CHUNK = 200            # 每个事务回收的页数，块之间检查时间预算
+ANALYSIS_LIMIT = 1000         # ANALYZE 每个索引最多抽样的行数
+MESSAGE_RETENTION_DAYS = int(os.environ.get("MESSAGE_RETENTION_DAYS", "90"))   # 0 表示不归档
+ARCHIVE_COLUMNS = ('id', 'user_id', 'type', 'title', 'content', 'order_id', 'created_at')
+
+REPORT_TABLES = ('sessions', 'admin_sessions', 'sms_codes', 'cache_invalidations', 'notifications',
+                 'site_messages', 'site_messages_archive')
+COUNTED_TABLES = ('orders', 'users')   # row_counts 中由触发器维护的精确计数
+
+# 维护 SQL（tests/test_query_plans.py 检查其执行计划）
+# 按 rowid/id 分批删除过期行，每条语句最后一个参数是批大小
+PURGE_SQL = {
+    "sessions": """
+        DELETE FROM sessions WHERE rowid IN (
+            SELECT rowid FROM sessions WHERE expires_at <= ? LIMIT ?)
+    """,
+    "admin_sessions": """
+        DELETE FROM admin_sessions WHERE rowid IN (
+            SELECT rowid FROM admin_sessions WHERE expires_at <= ? LIMIT ?)
+    """,
+    "sms_codes": """
+        DELETE FROM sms_codes WHERE id IN (
+            SELECT id FROM sms_codes WHERE created_at < ? LIMIT ?)
+    """,
+    "cache_invalidations": """
+        DELETE FROM cache_invalidations WHERE id IN (
+            SELECT id FROM cache_invalidations WHERE created_at < ? LIMIT ?)
+    """,
+    "stream_tickets": """
+        DELETE FROM stream_tickets WHERE rowid IN (
+            SELECT rowid FROM stream_tickets WHERE expires_at <= ? LIMIT ?)
+    """,
+}
+TRIM_USER_SESSIONS_SQL = """
+    DELETE FROM sessions WHERE user_id = ? AND token NOT IN (
+        SELECT token FROM sessions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+    ) RETURNING token
+"""
+SESSION_GROUPS_SQL = """
+    SELECT user_id, COUNT(*) AS n FROM sessions WHERE user_id > ?
+    GROUP BY user_id ORDER BY user_id LIMIT ?
+"""
+ARCHIVE_SELECT_SQL = f"""
+    SELECT {', '.join(ARCHIVE_COLUMNS)} FROM site_messages
+    WHERE is_read = 1 AND created_at < ? ORDER BY created_at LIMIT ?
+"""
+
+# 下一轮 trim_all_sessions 从哪个 user_id 之后继续
+_trim_cursor = ''
+
+
+def purge_batches(db, sql, params, deadline):
+    """反复执行按 rowid 分批删除的 sql，直到删完或超过 deadline，返回删除行数"""
+    total = 0
+    while time.monotonic() < deadline:
+        deleted = db.execute(sql, (*params, BATCH_SIZE)).rowcount
+        db.commit()
+        total += deleted
+        if deleted < BATCH_SIZE:
+            break
+    return total
+
+
+def trim_user_sessions(db, user_id, keep=MAX_SESSIONS_PER_USER):
+    """只保留用户最新的 keep 个会话，返回被删除的 token（调用方负责失效缓存）"""
+    rows = db.execute(TRIM_USER_SESSIONS_SQL, (user_id, user_id, keep)).fetchall()
+    return [row['token'] for row in rows]
+
+
+def trim_all_sessions(db, deadline, keep=MAX_SESSIONS_PER_USER):
+    """沿 idx_sessions_user 按 user_id 分段扫描，每段最多 BATCH_SIZE 个用户；
+    超过 deadline 时记下位置，下次从这里继续，扫完一遍后从头开始"""
+    global _trim_cursor
+    trimmed = 0
+    while time.monotonic() < deadline:
+        groups = db.execute(SESSION_GROUPS_SQL, (_trim_cursor, BATCH_SIZE)).fetchall()
+        for row in groups:
+            if row['n'] > keep:
+                for token in trim_user_sessions(db, row['user_id'], keep):
+                    publish_invalidation(db, 'session', token)
+                    trimmed += 1
+                db.commit()
+            _trim_cursor = row['user_id']
+            if time.monotonic() >= deadline:
+                return trimmed
+        if len(groups) < BATCH_SIZE:
+            _trim_cursor = ''
+            break
+    return trimmed
+
+
+def archive_messages(db, before, deadline):
+    """把 before 之前的已读消息移入归档表，返回归档条数。
+    每批一行归档，body 为 zlib 压缩的 JSON 数组，每项按 ARCHIVE_COLUMNS 顺序；
+    同一批里不同用户的相似消息放在一起压缩，压缩率远高于逐条或按用户分块"""
+    total = 0
+    archived_at = datetime.now().isoformat()
+    while time.monotonic() < deadline:
+        rows = db.execute(ARCHIVE_SELECT_SQL, (before, BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        items = [list(row) for row in rows]
+        db.execute("""
+            INSERT INTO site_messages_archive (first_created, last_created, messages, body, archived_at)
+            VALUES (?,?,?,?,?)
+        """, (rows[0]['created_at'], rows[-1]['created_at'], len(rows),
+              zlib.compress(json.dumps(items, ensure_ascii=False).encode(), 6), archived_at))
+        db.executemany("DELETE FROM site_messages WHERE id = ?", [(row['id'],) for row in rows])
+        db.commit()
+        total += len(rows)
+        if len(rows) < BATCH_SIZE:
+            break
+    return total
+
+
+def unpack_archive(body):
+    """归档块 → 消息字典列表"""
+    return [dict(zip(ARCHIVE_COLUMNS, item)) for item in json.loads(zlib.decompress(body))]
+
+
+def purge_expired(db, deadline, now=None):
+    now = now or datetime.now()
+    stamp = now.isoformat()
+    # 过期会话本身已经无法通过认证（expires_at > now），删除无需失效缓存
+    return {
+        "sessions": purge_batches(db, PURGE_SQL["sessions"], (stamp,), deadline),
+        "admin_sessions": purge_batches(db, PURGE_SQL["admin_sessions"], (stamp,), deadline),
+        "stream_tickets": purge_batches(db, PURGE_SQL["stream_tickets"], (stamp,), deadline),
+        "sms_codes": purge_batches(db, PURGE_SQL["sms_codes"],
+                                   ((now - SMS_CODE_RETENTION).isoformat(),), deadline),
+        "cache_invalidations": purge_batches(db, PURGE_SQL["cache_invalidations"],
+                                             ((now - INVALIDATION_RETENTION).isoformat(),), deadline),
+        "trimmed_sessions": trim_all_sessions(db, deadline),
+        "archived_messages": archive_messages(
+            db, (now - timedelta(days=MESSAGE_RETENTION_DAYS)).isoformat(), deadline
+        ) if MESSAGE_RETENTION_DAYS else 0,
+    }
+
+
+def reclaim_space(db, deadline, pages=VACUUM_PAGES):
+    """分块回收空闲页，再抽样 ANALYZE 更新查询规划统计；库未启用 INCREMENTAL 时只做统计"""
+    freed = 0
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        while freed < pages and time.monotonic() < deadline:
+            before = db.execute("PRAGMA freelist_count").fetchone()[0]
+            if not before:
+                break
+            # execute() 只执行一步（回收一页），executescript 会执行到结束
+            db.executescript(f"PRAGMA incremental_vacuum({min(VACUUM_CHUNK, pages - freed)})")
+            freed += before - db.execute("PRAGMA freelist_count").fetchone()[0]
+    if time.monotonic() < deadline:
+        # analysis_limit 让 ANALYZE 每个索引只抽样一部分行，耗时与表大小无关
+        db.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        db.execute("ANALYZE")
+    db.commit()
+    return freed
+
+
+def estimated_rows(db, table):
+    """ANALYZE 统计中的行数估计，不扫描表（空表没有统计行，记为 0）；库从未 ANALYZE 时返回 None"""
+    try:
+        row = db.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return int(row['stat'].split()[0]) if row else 0
+
+
+def table_report(db):
+    page_size = db.execute("PRAGMA page_size").fetchone()[0]
+    report = {table: estimated_rows(db, table) for table in REPORT_TABLES}
+    report.update({row['name']: row['n'] for row in db.execute(
+        f"SELECT name, n FROM row_counts WHERE name IN ({','.join('?' * len(COUNTED_TABLES))})", COUNTED_TABLES)})
+    report["db_bytes"] = db.execute("PRAGMA page_count").fetchone()[0] * page_size
+    report["free_bytes"] = db.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+    return report
+
+
+def table_sizes(db):
+    """各表及其索引占用的字节数（dbstat 扫描全库，只在命令行 report 中使用）"""
+    try:
+        rows = db.execute("""
+            SELECT COALESCE(m.tbl_name, s.name) AS tbl, SUM(s.pgsize) AS bytes
+            FROM dbstat s LEFT JOIN sqlite_master m ON m.name = s.name
+            WHERE s.aggregate = 1 GROUP BY tbl ORDER BY bytes DESC
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {row['tbl']: row['bytes'] for row in rows}
+
+
+def run_maintenance(db, budget=TIME_BUDGET):
+    started = time.monotonic()
+    deadline = started + budget
+    purged = purge_expired(db, deadline)
+    freed = reclaim_space(db, deadline)
+    report = table_report(db)
+    logger.info(f"[MAINTENANCE] purged={purged} freed_pages={freed} sizes={report} "
+                f"took={time.monotonic() - started:.2f}s")
+    return {"purged": purged, "freed_pages": freed, "sizes": report}
+
+
+def run_forever(interval=MAINTENANCE_INTERVAL):
+    """使用连接池中的独立连接定期维护；在后台线程或独立进程中运行"""
+    while True:
+        try:
+            with get_db() as db:
+                run_maintenance(db)
+        except Exception as e:
+            logger.error(f"[MAINTENANCE] error: {e}")
+        time.sleep(interval)
+
+
+def start_background(interval=MAINTENANCE_INTERVAL):
+    thread = threading.Thread(target=run_forever, args=(interval,), name='maintenance', daemon=True)
+    thread.start()
+    return thread
+
+
+def enable_incremental_vacuum(db):
+    """auto_vacuum 模式只能在建表前设置，或随后执行一次完整 VACUUM 才生效"""
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    db.commit()
+    db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    db.execute("VACUUM")
+    return True
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    command = argv[1] if len(argv) > 1 else 'run'
+    if command == 'loop':
+        run_forever()
+        return 0
+    with get_db() as db:
+        if command == 'run':
+            run_maintenance(db)
+            return 0
+        if command == 'archive':
+            before = (datetime.now() - timedelta(days=MESSAGE_RETENTION_DAYS)).isoformat()
+            archived = archive_messages(db, before, float('inf')) if MESSAGE_RETENTION_DAYS else 0
+            freed = reclaim_space(db, float('inf'), 10 ** 9)
+            logger.info(f"[MAINTENANCE] archived {archived} messages, freed_pages={freed}")
+            return 0
+        if command == 'report':
+            logger.info(f"[MAINTENANCE] sizes={table_report(db)}")
+            logger.info(f"[MAINTENANCE] bytes={table_sizes(db)}")
+            return 0
+        if command == 'vacuum':
+            changed = enable_incremental_vacuum(db)
+            logger.info(f"[MAINTENANCE] auto_vacuum=INCREMENTAL {'enabled' if changed else 'already enabled'}")
+            return 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
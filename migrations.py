@@ -0,0 +1,558 @@
+"""
+VeloceVoce 惟落雀 - 数据库结构迁移
+每个迁移只执行一次，已执行的版本记录在 schema_migrations 表中。
+新增表、列或索引时在 MIGRATIONS 末尾追加一项，不要修改已发布的迁移。
+"""
+
+import logging
+from datetime import datetime
+
+logger = logging.getLogger('migrations')
+
+
+def table_columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def add_columns(db, table, columns):
+    """只添加尚不存在的列（兼容旧版 init_db 已经加过列的数据库）"""
+    existing = table_columns(db, table)
+    for col, col_type in columns.items():
+        if col not in existing:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+
+
+def _m001_base_tables(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            email TEXT UNIQUE,
+            phone TEXT UNIQUE,
+            password_hash TEXT NOT NULL,
+            nickname TEXT DEFAULT '',
+            phone_model TEXT DEFAULT '',
+            register_ip TEXT DEFAULT '',
+            user_agent TEXT DEFAULT '',
+            fingerprint TEXT DEFAULT '',
+            credit_used INTEGER DEFAULT 0,
+            credit_amount REAL DEFAULT 0,
+            is_blocked INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            last_login TEXT
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            operator TEXT NOT NULL,
+            amount REAL NOT NULL,
+            bonus REAL DEFAULT 0,
+            total REAL DEFAULT 0,
+            payment TEXT DEFAULT '',
+            status TEXT DEFAULT 'pending',
+            is_credit INTEGER DEFAULT 0,
+            message TEXT DEFAULT '',
+            created_at TEXT NOT NULL,
+            updated_at TEXT DEFAULT '',
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            token TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS admin_sessions (
+            token TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS sms_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone TEXT NOT NULL,
+            code TEXT NOT NULL,
+            purpose TEXT DEFAULT 'register',
+            ip TEXT DEFAULT '',
+            created_at TEXT NOT NULL,
+            used INTEGER DEFAULT 0
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS site_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            type TEXT DEFAULT 'info',
+            title TEXT NOT NULL,
+            content TEXT DEFAULT '',
+            order_id TEXT DEFAULT '',
+            is_read INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('online_count', '0')")
+    db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('cny_active', '1')")
+
+
+def _m002_user_columns(db):
+    add_columns(db, 'users', {
+        'address': "TEXT DEFAULT ''",
+        'city': "TEXT DEFAULT ''",
+        'postal_code': "TEXT DEFAULT ''",
+        'region': "TEXT DEFAULT ''",
+        'country': "TEXT DEFAULT ''",
+    })
+    add_columns(db, 'users', {
+        'credit_score': 'INTEGER DEFAULT 0',
+        'credit_level': "TEXT DEFAULT '新手'",
+        'total_spent': 'REAL DEFAULT 0',
+        'consecutive_success': 'INTEGER DEFAULT 0',
+        'unpaid_order_id': "TEXT DEFAULT ''",
+        'milestone_100': 'INTEGER DEFAULT 0',
+        'milestone_300': 'INTEGER DEFAULT 0',
+    })
+
+
+def _m003_indexes(db):
+    # orders: 用户订单列表 / 同用户进行中订单检查
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders(user_id, status)")
+    # orders: 调度器按状态扫描、后台按状态筛选
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id, expires_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_admin_sessions_expires ON admin_sessions(expires_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sms_codes_lookup ON sms_codes(phone, purpose, used, created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_site_messages_user_created ON site_messages(user_id, created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_site_messages_unread ON site_messages(user_id) WHERE is_read = 0")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_register_ip ON users(register_ip, created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_fingerprint ON users(fingerprint)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)")
+    db.execute("ANALYZE")
+
+
+def _m004_cache_invalidations(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            key TEXT DEFAULT '',
+            created_at TEXT NOT NULL
+        )
+    """)
+
+
+
+def _m005_order_events(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS order_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_order_events_created ON order_events(created_at)")
+
+
+
+def _m006_order_leases(db):
+    add_columns(db, 'orders', {
+        'claimed_by': "TEXT DEFAULT ''",
+        'lease_expires_at': "TEXT DEFAULT ''",
+    })
+
+
+def _m007_notifications(db):
+    db.execute("""CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        title TEXT DEFAULT '',
+        body TEXT NOT NULL,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        sent_at TEXT DEFAULT '',
+        last_error TEXT DEFAULT '',
+        claimed_by TEXT DEFAULT ''
+    )""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(channel, status, next_attempt_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
+
+
+def _m008_rate_limits(db):
+    # 仅在 RATE_LIMIT_BACKEND=sqlite（多 worker 共享限额）时使用
+    db.execute("""CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        allowed INTEGER DEFAULT 1
+    )""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_updated ON rate_limits(updated_at)")
+
+
+def _m009_row_counts(db):
+    # 维护型计数器：orders/users 的总数和按状态计数由触发器在每次写入时更新，
+    # 所有进程（server、调度器、机器人）的写入都会被计入，后台读取总数为 O(1)
+    db.execute("""CREATE TABLE IF NOT EXISTS row_counts (
+        name TEXT PRIMARY KEY,
+        n INTEGER NOT NULL DEFAULT 0
+    )""")
+    bump = "INSERT INTO row_counts (name, n) VALUES ({name}, {delta}) ON CONFLICT(name) DO UPDATE SET n = n + ({delta});"
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_count_insert AFTER INSERT ON orders BEGIN
+        {bump.format(name="'orders'", delta=1)}
+        {bump.format(name="'orders:' || NEW.status", delta=1)}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_count_delete AFTER DELETE ON orders BEGIN
+        {bump.format(name="'orders'", delta=-1)}
+        {bump.format(name="'orders:' || OLD.status", delta=-1)}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_count_status AFTER UPDATE OF status ON orders
+        WHEN OLD.status IS NOT NEW.status BEGIN
+        {bump.format(name="'orders:' || OLD.status", delta=-1)}
+        {bump.format(name="'orders:' || NEW.status", delta=1)}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_users_count_insert AFTER INSERT ON users BEGIN
+        {bump.format(name="'users'", delta=1)}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_users_count_delete AFTER DELETE ON users BEGIN
+        {bump.format(name="'users'", delta=-1)}
+    END""")
+    db.execute("DELETE FROM row_counts")
+    db.execute("INSERT INTO row_counts (name, n) SELECT 'orders', COUNT(*) FROM orders")
+    db.execute("INSERT INTO row_counts (name, n) SELECT 'orders:' || status, COUNT(*) FROM orders GROUP BY status")
+    db.execute("INSERT INTO row_counts (name, n) SELECT 'users', COUNT(*) FROM users")
+    # 后台列表按 (created_at, id) 做游标分页；旧的单列索引是新索引的前缀，删除
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_id ON orders(created_at, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created_id ON orders(status, created_at, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_created_id ON users(created_at, id)")
+    db.execute("DROP INDEX IF EXISTS idx_orders_created")
+    db.execute("DROP INDEX IF EXISTS idx_orders_status_created")
+    db.execute("DROP INDEX IF EXISTS idx_users_created")
+    db.execute("ANALYZE")
+
+
+def _m010_order_rollups(db):
+    # 统计汇总表，查询见 stats.py；触发器在每次订单写入时增量更新。
+    # 触发器和回填 SQL 是发布时的快照，不引用 stats.py，之后修改那边不影响本迁移的结果
+    completed_day = "substr(COALESCE(NULLIF({row}.updated_at, ''), {row}.created_at), 1, 10)"
+    add_columns(db, 'row_counts', {'amount': "REAL NOT NULL DEFAULT 0"})
+    db.execute("""CREATE TABLE IF NOT EXISTS order_stats_daily (
+        day TEXT NOT NULL,
+        status TEXT NOT NULL,
+        operator TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, status, operator)
+    )""")
+    db.execute("""CREATE TABLE IF NOT EXISTS order_completions_daily (
+        day TEXT NOT NULL,
+        operator TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        amount REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, operator)
+    )""")
+
+    def counts(row, sign):
+        return f"""
+        INSERT INTO row_counts (name, n, amount) VALUES ('orders', {sign}1, {sign}{row}.amount)
+            ON CONFLICT(name) DO UPDATE SET n = n + excluded.n, amount = amount + excluded.amount;
+        INSERT INTO row_counts (name, n, amount) VALUES ('orders:' || {row}.status, {sign}1, {sign}{row}.amount)
+            ON CONFLICT(name) DO UPDATE SET n = n + excluded.n, amount = amount + excluded.amount;"""
+
+    def daily(row, sign):
+        return f"""
+        INSERT INTO order_stats_daily (day, status, operator, orders, amount)
+            VALUES (substr({row}.created_at, 1, 10), {row}.status, {row}.operator, {sign}1, {sign}{row}.amount)
+            ON CONFLICT(day, status, operator) DO UPDATE
+            SET orders = orders + excluded.orders, amount = amount + excluded.amount;"""
+
+    def completed(row, sign):
+        return f"""
+        INSERT INTO order_completions_daily (day, operator, orders, amount)
+            SELECT {completed_day.format(row=row)}, {row}.operator, {sign}1, {sign}{row}.amount
+            WHERE {row}.status = 'completed'
+            ON CONFLICT(day, operator) DO UPDATE
+            SET orders = orders + excluded.orders, amount = amount + excluded.amount;"""
+
+    # 取代 _m009 的计数触发器：计数同时累计金额，金额/状态变化都会更新
+    for name in ('trg_orders_count_insert', 'trg_orders_count_delete', 'trg_orders_count_status'):
+        db.execute(f"DROP TRIGGER IF EXISTS {name}")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_insert AFTER INSERT ON orders BEGIN
+        {counts('NEW', '+')}{daily('NEW', '+')}{completed('NEW', '+')}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_delete AFTER DELETE ON orders BEGIN
+        {counts('OLD', '-')}{daily('OLD', '-')}{completed('OLD', '-')}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_rollup_update
+        AFTER UPDATE OF status, operator, amount, created_at, updated_at ON orders
+        WHEN OLD.status IS NOT NEW.status OR OLD.operator IS NOT NEW.operator
+          OR OLD.amount IS NOT NEW.amount OR OLD.created_at IS NOT NEW.created_at
+          OR (NEW.status = 'completed' AND OLD.updated_at IS NOT NEW.updated_at)
+        BEGIN
+        {counts('OLD', '-')}{counts('NEW', '+')}
+        {daily('OLD', '-')}{daily('NEW', '+')}
+        {completed('OLD', '-')}{completed('NEW', '+')}
+    END""")
+    for table in ('row_counts', 'order_stats_daily', 'order_completions_daily'):
+        db.execute(f"DELETE FROM {table}")
+    db.execute("""
+        INSERT INTO row_counts (name, n, amount)
+        SELECT 'orders', COUNT(*), COALESCE(SUM(amount), 0) FROM orders
+        UNION ALL
+        SELECT 'orders:' || status, COUNT(*), COALESCE(SUM(amount), 0) FROM orders GROUP BY status
+        UNION ALL
+        SELECT 'users', COUNT(*), 0 FROM users
+    """)
+    db.execute("""
+        INSERT INTO order_stats_daily (day, status, operator, orders, amount)
+        SELECT substr(created_at, 1, 10), status, operator, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM orders GROUP BY 1, 2, 3
+    """)
+    db.execute(f"""
+        INSERT INTO order_completions_daily (day, operator, orders, amount)
+        SELECT {completed_day.format(row='orders')}, operator, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM orders WHERE status = 'completed' GROUP BY 1, 2
+    """)
+
+
+def _m011_payment_reminders(db):
+    # 付款提醒状态（原 payment_reminders.json）。触发器在订单进入/离开 awaiting_payment 时
+    # 增删记录，payment_bot 每轮只按 next_remind_at 范围查询到期提醒。
+    # 首次提醒在下单 1 小时后，与 payment_bot.REMINDER_SCHEDULE[0] 一致
+    db.execute("""CREATE TABLE IF NOT EXISTS payment_reminders (
+        order_id TEXT PRIMARY KEY,
+        level INTEGER NOT NULL DEFAULT 0,
+        last_sent TEXT,
+        next_remind_at TEXT
+    )""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_payment_reminders_next ON payment_reminders(next_remind_at)")
+    first = "strftime('%Y-%m-%dT%H:%M:%S', NEW.created_at, '+1 hours')"
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_reminders_insert AFTER INSERT ON orders
+        WHEN NEW.status = 'awaiting_payment' BEGIN
+        INSERT OR IGNORE INTO payment_reminders (order_id, next_remind_at) VALUES (NEW.id, {first});
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_reminders_enter AFTER UPDATE OF status ON orders
+        WHEN NEW.status = 'awaiting_payment' AND OLD.status IS NOT 'awaiting_payment' BEGIN
+        INSERT OR IGNORE INTO payment_reminders (order_id, next_remind_at) VALUES (NEW.id, {first});
+    END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS trg_reminders_leave AFTER UPDATE OF status ON orders
+        WHEN OLD.status = 'awaiting_payment' AND NEW.status IS NOT 'awaiting_payment' BEGIN
+        DELETE FROM payment_reminders WHERE order_id = OLD.id;
+    END""")
+    db.execute("""CREATE TRIGGER IF NOT EXISTS trg_reminders_delete AFTER DELETE ON orders
+        WHEN OLD.status = 'awaiting_payment' BEGIN
+        DELETE FROM payment_reminders WHERE order_id = OLD.id;
+    END""")
+    db.execute(f"""
+        INSERT OR IGNORE INTO payment_reminders (order_id, next_remind_at)
+        SELECT id, {first.replace('NEW.', '')} FROM orders WHERE status = 'awaiting_payment'
+    """)
+
+
+def _m012_inbox_counts(db):
+    # 每个用户的站内消息总数/未读数，由触发器随 site_messages 的任何写入（server、order_bot）维护，
+    # /api/me 读未读数只需一次主键查询
+    db.execute("""CREATE TABLE IF NOT EXISTS inbox_counts (
+        user_id TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        unread INTEGER NOT NULL DEFAULT 0
+    )""")
+    bump = """INSERT INTO inbox_counts (user_id, total, unread) VALUES ({user}, {total}, {unread})
+        ON CONFLICT(user_id) DO UPDATE SET total = total + excluded.total, unread = unread + excluded.unread;"""
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_inbox_insert AFTER INSERT ON site_messages BEGIN
+        {bump.format(user='NEW.user_id', total=1, unread='NEW.is_read = 0')}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_inbox_delete AFTER DELETE ON site_messages BEGIN
+        {bump.format(user='OLD.user_id', total=-1, unread='-(OLD.is_read = 0)')}
+    END""")
+    db.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_inbox_read AFTER UPDATE OF is_read ON site_messages
+        WHEN (OLD.is_read = 0) IS NOT (NEW.is_read = 0) BEGIN
+        {bump.format(user='NEW.user_id', total=0, unread='(NEW.is_read = 0) - (OLD.is_read = 0)')}
+    END""")
+    db.execute("DELETE FROM inbox_counts")
+    db.execute("""
+        INSERT INTO inbox_counts (user_id, total, unread)
+        SELECT user_id, COUNT(*), SUM(is_read = 0) FROM site_messages GROUP BY user_id
+    """)
+
+
+def _m013_message_archive(db):
+    # 超过保留期的已读消息按批压缩后移入归档表（见 maintenance.archive_messages），
+    # 旧数据由维护任务分批迁移，不在迁移中一次完成
+    db.execute("""CREATE TABLE IF NOT EXISTS site_messages_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_created TEXT NOT NULL,
+        last_created TEXT NOT NULL,
+        messages INTEGER NOT NULL,
+        body BLOB NOT NULL,
+        archived_at TEXT NOT NULL
+    )""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_messages_archive_created ON site_messages_archive(last_created)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_site_messages_read_created ON site_messages(created_at) WHERE is_read = 1")
+
+
+def _m014_credit_ledger(db):
+    # 信用积分账本（见 credit.py）：每笔完成订单一条，只追加；
+    # credit_baseline 保存启用账本时各用户已有的积分状态，批量重算从它开始累加
+    db.execute("""CREATE TABLE IF NOT EXISTS credit_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        order_id TEXT NOT NULL,
+        amount REAL NOT NULL,
+        is_credit INTEGER NOT NULL DEFAULT 0,
+        points INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    )""")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_credit_events_user ON credit_events(user_id, id, amount, is_credit)")
+    db.execute("""CREATE TABLE IF NOT EXISTS credit_baseline (
+        user_id TEXT PRIMARY KEY,
+        score INTEGER NOT NULL DEFAULT 0,
+        total_spent REAL NOT NULL DEFAULT 0,
+        streak INTEGER NOT NULL DEFAULT 0,
+        milestone_100 INTEGER NOT NULL DEFAULT 0,
+        milestone_300 INTEGER NOT NULL DEFAULT 0
+    )""")
+    db.execute("""
+        INSERT OR IGNORE INTO credit_baseline (user_id, score, total_spent, streak, milestone_100, milestone_300)
+        SELECT id, COALESCE(credit_score, 0), COALESCE(total_spent, 0), COALESCE(consecutive_success, 0),
+               COALESCE(milestone_100, 0), COALESCE(milestone_300, 0)
+        FROM users
+        WHERE credit_score > 0 OR total_spent > 0 OR consecutive_success > 0
+    """)
+
+
+def _m015_notification_sender(db):
+    # 每条通知记录登记时所用凭据的指纹（notify.credential_key），投递服务按 (channel, sender) 领取；
+    # 迁移前登记的消息无法确定凭据，未发送的标记为 failed，不再由任意进程代发
+    add_columns(db, 'notifications', {'sender': "TEXT DEFAULT ''"})
+    db.execute("DROP INDEX IF EXISTS idx_notifications_due")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(channel, sender, status, next_attempt_at)")
+    db.execute("""
+        UPDATE notifications SET status='failed', last_error='登记时未记录凭据（迁移前的消息）'
+        WHERE sender = '' AND status IN ('pending', 'sending')
+    """)
+
+
+def _m016_credit_event_order_unique(db):
+    # 同一订单只能计一次分。先删除重复完成产生的多余记录（保留最早一条），
+    # 受影响用户的积分需要用 python credit.py recompute 重算
+    removed = db.execute("""
+        DELETE FROM credit_events WHERE id NOT IN (SELECT MIN(id) FROM credit_events GROUP BY order_id)
+    """).rowcount
+    if removed:
+        logger.warning(f"[MIGRATE] removed {removed} duplicate credit events, run: python credit.py recompute")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_credit_events_order ON credit_events(order_id)")
+
+
+def _m017_purge_indexes(db):
+    # maintenance.PURGE_SQL 按 created_at 分批删除，没有索引时每次维护都要扫完整张表
+    db.execute("CREATE INDEX IF NOT EXISTS idx_sms_codes_created ON sms_codes(created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created ON cache_invalidations(created_at)")
+
+
+def _m018_payment_submitted(db):
+    # worker 发起支付前在租约内登记；之后租约过期的订单不再退回队列，转人工核对，避免重复充值
+    add_columns(db, 'orders', {'payment_submitted_at': "TEXT DEFAULT ''"})
+
+
+
+def _m019_stream_tickets(db):
+    # EventSource 不能带 Authorization 头：先用请求头换一次性票据，URL 里只出现票据（见 stream.issue_ticket）
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS stream_tickets (
+            ticket TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL DEFAULT '',
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            expires_at TEXT NOT NULL
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_stream_tickets_expires ON stream_tickets(expires_at)")
+
+
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "users profile and credit columns", _m002_user_columns),
+    (3, "secondary indexes", _m003_indexes),
+    (4, "cross-process cache invalidation log", _m004_cache_invalidations),
+    (5, "order event outbox", _m005_order_events),
+    (6, "order claim leases", _m006_order_leases),
+    (7, "notification outbox", _m007_notifications),
+    (8, "shared rate limit buckets", _m008_rate_limits),
+    (9, "maintained row counts and keyset indexes", _m009_row_counts),
+    (10, "order statistics rollups", _m010_order_rollups),
+    (11, "payment reminder schedule", _m011_payment_reminders),
+    (12, "maintained inbox counters", _m012_inbox_counts),
+    (13, "site message archive", _m013_message_archive),
+    (14, "credit event ledger", _m014_credit_ledger),
+    (15, "notification sender key", _m015_notification_sender),
+    (16, "one credit event per order", _m016_credit_event_order_unique),
+    (17, "created_at indexes for maintenance purges", _m017_purge_indexes),
+    (18, "order payment submission marker", _m018_payment_submitted),
+    (19, "single-use stream tickets", _m019_stream_tickets),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(db):
+    """已应用的最高版本；从未迁移过的库返回 0"""
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_migrations'"
+    ).fetchone()
+    if not exists:
+        return 0
+    row = db.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+def schema_ready(db):
+    """数据库已迁移到本代码要求的版本（多 worker 模式下 worker 只检查、不迁移）"""
+    return current_version(db) >= LATEST_VERSION
+
+
+def migrate(db):
+    """执行所有未应用的迁移，返回迁移后的版本号"""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    db.commit()
+    # BEGIN IMMEDIATE 让 server 与各机器人同时启动时只有一个进程执行迁移
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        version = current_version(db)
+        for number, name, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            apply(db)
+            db.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?,?,?)",
+                (number, name, datetime.now().isoformat())
+            )
+            version = number
+            logger.info(f"[MIGRATE] applied {number}: {name}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return version
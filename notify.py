@@ -0,0 +1,293 @@
+"""
+VeloceVoce 惟落雀 - 通知投递服务
+  - notifications 发件箱表：业务代码只在事务中 enqueue，不再在请求/充值流程里同步调用外部 API
+  - NotificationService：异步 HTTP 客户端（httpx，keep-alive 连接池）批量投递
+  - 每个渠道一个令牌桶限速；被限速期间积压的消息合并为一条摘要发送
+  - 失败按指数退避重试，超过 MAX_ATTEMPTS 次标记为 failed；429 按服务端给出的 retry_after 等待并暂停该渠道
+server.py 和 dispatcher.py 都会运行投递服务，通过租约领取消息，同一条消息只会被一个进程发送。
+两者的凭据来源不同（环境变量 / bot_config.json），每条消息记录登记时所用凭据的指纹（sender），
+投递服务只领取与自己凭据一致的消息，不会用错 token/chat 代发。
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+import httpx
+
+from database import run_db
+
+logger = logging.getLogger('notify')
+
+TELEGRAM_API = os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org")
+PUSHPLUS_URL = os.environ.get("PUSHPLUS_URL", "http://www.pushplus.plus/send")
+
+# 渠道限速：(每秒消息数, 突发上限)
+CHANNEL_RATES = {
+    'telegram': (1.0, 5),
+    'pushplus': (0.5, 2),
+}
+MAX_ATTEMPTS = 8
+RETRY_BASE = 5          # 第 n 次失败后等待 RETRY_BASE * 2^n 秒
+RETRY_MAX = 3600
+SEND_LEASE = 60         # 领取后未完成的消息在此秒数后可被其他进程重新领取
+DIGEST_MAX_ITEMS = 20
+DIGEST_MAX_CHARS = 3800  # Telegram 单条上限 4096
+DIGEST_SEPARATOR = "\n\n————————\n\n"
+
+# 各渠道必须配置的凭据字段
+REQUIRED_FIELDS = {
+    'telegram': ('token', 'chat_id'),
+    'pushplus': ('token',),
+}
+
+
+def channel_credentials(cfg):
+    """bot_config.json 中的通知凭据（dispatcher / order_bot / payment_bot 共用）"""
+    return {
+        'telegram': {'token': cfg.get('telegram_bot_token', ''), 'chat_id': cfg.get('telegram_chat_id', '')},
+        'pushplus': {'token': cfg.get('pushplus_token', ''), 'topic': cfg.get('pushplus_topic', '')},
+    }
+
+
+def is_configured(channel, cred):
+    return all(cred.get(field) for field in REQUIRED_FIELDS.get(channel, ('token',)))
+
+
+def credential_key(channel, cred):
+    """凭据指纹：凭据相同的进程之间可以互相代发，不同的只领取自己登记的消息"""
+    raw = json.dumps([channel, sorted(cred.items())], ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def enqueue(db, channel, cred, body, title=""):
+    """在当前事务中登记一条待发送通知；渠道未配置凭据时不登记，返回是否登记"""
+    if not is_configured(channel, cred):
+        return False
+    now = datetime.now().isoformat()
+    db.execute(
+        "INSERT INTO notifications (channel, sender, title, body, status, attempts, next_attempt_at, created_at) "
+        "VALUES (?,?,?,?,'pending',0,?,?)",
+        (channel, credential_key(channel, cred), title, body, now, now)
+    )
+    return True
+
+
+def enqueue_alert(db, credentials, body, title="", channels=('telegram', 'pushplus')):
+    """credentials: 同 NotificationService；只登记到已配置凭据的渠道"""
+    for channel in channels:
+        if channel in credentials:
+            enqueue(db, channel, credentials[channel], body, title)
+
+
+CLAIM_BATCH_SQL = """
+    UPDATE notifications SET status='sending', claimed_by=?, next_attempt_at=?
+    WHERE id IN (
+        SELECT id FROM notifications
+        WHERE channel=? AND sender=? AND status IN ('pending','sending') AND next_attempt_at <= ?
+        ORDER BY id LIMIT ?
+    )
+    RETURNING id, title, body, attempts
+"""
+
+
+def claim_batch(db, channel, sender, worker_id, limit=DIGEST_MAX_ITEMS):
+    now = datetime.now()
+    rows = db.execute(CLAIM_BATCH_SQL, (worker_id, (now + timedelta(seconds=SEND_LEASE)).isoformat(),
+          channel, sender, now.isoformat(), limit)).fetchall()
+    return sorted((dict(r) for r in rows), key=lambda r: r['id'])
+
+
+def finish_batch(db, items, worker_id, ok, error="", retry_after=None):
+    """写回投递结果；失败的消息按已尝试次数指数退避，服务端给出 retry_after 时按它等待"""
+    now = datetime.now()
+    if ok:
+        db.executemany(
+            "UPDATE notifications SET status='sent', sent_at=?, last_error='' WHERE id=? AND claimed_by=?",
+            [(now.isoformat(), item['id'], worker_id) for item in items]
+        )
+        return
+    params = []
+    for item in items:
+        attempts = item['attempts'] + 1
+        status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+        delay = retry_after if retry_after is not None else RETRY_BASE * 2 ** attempts
+        retry_at = now + timedelta(seconds=min(delay, RETRY_MAX))
+        params.append((status, attempts, error[:500], retry_at.isoformat(), item['id'], worker_id))
+    db.executemany(
+        "UPDATE notifications SET status=?, attempts=?, last_error=?, next_attempt_at=? WHERE id=? AND claimed_by=?",
+        params
+    )
+
+
+def release_batch(db, items, worker_id):
+    """未发送的消息立即放回队列"""
+    now = datetime.now().isoformat()
+    db.executemany(
+        "UPDATE notifications SET status='pending', next_attempt_at=? WHERE id=? AND claimed_by=?",
+        [(now, item['id'], worker_id) for item in items]
+    )
+
+
+PURGE_NOTIFICATIONS_SQL = "DELETE FROM notifications WHERE created_at < ? AND status != 'sending'"
+
+
+def purge_notifications(db, before):
+    return db.execute(PURGE_NOTIFICATIONS_SQL, (before,)).rowcount
+
+
+def build_digest(batch):
+    """把多条消息合并为一条；超出长度的部分留给下一批"""
+    parts, used, size = [], [], 0
+    for item in batch:
+        body = item['body']
+        extra = len(body) + (len(DIGEST_SEPARATOR) if parts else 0)
+        if parts and size + extra > DIGEST_MAX_CHARS:
+            break
+        parts.append(body)
+        used.append(item)
+        size += extra
+    if len(used) == 1:
+        return used, used[0]['title'], used[0]['body']
+    header = f"📬 {len(used)} 条通知汇总"
+    return used, header, header + DIGEST_SEPARATOR + DIGEST_SEPARATOR.join(parts)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def available(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1
+
+    def consume(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """被服务端限流：seconds 秒内不再放行"""
+        self.available()
+        self.tokens = -seconds * self.rate
+
+
+def retry_after(error):
+    """429 响应要求的等待秒数：Retry-After 头或 Telegram 的 parameters.retry_after；其他错误返回 None"""
+    resp = getattr(error, 'response', None)
+    if resp is None or resp.status_code != 429:
+        return None
+    try:
+        return float(resp.headers['Retry-After'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return float(resp.json()['parameters']['retry_after'])
+    except Exception:
+        return RETRY_BASE
+
+
+class NotificationService:
+    """credentials: {'telegram': {'token', 'chat_id'}, 'pushplus': {'token', 'topic'}}；
+    只投递本进程有凭据的渠道，且只领取用同一套凭据登记的消息"""
+
+    def __init__(self, credentials, worker_id, poll_interval=2.0):
+        self.credentials = credentials
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.channels = [c for c, cred in credentials.items() if is_configured(c, cred)]
+        self.senders = {c: credential_key(c, credentials[c]) for c in self.channels}
+        self.buckets = {c: TokenBucket(*CHANNEL_RATES.get(c, (1.0, 1))) for c in self.channels}
+        self.sent = 0
+        self.messages = 0
+        self.digests = 0
+        self.failures = 0
+        self.last_error = ''
+
+    async def _post(self, client, channel, title, text):
+        cred = self.credentials[channel]
+        if channel == 'telegram':
+            resp = await client.post(
+                f"{TELEGRAM_API}/bot{cred['token']}/sendMessage",
+                json={"chat_id": cred.get('chat_id', ''), "text": text, "parse_mode": "HTML"}
+            )
+        elif channel == 'pushplus':
+            resp = await client.post(PUSHPLUS_URL, json={
+                "token": cred['token'], "title": title or "通知", "content": text,
+                "topic": cred.get('topic', ''), "template": "html"
+            })
+        else:
+            raise ValueError(f"unknown channel {channel}")
+        if resp.status_code >= 300:
+            raise httpx.HTTPStatusError(f"HTTP {resp.status_code}: {resp.text[:200]}",
+                                        request=resp.request, response=resp)
+        # PushPlus 出错时仍返回 HTTP 200，错误码在 body 的 code 字段
+        if channel == 'pushplus' and resp.json().get('code') != 200:
+            raise ValueError(f"pushplus: {resp.text[:200]}")
+
+    async def deliver_channel(self, client, channel):
+        if not self.buckets[channel].available():
+            return 0
+        batch = await run_db(claim_batch, channel, self.senders[channel], self.worker_id)
+        if not batch:
+            return 0
+        used, title, text = build_digest(batch)
+        if len(used) < len(batch):
+            await run_db(release_batch, batch[len(used):], self.worker_id)
+        self.buckets[channel].consume()
+        try:
+            await self._post(client, channel, title, text)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{channel}: {e}"
+            delay = retry_after(e)
+            if delay is not None:
+                self.buckets[channel].pause(delay)
+            logger.error(f"[NOTIFY] {channel} send failed ({len(used)} msgs): {e}")
+            await run_db(finish_batch, used, self.worker_id, False, str(e), delay)
+            return 0
+        await run_db(finish_batch, used, self.worker_id, True)
+        self.sent += 1
+        self.messages += len(used)
+        if len(used) > 1:
+            self.digests += 1
+        return len(used)
+
+    async def deliver_once(self, client):
+        total = 0
+        for channel in self.channels:
+            try:
+                total += await self.deliver_channel(client, channel)
+            except Exception as e:
+                self.last_error = f"{channel}: {e}"
+                logger.error(f"[NOTIFY] {channel} error: {e}")
+        return total
+
+    async def run_forever(self):
+        if not self.channels:
+            logger.info("[NOTIFY] no channel credentials configured, delivery disabled")
+            return
+        logger.info(f"[NOTIFY] delivery started channels={self.channels}")
+        limits = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+        async with httpx.AsyncClient(timeout=10, limits=limits) as client:
+            while True:
+                if not await self.deliver_once(client):
+                    await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        return {
+            "channels": self.channels,
+            "requests_sent": self.sent,
+            "messages_sent": self.messages,
+            "digests": self.digests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
@@ -1,7 +1,9 @@
 """
 VeloceVoce 惟落雀 - 充值自动化机器人
 负责：
-  - 基于 ADB 的瓜瓜充值 App 自动化操作
+  - 基于 ADB 的瓜瓜充值 App 自动化操作（每设备常驻 adb shell 会话，截图走 exec-out）
+  - 多设备并行：每个 adb 设备（devices 配置）一个工作线程，按租约协议领取订单（order_queue.py）
+  - 设备健康追踪：连续故障的设备暂停接单，冷却后探测恢复
   - 多账号和多卡轮换
   - PushPlus 和 Telegram 通知
   - 充值成功后的短信通知
@@ -9,14 +11,21 @@ VeloceVoce 惟落雀 - 充值自动化机器人
 
 import time
 import json
-import sqlite3
 import logging
 import os
+import queue
+import shlex
 import subprocess
-import urllib.request
 import random
+import threading
 from datetime import datetime
 
+from database import get_db
+from events import notify_dispatcher
+from notify import enqueue_alert, channel_credentials
+from order_queue import (LEASE_SECONDS, LeaseHeartbeat, LeaseLost, claim_order,
+                         finish_claim, make_worker_id, requeue_claim)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s'
@@ -24,7 +33,6 @@ logging.basicConfig(
 logger = logging.getLogger('order_bot')
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, 'recharge.db')
 CONFIG_FILE = os.path.join(BASE_DIR, 'bot_config.json')
 
 def load_config():
@@ -33,82 +41,178 @@ def load_config():
             return json.load(f)
     return {}
 
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+class DeviceError(Exception):
+    """设备故障（ADB 不可用、App 无法启动）：订单退回队列，由其他设备处理"""
+    pass
 
-def send_pushplus(token, title, content, topic=""):
-    if not token:
-        return
-    try:
-        data = json.dumps({
-            "token": token,
-            "title": title,
-            "content": content,
-            "topic": topic,
-            "template": "html"
-        }).encode('utf-8')
-        req = urllib.request.Request(
-            "http://www.pushplus.plus/send",
-            data=data,
-            headers={"Content-Type": "application/json"}
-        )
-        urllib.request.urlopen(req, timeout=5)
-        logger.info(f"[PUSHPLUS] sent: {title}")
-    except Exception as e:
-        logger.error(f"[PUSHPLUS] error: {e}")
+class LatencyStats:
+    """ADB 命令耗时统计（按命令类型）"""
 
-def send_telegram(token, chat_id, msg):
-    if not token or not chat_id:
-        return
-    try:
-        data = json.dumps({
-            "chat_id": chat_id,
-            "text": msg,
-            "parse_mode": "HTML"
-        }).encode('utf-8')
-        req = urllib.request.Request(
-            f"https://api.telegram.org/bot{token}/sendMessage",
-            data=data,
-            headers={"Content-Type": "application/json"}
-        )
-        urllib.request.urlopen(req, timeout=5)
-    except Exception as e:
-        logger.error(f"[TELEGRAM] error: {e}")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            item = self._data.setdefault(name, [0, 0.0, 0.0])
+            item[0] += 1
+            item[1] += seconds
+            item[2] = max(item[2], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: {"count": n, "avg_ms": round(total / n * 1000, 1), "max_ms": round(peak * 1000, 1)}
+                    for name, (n, total, peak) in self._data.items()}
 
-def adb_cmd(adb_path, *args):
-    """执行 ADB 命令"""
-    cmd = [adb_path] + list(args)
+adb_latency = LatencyStats()
+
+def adb_cmd(adb_path, *args, serial=None):
+    """执行 ADB 命令（每次启动一个 adb 进程）；指定 serial 时通过 adb -s 选择设备"""
+    cmd = [adb_path] + (['-s', serial] if serial else []) + list(args)
+    start = time.monotonic()
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
         return result.stdout.strip(), result.returncode
     except Exception as e:
         logger.error(f"[ADB] error: {e}")
         return "", -1
+    finally:
+        adb_latency.record(f"spawn:{args[0] if args else ''}", time.monotonic() - start)
+
+class AdbSession:
+    """每个设备一个常驻 adb shell 进程，命令通过 stdin 发送，避免每个动作都启动 adb。
+    每条命令的 stdin 重定向到 /dev/null，读 stdin 的命令不会吞掉后面的脚本和结束标记；
+    最后追加一个结束标记行携带退出码；进程异常退出或超时时下次调用自动重启"""
+
+    MARKER = '__VV_ADB_END__'
 
-def adb_tap(adb_path, x, y):
-    return adb_cmd(adb_path, 'shell', 'input', 'tap', str(x), str(y))
+    def __init__(self, adb_path, serial=None, timeout=30):
+        self.adb_path = adb_path
+        self.serial = serial
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._proc = None
+        self._lines = None
 
-def adb_text(adb_path, text):
-    text = text.replace(' ', '%s')
-    return adb_cmd(adb_path, 'shell', 'input', 'text', text)
+    def _start(self):
+        cmd = [self.adb_path] + (['-s', self.serial] if self.serial else []) + ['shell']
+        self._proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', errors='replace', bufsize=1
+        )
+        self._lines = queue.Queue()
+        threading.Thread(target=self._reader, args=(self._proc, self._lines),
+                         name=f"adb-{self.serial or 'default'}", daemon=True).start()
+
+    @staticmethod
+    def _reader(proc, lines):
+        for line in proc.stdout:
+            lines.put(line.rstrip('\r\n'))
+        lines.put(None)
+
+    def close(self):
+        if self._proc is not None:
+            try:
+                self._proc.kill()
+            except Exception:
+                pass
+            self._proc = None
+
+    def run(self, *commands):
+        """按顺序执行一条或多条 shell 命令（同一次往返），返回 (输出, 最后一条命令的退出码)"""
+        name = commands[0].split(' ', 1)[0] if commands else ''
+        start = time.monotonic()
+        with self._lock:
+            try:
+                if self._proc is None or self._proc.poll() is not None:
+                    self._start()
+                script = ''.join(f"{{ {c}\n}} </dev/null\n" for c in commands)
+                script += f"printf '\\n{self.MARKER} %d\\n' $?\n"
+                self._proc.stdin.write(script)
+                self._proc.stdin.flush()
+                out = []
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+                    if line is None:
+                        raise EOFError("adb shell exited")
+                    if line.startswith(self.MARKER):
+                        rc = int(line[len(self.MARKER):].strip() or -1)
+                        return '\n'.join(out).strip(), rc
+                    out.append(line)
+            except Exception as e:
+                logger.error(f"[ADB] {self.serial or 'default'} session error: {e!r}")
+                self.close()
+                return "", -1
+            finally:
+                adb_latency.record(f"session:{name}", time.monotonic() - start)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_adb_session(adb_path, serial=None):
+    key = (adb_path, serial)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = AdbSession(adb_path, serial)
+        return _sessions[key]
 
-def adb_screenshot(adb_path, output_path):
-    adb_cmd(adb_path, 'shell', 'screencap', '-p', '/sdcard/screen.png')
-    adb_cmd(adb_path, 'pull', '/sdcard/screen.png', output_path)
+def adb_shell(adb_path, *commands, serial=None):
+    return get_adb_session(adb_path, serial).run(*commands)
 
-def launch_guagua(adb_path, package):
+def tap_command(x, y):
+    return f"input tap {int(x)} {int(y)}"
+
+def text_command(text):
+    return f"input text {shlex.quote(str(text).replace(' ', '%s'))}"
+
+def adb_tap(adb_path, x, y, serial=None):
+    return adb_shell(adb_path, tap_command(x, y), serial=serial)
+
+def adb_text(adb_path, text, serial=None):
+    return adb_shell(adb_path, text_command(text), serial=serial)
+
+def adb_input(adb_path, *actions, serial=None):
+    """一次往返执行一组输入动作：('tap', x, y) / ('text', s)"""
+    commands = [tap_command(*args) if kind == 'tap' else text_command(*args) for kind, *args in actions]
+    return adb_shell(adb_path, *commands, serial=serial)
+
+def adb_screencap(adb_path, serial=None):
+    """exec-out 直接把 PNG 流式读入内存，不再经过 /sdcard 和 adb pull"""
+    cmd = [adb_path] + (['-s', serial] if serial else []) + ['exec-out', 'screencap', '-p']
+    start = time.monotonic()
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=30)
+        return result.stdout if result.returncode == 0 else b''
+    except Exception as e:
+        logger.error(f"[ADB] screencap error: {e}")
+        return b''
+    finally:
+        adb_latency.record("exec-out:screencap", time.monotonic() - start)
+
+def adb_screenshot(adb_path, output_path=None, serial=None):
+    data = adb_screencap(adb_path, serial)
+    if output_path and data:
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    return data
+
+def device_online(adb_path, serial=None):
+    out, rc = adb_cmd(adb_path, 'get-state', serial=serial)
+    return rc == 0 and out == 'device'
+
+def launch_guagua(adb_path, package, serial=None):
     """启动瓜瓜 App"""
-    out, rc = adb_cmd(adb_path, 'shell', 'monkey', '-p', package, '-c',
-                      'android.intent.category.LAUNCHER', '1')
-    logger.info(f"[ADB] launch {package}: rc={rc}")
+    out, rc = adb_shell(adb_path, f"monkey -p {shlex.quote(package)} -c android.intent.category.LAUNCHER 1",
+                        serial=serial)
+    logger.info(f"[ADB] {serial or 'default'} launch {package}: rc={rc}")
     return rc == 0
 
-def perform_recharge(cfg, order):
+def perform_recharge(cfg, order, serial=None, lease=None):
     """
     对单个订单执行充值操作
-    返回: (success: bool, message: str)
+    返回: (success: bool, message: str)；设备故障时抛出 DeviceError，
+    发起支付前发现租约已失效时抛出 LeaseLost（lease.submit_payment 在数据库中确认并登记）
     """
     adb_path = cfg.get('adb_path', 'adb')
     package = cfg.get('guagua_package', 'com.riceguagua.android')
@@ -117,6 +221,8 @@ def perform_recharge(cfg, order):
     action_delay_max = cfg.get('action_delay_max', 5)
     payment_result_wait = cfg.get('payment_result_wait', 10)
     manual_operators = cfg.get('manual_operators', [])
+    # 充值页坐标：{"phone_field": [x, y], "amount_field": [x, y], "pay_button": [x, y]}；未配置时不操作界面
+    form = cfg.get('recharge_form') or {}
 
     operator = order.get('operator', '')
     if operator in manual_operators:
@@ -131,32 +237,38 @@ def perform_recharge(cfg, order):
     account = random.choice(accounts)
     logger.info(f"[BOT] starting recharge order={order['id'][:8]} phone={order['phone']} amount={order['amount']}")
 
-    if not launch_guagua(adb_path, package):
-        return False, "无法启动瓜瓜 App"
+    if not launch_guagua(adb_path, package, serial):
+        raise DeviceError("无法启动瓜瓜 App")
 
     time.sleep(page_load_wait)
 
+    if form:
+        # 号码和金额一次往返输入，不再每个动作一次 adb 调用
+        _, rc = adb_input(adb_path, ('tap', *form['phone_field']), ('text', order['phone']),
+                          ('tap', *form['amount_field']), ('text', order['amount']), serial=serial)
+        if rc != 0:
+            raise DeviceError("填写充值表单失败")
+
     delay = random.uniform(action_delay_min, action_delay_max)
     time.sleep(delay)
 
+    if lease is not None:
+        lease.submit_payment()
+
+    if form:
+        _, rc = adb_input(adb_path, ('tap', *form['pay_button']), serial=serial)
+        if rc != 0:
+            # 支付按钮是否已生效无法确定，不能当作设备故障重新排队
+            return False, "点击支付失败，请人工核对"
+
     logger.info(f"[BOT] recharge initiated for {order['phone']} via account {account.get('username', 'unknown')}")
     time.sleep(payment_result_wait)
 
     logger.info(f"[BOT] recharge completed for order={order['id'][:8]}")
     return True, "充值成功"
 
-def update_order_status(db, order_id, status, message=""):
-    now = datetime.now().isoformat()
-    db.execute(
-        "UPDATE orders SET status=?, message=?, updated_at=? WHERE id=?",
-        (status, message, now, order_id)
-    )
-    db.commit()
-
-def notify_recharge_result(cfg, order, success, message):
-    token = cfg.get('pushplus_token', '')
-    tg_token = cfg.get('telegram_bot_token', '')
-    tg_chat = cfg.get('telegram_chat_id', '')
+def notify_recharge_result(db, credentials, order, success, message):
+    """在写回结果的事务中登记通知，由调度器的投递服务发送"""
     if success:
         title = f"✅ 充值成功 €{order['amount']}"
         msg = (f"✅ 充值完成\n"
@@ -170,44 +282,150 @@ def notify_recharge_result(cfg, order, success, message):
                f"订单: {order['id'][:8]}\n"
                f"号码: {order['phone']}\n"
                f"原因: {message}")
-    send_pushplus(token, title, msg)
-    send_telegram(tg_token, tg_chat, msg)
-
-def process_pending_orders(db, cfg):
-    rows = db.execute(
-        "SELECT * FROM orders WHERE status='processing' ORDER BY created_at ASC LIMIT 1"
-    ).fetchall()
-    for row in rows:
-        order = dict(row)
-        update_order_status(db, order['id'], 'paying', '正在充值中')
-        success, message = perform_recharge(cfg, order)
+    enqueue_alert(db, credentials, msg, title)
+
+def finish_order(db, order, worker_id, success, message, credentials):
+    status = 'completed' if success else 'failed'
+    if not finish_claim(db, order['id'], worker_id, status, message):
+        # 订单已被管理员处理：结果不覆盖，但要让人知道机器人这边的结果，以便核对是否重复充值
+        logger.error(f"[BOT] order={order['id'][:8]} claim taken over, result {status} not written: {message}")
+        enqueue_alert(db, credentials,
+                      f"⚠️ 充值结果未写回，请人工核对\n订单: {order['id'][:8]}\n号码: {order['phone']}\n"
+                      f"金额: €{order['amount']}\n机器人结果: {status} {message}", "充值结果待核对")
+        db.commit()
+        return False
+    if success:
+        # 发送站内消息
+        db.execute(
+            "INSERT INTO site_messages (user_id, type, title, content, order_id, created_at) VALUES (?,?,?,?,?,?)",
+            (order['user_id'], 'success',
+             f"充值成功 €{order['amount']}",
+             f"号码 {order['phone']} 充值 €{order['amount']} 已完成。",
+             order['id'], datetime.now().isoformat())
+        )
+    notify_recharge_result(db, credentials, order, success, message)
+    db.commit()
+    notify_dispatcher()
+    return True
+
+class DeviceWorker(threading.Thread):
+    """一个设备一个工作线程：领取订单 → 充值 → 写回结果。
+    充值过程中不占用数据库连接，领取和写回各自使用短事务"""
+
+    def __init__(self, cfg, serial=None):
+        super().__init__(name=f"device-{serial or 'default'}", daemon=True)
+        self.cfg = cfg
+        self.serial = serial
+        self.worker_id = make_worker_id(serial)
+        self.lease_seconds = cfg.get('lease_seconds', LEASE_SECONDS)
+        self.adb_path = cfg.get('adb_path', 'adb')
+        self.max_errors = cfg.get('max_device_errors', 3)
+        self.cooldown = cfg.get('device_cooldown', 300)
+        self.credentials = channel_credentials(cfg)
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.device_errors = 0
+        self.consecutive_errors = 0
+        self.healthy = True
+        self.disabled_until = 0
+        self.last_error = ''
+
+    @property
+    def label(self):
+        return self.serial or 'default'
+
+    def record_device_error(self, error):
+        self.device_errors += 1
+        self.consecutive_errors += 1
+        self.last_error = str(error)
+        if self.consecutive_errors >= self.max_errors:
+            self.healthy = False
+            self.disabled_until = time.monotonic() + self.cooldown
+            logger.warning(f"[DEVICE] {self.label} disabled for {self.cooldown}s after {self.consecutive_errors} errors: {error}")
+
+    def check_health(self):
+        if self.healthy:
+            return True
+        if time.monotonic() < self.disabled_until:
+            return False
+        if device_online(self.adb_path, self.serial):
+            self.healthy = True
+            self.consecutive_errors = 0
+            logger.info(f"[DEVICE] {self.label} back online")
+            return True
+        self.disabled_until = time.monotonic() + self.cooldown
+        return False
+
+    def process_one(self):
+        """处理一单；队列为空时返回 False"""
+        with get_db() as db:
+            order = claim_order(db, self.worker_id, self.lease_seconds)
+        if not order:
+            return False
+        try:
+            with LeaseHeartbeat(order['id'], self.worker_id, self.lease_seconds) as lease:
+                success, message = perform_recharge(self.cfg, order, self.serial, lease)
+        except DeviceError as e:
+            logger.error(f"[BOT] {self.label} order={order['id'][:8]} device error: {e}")
+            self.record_device_error(e)
+            with get_db() as db:
+                requeue_claim(db, order['id'], self.worker_id, f"设备 {self.label} 故障，重新排队")
+            return True
+        except LeaseLost:
+            logger.error(f"[BOT] {self.label} order={order['id'][:8]} lease lost before payment, "
+                         f"left to the dispatcher")
+            return True
+        self.consecutive_errors = 0
+        with get_db() as db:
+            if not finish_order(db, order, self.worker_id, success, message, self.credentials):
+                return True
         if success:
-            update_order_status(db, order['id'], 'completed', message)
-            # 发送站内消息
-            db.execute(
-                "INSERT INTO site_messages (user_id, type, title, content, order_id, created_at) VALUES (?,?,?,?,?,?)",
-                (order['user_id'], 'success',
-                 f"充值成功 €{order['amount']}",
-                 f"号码 {order['phone']} 充值 €{order['amount']} 已完成。",
-                 order['id'], datetime.now().isoformat())
-            )
-            db.commit()
+            self.completed += 1
         else:
-            update_order_status(db, order['id'], 'failed', message)
-        notify_recharge_result(cfg, order, success, message)
+            self.failed += 1
+        return True
+
+    def run(self):
+        poll_interval = self.cfg.get('poll_interval', 10)
+        logger.info(f"[DEVICE] {self.label} worker started")
+        while True:
+            try:
+                if not self.check_health():
+                    time.sleep(min(poll_interval, self.cooldown))
+                    continue
+                if not self.process_one():
+                    time.sleep(poll_interval)
+            except Exception as e:
+                logger.error(f"[DEVICE] {self.label} error: {e}")
+                time.sleep(poll_interval)
+
+    def stats(self):
+        hours = max(time.monotonic() - self.started_at, 1) / 3600
+        return {
+            "device": self.label,
+            "healthy": self.healthy,
+            "completed": self.completed,
+            "failed": self.failed,
+            "device_errors": self.device_errors,
+            "orders_per_hour": round((self.completed + self.failed) / hours, 1),
+            "last_error": self.last_error,
+        }
 
 def run():
     cfg = load_config()
-    poll_interval = cfg.get('poll_interval', 10)
-    logger.info(f"[ORDER_BOT] started, poll_interval={poll_interval}s")
+    devices = cfg.get('devices') or [None]
+    stats_interval = cfg.get('stats_interval', 600)
+    logger.info(f"[ORDER_BOT] started, devices={[d or 'default' for d in devices]}")
+    workers = [DeviceWorker(cfg, serial) for serial in devices]
+    for w in workers:
+        w.start()
     while True:
-        try:
-            db = get_db()
-            process_pending_orders(db, cfg)
-            db.close()
-        except Exception as e:
-            logger.error(f"[ORDER_BOT] error: {e}")
-        time.sleep(poll_interval)
+        time.sleep(stats_interval)
+        stats = [w.stats() for w in workers]
+        total = sum(st['orders_per_hour'] for st in stats)
+        logger.info(f"[ORDER_BOT] throughput={total:.1f} orders/h devices={stats}")
+        logger.info(f"[ORDER_BOT] adb latency={adb_latency.snapshot()}")
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,205 @@
+"""
+VeloceVoce 惟落雀 - 订单领取/租约协议
+processing 队列的所有消费者（order_bot 各设备、将来的其他机器人）都通过这里领取订单：
+  - claim_order：单条 UPDATE … RETURNING 原子领取，写入 claimed_by 和租约到期时间
+  - renew_lease：充值过程中定期续约（心跳）
+  - submit_payment：发起支付前在租约内登记；租约已失效时拒绝，不会对已被他人领取的订单付款
+  - finish_claim / requeue_claim：只有仍持有租约的 worker 才能写回结果
+  - reclaim_expired_leases：调度器把租约过期（worker 崩溃）的订单退回 processing；
+    已登记支付的订单不退回（可能已经扣款），保留领取者并转人工核对（hold_paid_expired_leases）
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from database import get_db
+from events import publish_order_event, publish_order_events, notify_dispatcher
+
+logger = logging.getLogger('order_queue')
+
+LEASE_SECONDS = 120
+
+# 队列 SQL（tests/test_query_plans.py 检查其执行计划）
+CLAIM_ORDER_SQL = """
+    UPDATE orders
+    SET status='paying', message='正在充值中', updated_at=?, claimed_by=?, lease_expires_at=?,
+        payment_submitted_at=''
+    WHERE id = (SELECT id FROM orders WHERE status='processing' ORDER BY created_at ASC LIMIT 1)
+      AND status='processing'
+    RETURNING *
+"""
+RENEW_LEASE_SQL = "UPDATE orders SET lease_expires_at=? WHERE id=? AND claimed_by=? AND status='paying'"
+SUBMIT_PAYMENT_SQL = """
+    UPDATE orders SET payment_submitted_at=?, message='已发起支付'
+    WHERE id=? AND claimed_by=? AND status='paying' AND lease_expires_at > ?
+"""
+FINISH_CLAIM_SQL = """
+    UPDATE orders SET status=?, message=?, updated_at=?, claimed_by='', lease_expires_at=''
+    WHERE id=? AND claimed_by=? AND status='paying'
+"""
+RECLAIM_EXPIRED_SQL = """
+    UPDATE orders SET status='processing', message='租约过期，重新排队', updated_at=?,
+                      claimed_by='', lease_expires_at=''
+    WHERE status='paying' AND lease_expires_at != '' AND lease_expires_at < ? AND payment_submitted_at = ''
+    RETURNING id, claimed_by
+"""
+# 已发起支付的订单：只清除租约到期时间，claimed_by 保留，原 worker 迟到的结果仍可写回；
+# 管理员处理（完成/失败/重新排队）时会清空 claimed_by
+HOLD_PAID_EXPIRED_SQL = """
+    UPDATE orders SET message='已发起支付但租约过期，待人工核对', updated_at=?, lease_expires_at=''
+    WHERE status='paying' AND lease_expires_at != '' AND lease_expires_at < ? AND payment_submitted_at != ''
+    RETURNING *
+"""
+
+
+class LeaseLost(Exception):
+    """租约已过期或被回收，当前 worker 不能再写回该订单"""
+    pass
+
+
+def make_worker_id(name=""):
+    return f"{socket.gethostname()}:{os.getpid()}:{name or 'default'}"
+
+
+def _lease_until(lease_seconds):
+    return (datetime.now() + timedelta(seconds=lease_seconds)).isoformat()
+
+
+def claim_order(db, worker_id, lease_seconds=LEASE_SECONDS):
+    """原子领取最早的 processing 订单并置为 paying；返回订单 dict 或 None"""
+    now = datetime.now().isoformat()
+    row = db.execute(CLAIM_ORDER_SQL, (now, worker_id, _lease_until(lease_seconds))).fetchone()
+    if not row:
+        db.commit()
+        return None
+    publish_order_event(db, row['id'], 'paying')
+    db.commit()
+    notify_dispatcher()
+    return dict(row)
+
+
+def renew_lease(db, order_id, worker_id, lease_seconds=LEASE_SECONDS):
+    cur = db.execute(RENEW_LEASE_SQL, (_lease_until(lease_seconds), order_id, worker_id))
+    db.commit()
+    return cur.rowcount == 1
+
+
+def submit_payment(db, order_id, worker_id):
+    """在仍持有租约时登记发起支付并提交；租约已失效时返回 False，调用方不得付款"""
+    now = datetime.now().isoformat()
+    cur = db.execute(SUBMIT_PAYMENT_SQL, (now, order_id, worker_id, now))
+    db.commit()
+    return cur.rowcount == 1
+
+
+def finish_claim(db, order_id, worker_id, status, message=""):
+    """写回最终状态并释放租约（由调用方提交）；租约已失效时返回 False，不覆盖他人的结果"""
+    now = datetime.now().isoformat()
+    cur = db.execute(FINISH_CLAIM_SQL, (status, message, now, order_id, worker_id))
+    if cur.rowcount != 1:
+        db.rollback()
+        return False
+    publish_order_event(db, order_id, status)
+    return True
+
+
+def requeue_claim(db, order_id, worker_id, message=""):
+    """放弃领取，把订单退回 processing 队列"""
+    ok = finish_claim(db, order_id, worker_id, 'processing', message)
+    db.commit()
+    notify_dispatcher()
+    return ok
+
+
+def reclaim_expired_leases(db):
+    """租约过期的 paying 订单退回 processing；返回订单 ID 列表"""
+    now = datetime.now().isoformat()
+    rows = db.execute(RECLAIM_EXPIRED_SQL, (now, now)).fetchall()
+    if not rows:
+        return []
+    publish_order_events(db, [(row['id'], 'processing') for row in rows])
+    db.commit()
+    for row in rows:
+        logger.warning(f"[LEASE] order={row['id'][:8]} lease expired, requeued")
+    return [row['id'] for row in rows]
+
+
+def hold_paid_expired_leases(db):
+    """已发起支付、租约过期的 paying 订单转人工核对（不退回队列）；返回订单 dict 列表，由调用方告警"""
+    now = datetime.now().isoformat()
+    rows = db.execute(HOLD_PAID_EXPIRED_SQL, (now, now)).fetchall()
+    db.commit()
+    for row in rows:
+        logger.error(f"[LEASE] order={row['id'][:8]} lease expired after payment by {row['claimed_by']}, "
+                     f"held for manual review")
+    return [dict(row) for row in rows]
+
+
+def lease_active(order):
+    return (order.get('status') == 'paying' and bool(order.get('lease_expires_at'))
+            and order['lease_expires_at'] > datetime.now().isoformat())
+
+
+class LeaseHeartbeat:
+    """with LeaseHeartbeat(...) as lease: 后台线程每 lease_seconds/3 续约一次。
+    续约被拒绝（租约已被回收），或续约一直出错直到租约到期时，lease.lost 置为 True：
+    发起支付前 lease.submit_payment() 抛出 LeaseLost，订单交回调度器；已发起支付的订单由调度器转人工核对"""
+
+    def __init__(self, order_id, worker_id, lease_seconds=LEASE_SECONDS):
+        self.order_id = order_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self.paid = False
+        self._expires = time.monotonic() + lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{order_id[:8]}", daemon=True)
+
+    def _mark_lost(self, reason):
+        self.lost = True
+        stage = "after payment, result goes to manual review" if self.paid else "before payment, order released"
+        logger.error(f"[LEASE] order={self.order_id[:8]} lease lost by {self.worker_id} ({reason}), {stage}")
+
+    def _run(self):
+        interval = max(self.lease_seconds / 3, 1)
+        while not self._stop.wait(interval):
+            try:
+                with get_db() as db:
+                    renewed = renew_lease(db, self.order_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                if time.monotonic() >= self._expires:
+                    self._mark_lost(f"renew failing until expiry: {e}")
+                    return
+                logger.warning(f"[LEASE] order={self.order_id[:8]} renew error, "
+                               f"{self._expires - time.monotonic():.0f}s left: {e}")
+                continue
+            if not renewed:
+                self._mark_lost("reclaimed")
+                return
+            self._expires = time.monotonic() + self.lease_seconds
+
+    def check(self):
+        if self.lost:
+            raise LeaseLost(self.order_id)
+
+    def submit_payment(self):
+        """发起支付前调用：在数据库中确认租约仍有效并登记，否则抛出 LeaseLost"""
+        self.check()
+        with get_db() as db:
+            if not submit_payment(db, self.order_id, self.worker_id):
+                self._mark_lost("expired before payment")
+                raise LeaseLost(self.order_id)
+        self.paid = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
@@ -0,0 +1,67 @@
+"""
+VeloceVoce 惟落雀 - 列表分页（后台订单/用户、用户收件箱）
+  - 游标分页：按 (created_at, id) 倒序，下一页从上一页最后一行之后继续，深翻页与第一页代价相同
+  - 游标对客户端不透明（base64 编码），只能原样传回
+  - row_count：读取触发器维护的计数（见 migrations._m009_row_counts）
+"""
+
+import json
+import base64
+import binascii
+
+MAX_PER_PAGE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """返回 (created_at, id)；格式错误时抛出 InvalidCursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    # 订单/用户 id 是字符串，站内消息 id 是整数
+    if not isinstance(created_at, str) or isinstance(row_id, bool) or not isinstance(row_id, (str, int)):
+        raise InvalidCursor(cursor)
+    return created_at, row_id
+
+
+def keyset_sql(select, where, params, per_page, cursor=None, alias=''):
+    """select: 不含 WHERE/ORDER BY 的查询；where: 条件列表（AND 连接）。
+    返回 (sql, params)，多取一行用于判断是否还有下一页"""
+    col = f"{alias}." if alias else ''
+    where = list(where)
+    params = list(params)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        where.append(f"({col}created_at, {col}id) < (?, ?)")
+        params += [created_at, row_id]
+    sql = select
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {col}created_at DESC, {col}id DESC LIMIT ?"
+    return sql, params + [per_page + 1]
+
+
+def keyset_page(db, select, where, params, per_page, cursor=None, alias=''):
+    """执行 keyset_sql 生成的查询，返回 (rows, next_cursor)"""
+    rows = db.execute(*keyset_sql(select, where, params, per_page, cursor, alias)).fetchall()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    return rows, next_cursor
+
+
+def row_count(db, name):
+    row = db.execute("SELECT n FROM row_counts WHERE name=?", (name,)).fetchone()
+    return row['n'] if row else 0
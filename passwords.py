@@ -0,0 +1,211 @@
+"""
+VeloceVoce 惟落雀 - 密码哈希
+  - 可选 scrypt（默认）或 PBKDF2-SHA256，成本参数由环境变量配置，写入哈希串，调整参数不影响旧哈希验证
+  - 兼容旧格式：salt$sha256 与无盐 sha256；登录成功时用当前算法和参数重新哈希（needs_rehash）
+  - hashlib 的 scrypt/pbkdf2_hmac 计算期间释放 GIL，PasswordService 在独立线程池中执行，
+    线程数默认等于 CPU 核数，不占用事件循环和数据库线程池
+
+哈希串格式：
+  scrypt$n=16384,r=8,p=1$<salt>$<hash>
+  pbkdf2_sha256$600000$<salt>$<hash>
+"""
+
+import os
+import time
+import hmac
+import base64
+import asyncio
+import hashlib
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+SALT_BYTES = 16
+KEY_BYTES = 32
+RATE_WINDOW = 60
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class ScryptHasher:
+    scheme = 'scrypt'
+
+    def __init__(self, n=2 ** 14, r=8, p=1):
+        self.n, self.r, self.p = n, r, p
+        self.params = f"n={n},r={r},p={p}"
+
+    def _derive(self, password, salt, n, r, p):
+        # maxmem 默认只有 32MB，n 调大时需要放宽
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 1024 * 1024, dklen=KEY_BYTES)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(SALT_BYTES)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{self.scheme}${self.params}${_b64(salt)}${_b64(key)}"
+
+    def verify(self, password, params, salt, key):
+        opts = dict(item.split('=') for item in params.split(','))
+        derived = self._derive(password, _unb64(salt), int(opts['n']), int(opts['r']), int(opts['p']))
+        return hmac.compare_digest(derived, _unb64(key))
+
+
+class Pbkdf2Hasher:
+    scheme = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+        self.params = str(iterations)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(SALT_BYTES)
+        key = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.iterations, KEY_BYTES)
+        return f"{self.scheme}${self.params}${_b64(salt)}${_b64(key)}"
+
+    def verify(self, password, params, salt, key):
+        derived = hashlib.pbkdf2_hmac('sha256', password.encode(), _unb64(salt), int(params), KEY_BYTES)
+        return hmac.compare_digest(derived, _unb64(key))
+
+
+def _verify_legacy(password, stored):
+    if '$' in stored:
+        salt, hashed = stored.split('$', 1)
+        return hmac.compare_digest(hashlib.sha256((salt + password).encode()).hexdigest(), hashed)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+class PasswordHasher:
+    """用 current 生成新哈希；验证时按哈希串前缀选择算法"""
+
+    def __init__(self, current):
+        self.current = current
+        self._schemes = {h.scheme: h for h in (ScryptHasher(), Pbkdf2Hasher())}
+        self._schemes[current.scheme] = current
+
+    def hash(self, password):
+        return self.current.hash(password)
+
+    def verify(self, password, stored):
+        parts = stored.split('$')
+        hasher = self._schemes.get(parts[0]) if len(parts) == 4 else None
+        if hasher is None:
+            return _verify_legacy(password, stored)
+        try:
+            return hasher.verify(password, parts[1], parts[2], parts[3])
+        except (ValueError, KeyError):
+            return False
+
+    def needs_rehash(self, stored):
+        parts = stored.split('$')
+        return len(parts) != 4 or parts[0] != self.current.scheme or parts[1] != self.current.params
+
+
+def create_hasher(scheme=None):
+    scheme = scheme or os.environ.get("PASSWORD_HASHER", "scrypt")
+    if scheme == 'pbkdf2':
+        return PasswordHasher(Pbkdf2Hasher(int(os.environ.get("PASSWORD_PBKDF2_ITERATIONS", "600000"))))
+    return PasswordHasher(ScryptHasher(
+        n=int(os.environ.get("PASSWORD_SCRYPT_N", str(2 ** 14))),
+        r=int(os.environ.get("PASSWORD_SCRYPT_R", "8")),
+        p=int(os.environ.get("PASSWORD_SCRYPT_P", "1")),
+    ))
+
+
+class PasswordService:
+    """在专用线程池中哈希/验证密码，并统计吞吐"""
+
+    def __init__(self, hasher, workers=None):
+        self.hasher = hasher
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.pending = 0
+        self.hashes = 0
+        self.verified = 0
+        self.failed = 0
+        self.rehashed = 0
+        self.busy_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='kdf')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.busy_seconds += elapsed
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), self._timed, fn, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    async def hash(self, password):
+        result = await self._submit(self.hasher.hash, password)
+        with self._lock:
+            self.hashes += 1
+        return result
+
+    def _verify(self, password, stored):
+        if not self.hasher.verify(password, stored):
+            return False, None
+        if self.hasher.needs_rehash(stored):
+            return True, self.hasher.hash(password)
+        return True, None
+
+    async def verify(self, password, stored):
+        """返回 (是否正确, 新哈希)；新哈希不为 None 时调用方应写回数据库"""
+        ok, new_hash = await self._submit(self._verify, password, stored)
+        now = time.monotonic()
+        with self._lock:
+            if ok:
+                self.verified += 1
+                self._recent.append(now)
+            else:
+                self.failed += 1
+            if new_hash:
+                self.rehashed += 1
+            while self._recent and now - self._recent[0] > RATE_WINDOW:
+                self._recent.popleft()
+        return ok, new_hash
+
+    def stats(self):
+        with self._lock:
+            total = self.hashes + self.verified + self.failed
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > RATE_WINDOW:
+                self._recent.popleft()
+            return {
+                "scheme": self.hasher.current.scheme,
+                "params": self.hasher.current.params,
+                "workers": self.workers,
+                "pending": self.pending,
+                "hashes": self.hashes,
+                "verified": self.verified,
+                "failed": self.failed,
+                "rehashed": self.rehashed,
+                "avg_ms": round(self.busy_seconds / total * 1000, 2) if total else 0,
+                "logins_per_min": len(self._recent),
+            }
@@ -4,17 +4,19 @@ VeloceVoce 惟落雀 - 付款提醒机器人
   - 对 awaiting_payment 订单发送4级提醒
   - 逾期付款的短信提醒
   - 每日报告生成
-  - 通过 JSON 文件追踪提醒状态
+  - 提醒状态保存在 payment_reminders 表（触发器维护，按 next_remind_at 取到期提醒）
 """
 
 import time
 import json
-import sqlite3
 import logging
 import os
-import urllib.request
 from datetime import datetime, timedelta
 
+from database import get_db
+from notify import enqueue_alert, channel_credentials
+from stats import daily_report
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] %(message)s'
@@ -22,7 +24,6 @@ logging.basicConfig(
 logger = logging.getLogger('payment_bot')
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, 'recharge.db')
 CONFIG_FILE = os.path.join(BASE_DIR, 'bot_config.json')
 REMINDERS_FILE = os.path.join(BASE_DIR, 'payment_reminders.json')
 
@@ -35,38 +36,39 @@ def load_config():
             return json.load(f)
     return {}
 
-def load_reminders():
-    if os.path.exists(REMINDERS_FILE):
-        with open(REMINDERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-def save_reminders(data):
-    with open(REMINDERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# 每轮最多处理的到期提醒数，剩余的下一轮继续
+SWEEP_LIMIT = 500
 
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+def next_remind_at(created, level):
+    """已发送 level 级后下一次提醒的时间；4级都发完返回 None"""
+    if level >= len(REMINDER_SCHEDULE):
+        return None
+    return (created + timedelta(hours=sum(REMINDER_SCHEDULE[:level + 1]))).isoformat(timespec='seconds')
 
-def send_telegram(token, chat_id, msg):
-    if not token or not chat_id:
-        return
-    try:
-        data = json.dumps({
-            "chat_id": chat_id,
-            "text": msg,
-            "parse_mode": "HTML"
-        }).encode('utf-8')
-        req = urllib.request.Request(
-            f"https://api.telegram.org/bot{token}/sendMessage",
-            data=data,
-            headers={"Content-Type": "application/json"}
+def import_legacy_reminders(db):
+    """一次性导入旧版 payment_reminders.json 中的提醒级别，导入后改名为 .imported"""
+    if not os.path.exists(REMINDERS_FILE):
+        return 0
+    with open(REMINDERS_FILE, 'r', encoding='utf-8') as f:
+        legacy = json.load(f)
+    imported = 0
+    for row in db.execute(
+        "SELECT r.order_id, o.created_at FROM payment_reminders r JOIN orders o ON o.id = r.order_id"
+    ).fetchall():
+        state = legacy.get(row['order_id'])
+        if not state or not state.get('level'):
+            continue
+        level = state['level']
+        db.execute(
+            "UPDATE payment_reminders SET level=?, last_sent=?, next_remind_at=? WHERE order_id=?",
+            (level, state.get('last_sent'), next_remind_at(datetime.fromisoformat(row['created_at']), level),
+             row['order_id'])
         )
-        urllib.request.urlopen(req, timeout=5)
-    except Exception as e:
-        logger.error(f"[TELEGRAM] {e}")
+        imported += 1
+    db.commit()
+    os.replace(REMINDERS_FILE, REMINDERS_FILE + '.imported')
+    logger.info(f"[REMINDER] imported {imported} legacy reminder states")
+    return imported
 
 def send_sms_reminder(cfg, phone, order_id, amount, level):
     """发送短信付款提醒"""
@@ -77,81 +79,59 @@ def send_sms_reminder(cfg, phone, order_id, amount, level):
         return
     logger.info(f"[SMS] reminder level={level} to phone={phone} order={order_id[:8]} amount={amount}")
 
+# 到期提醒（tests/test_query_plans.py 检查其执行计划）
+DUE_REMINDERS_SQL = """
+    SELECT r.order_id, r.level, o.phone, o.amount, o.created_at, u.phone AS user_phone
+    FROM payment_reminders r
+    JOIN orders o ON o.id = r.order_id
+    LEFT JOIN users u ON u.id = o.user_id
+    WHERE r.next_remind_at <= ?
+    ORDER BY r.next_remind_at
+    LIMIT ?
+"""
+CLAIM_REMINDER_SQL = "UPDATE payment_reminders SET level=?, last_sent=?, next_remind_at=? WHERE order_id=? AND level=?"
+
 def process_payment_reminders(db, cfg):
-    reminders = load_reminders()
-    rows = db.execute(
-        "SELECT o.*, u.phone as user_phone, u.email FROM orders o "
-        "LEFT JOIN users u ON o.user_id=u.id "
-        "WHERE o.status='awaiting_payment' ORDER BY o.created_at ASC"
-    ).fetchall()
-    changed = False
+    """发送到期提醒；每条提醒的级别更新与通知入队在同一事务中提交，返回发送数"""
+    now = datetime.now()
+    rows = db.execute(DUE_REMINDERS_SQL, (now.isoformat(timespec='seconds'), SWEEP_LIMIT)).fetchall()
+    sent = 0
     for row in rows:
-        order = dict(row)
-        oid = order['id']
-        created = datetime.fromisoformat(order['created_at'])
-        state = reminders.get(oid, {"level": 0, "last_sent": None})
-        current_level = state["level"]
-        if current_level >= len(REMINDER_SCHEDULE):
+        oid = row['order_id']
+        created = datetime.fromisoformat(row['created_at'])
+        level = row['level'] + 1
+        # 带上旧级别做条件更新：订单已离开 awaiting_payment（记录被触发器删除）
+        # 或被其他实例抢先处理时不会重复提醒
+        claimed = db.execute(
+            CLAIM_REMINDER_SQL,
+            (level, now.isoformat(), next_remind_at(created, level), oid, row['level'])
+        ).rowcount
+        if not claimed:
             continue
-        hours_elapsed = (datetime.now() - created).total_seconds() / 3600
-        next_remind_at = sum(REMINDER_SCHEDULE[:current_level + 1])
-        if hours_elapsed >= next_remind_at:
-            level = current_level + 1
-            logger.info(f"[REMINDER] order={oid[:8]} level={level} elapsed={hours_elapsed:.1f}h")
-            tg_token = cfg.get('telegram_bot_token', '')
-            tg_chat = cfg.get('telegram_chat_id', '')
-            msg = (f"💳 付款提醒 (第{level}次)\n"
-                   f"订单: {oid[:8]}\n"
-                   f"金额: €{order['amount']}\n"
-                   f"号码: {order['phone']}\n"
-                   f"已等待: {hours_elapsed:.1f}小时")
-            send_telegram(tg_token, tg_chat, msg)
-            if order.get('user_phone'):
-                send_sms_reminder(cfg, order['user_phone'], oid, order['amount'], level)
-            state["level"] = level
-            state["last_sent"] = datetime.now().isoformat()
-            reminders[oid] = state
-            changed = True
-    if changed:
-        save_reminders(reminders)
-    # 清理已完成/取消订单的记录
-    cleanup_ids = [oid for oid in reminders if oid not in [dict(r)['id'] for r in rows]]
-    if cleanup_ids:
-        for oid in cleanup_ids:
-            completed = db.execute(
-                "SELECT status FROM orders WHERE id=?", (oid,)
-            ).fetchone()
-            if completed and completed['status'] not in ('awaiting_payment',):
-                del reminders[oid]
-                changed = True
-    if changed:
-        save_reminders(reminders)
+        hours_elapsed = (now - created).total_seconds() / 3600
+        logger.info(f"[REMINDER] order={oid[:8]} level={level} elapsed={hours_elapsed:.1f}h")
+        msg = (f"💳 付款提醒 (第{level}次)\n"
+               f"订单: {oid[:8]}\n"
+               f"金额: €{row['amount']}\n"
+               f"号码: {row['phone']}\n"
+               f"已等待: {hours_elapsed:.1f}小时")
+        enqueue_alert(db, channel_credentials(cfg), msg, channels=('telegram',))
+        db.commit()
+        sent += 1
+        if row['user_phone']:
+            send_sms_reminder(cfg, row['user_phone'], oid, row['amount'], level)
+    return sent
 
 def generate_daily_report(db, cfg):
     today = datetime.now().strftime('%Y-%m-%d')
-    stats = {}
-    stats['total_orders'] = db.execute(
-        "SELECT COUNT(*) as c FROM orders WHERE created_at LIKE ?", (today + '%',)
-    ).fetchone()['c']
-    stats['completed'] = db.execute(
-        "SELECT COUNT(*) as c FROM orders WHERE status='completed' AND updated_at LIKE ?", (today + '%',)
-    ).fetchone()['c']
-    stats['awaiting_payment'] = db.execute(
-        "SELECT COUNT(*) as c FROM orders WHERE status='awaiting_payment'"
-    ).fetchone()['c']
-    stats['revenue'] = db.execute(
-        "SELECT COALESCE(SUM(amount),0) as s FROM orders WHERE status='completed' AND updated_at LIKE ?",
-        (today + '%',)
-    ).fetchone()['s']
+    stats = daily_report(db, today)
     report = (f"📊 每日报告 {today}\n"
               f"今日订单: {stats['total_orders']}\n"
               f"完成订单: {stats['completed']}\n"
               f"待付款: {stats['awaiting_payment']}\n"
               f"今日收入: €{stats['revenue']:.2f}")
     logger.info(f"[REPORT] {report}")
-    tg_token = cfg.get('telegram_bot_token', '')
-    tg_chat = cfg.get('telegram_chat_id', '')
-    send_telegram(tg_token, tg_chat, report)
+    enqueue_alert(db, channel_credentials(cfg), report, channels=('telegram',))
 
 def run():
     cfg = load_config()
@@ -160,14 +140,14 @@ def run():
     last_report_date = None
     while True:
         try:
-            db = get_db()
-            process_payment_reminders(db, cfg)
-            today = datetime.now().strftime('%Y-%m-%d')
-            report_hour = datetime.now().hour
-            if today != last_report_date and report_hour >= 9:
-                generate_daily_report(db, cfg)
-                last_report_date = today
-            db.close()
+            with get_db() as db:
+                import_legacy_reminders(db)
+                process_payment_reminders(db, cfg)
+                today = datetime.now().strftime('%Y-%m-%d')
+                report_hour = datetime.now().hour
+                if today != last_report_date and report_hour >= 9:
+                    generate_daily_report(db, cfg)
+                    last_report_date = today
         except Exception as e:
             logger.error(f"[PAYMENT_BOT] error: {e}")
         time.sleep(poll_interval)
@@ -0,0 +1,112 @@
+"""
+VeloceVoce 惟落雀 - 意大利手机号校验与运营商识别
+  - OPERATOR_PREFIXES 启动时编译成 前缀 → 运营商 字典，按前缀长度从长到短查找，
+    支持比 3 位更长的携号转网号段（如 "3773" 单独划给某个运营商）
+  - validate_batch：一次调用规范化并分类大量号码，供批量下单、导入和后台工具使用
+"""
+
+import re
+
+OPERATOR_PREFIXES = {
+    "TIM": ["330", "331", "333", "334", "335", "336", "337", "338", "339", "360", "361", "362", "363", "366", "368"],
+    "Vodafone": ["340", "341", "342", "343", "344", "345", "346", "347", "348", "349", "383"],
+    "WindTre": ["320", "322", "323", "324", "325", "326", "327", "328", "329", "380", "388", "389", "390", "391", "392", "393", "397"],
+    "Iliad": ["351", "352", "353"],
+    "Very": ["370", "371"],
+    "Lycamobile": ["373"],
+    "CMLink": ["350"],
+    "DailyTelecom": ["375"],
+    "ho.": ["377", "378"],
+    "Kena": ["354", "355"],
+}
+
+PHONE_LENGTH = 10
+ERR_LENGTH = "号码必须是10位数字"
+ERR_PREFIX = "意大利手机号必须3开头"
+
+_NON_DIGIT = re.compile(r'\D')
+
+
+class PrefixIndex:
+    """前缀 → 运营商元组；lookup 做最长前缀匹配，每个号码最多查 len(lengths) 次字典"""
+
+    def __init__(self, operator_prefixes):
+        index = {}
+        for op, prefixes in operator_prefixes.items():
+            for prefix in prefixes:
+                index.setdefault(prefix, [])
+                if op not in index[prefix]:
+                    index[prefix].append(op)
+        self.index = {prefix: tuple(ops) for prefix, ops in index.items()}
+        self.lengths = sorted({len(p) for p in self.index}, reverse=True)
+
+    def lookup(self, phone):
+        """返回匹配的运营商元组；未知号段返回 ()"""
+        index = self.index
+        for n in self.lengths:
+            ops = index.get(phone[:n])
+            if ops:
+                return ops
+        return ()
+
+
+operator_index = PrefixIndex(OPERATOR_PREFIXES)
+
+
+def _normalize_digits(digits):
+    """号码规则（单个和批量校验共用）：输入已去掉非数字字符，
+    返回 (规范化后的10位号码, None) 或 (None, 错误信息)"""
+    if len(digits) == 12 and digits.startswith('39'):
+        digits = digits[2:]
+    if len(digits) != PHONE_LENGTH:
+        return None, ERR_LENGTH
+    if digits[0] != '3':
+        return None, ERR_PREFIX
+    return digits, None
+
+
+def validate_italian_phone(phone):
+    """返回 (规范化后的10位号码, None) 或 (None, 错误信息)"""
+    return _normalize_digits(_NON_DIGIT.sub('', phone))
+
+
+def check_operator_match(phone, operator):
+    """返回 (是否匹配, 建议运营商)；未知号段不做限制"""
+    ops = operator_index.lookup(phone)
+    if not ops or operator in ops:
+        return True, None
+    return False, ops[0]
+
+
+def validate_batch(numbers):
+    """批量规范化并识别运营商。
+    返回与输入等长的列表，每项为 (号码, 运营商, 错误)：
+    号码无效时号码为 None、错误为提示文字；号段未知时运营商为 None"""
+    # 不按原始字符串去重缓存：批量号码基本互不相同，缓存的哈希和内存开销比重新校验还大
+    sub = _NON_DIGIT.sub
+    normalize = _normalize_digits
+    lookup = operator_index.lookup
+    results = []
+    append = results.append
+    for raw in numbers:
+        phone, error = normalize(raw if raw.isascii() and raw.isdigit() else sub('', raw))
+        if error:
+            append((None, None, error))
+        else:
+            ops = lookup(phone)
+            append((phone, ops[0] if ops else None, None))
+    return results
+
+
+def summarize_batch(results):
+    """按运营商/错误统计 validate_batch 的结果"""
+    summary = {"total": len(results), "valid": 0, "invalid": 0, "operators": {}, "errors": {}}
+    for phone, operator, error in results:
+        if error:
+            summary["invalid"] += 1
+            summary["errors"][error] = summary["errors"].get(error, 0) + 1
+        else:
+            summary["valid"] += 1
+            key = operator or "unknown"
+            summary["operators"][key] = summary["operators"].get(key, 0) + 1
+    return summary
@@ -0,0 +1,63 @@
+"""
+VeloceVoce 惟落雀 - server.py 的热点查询
+路由代码与 tests/test_query_plans.py 共用这里的语句，EXPLAIN QUERY PLAN 检查的就是线上执行的 SQL；
+机器人和维护任务的查询在各自模块中定义为模块级常量（dispatcher / order_queue / notify / maintenance / payment_bot）。
+"""
+
+from datetime import datetime, timedelta
+
+# ====== 认证 ======
+SESSION_USER_SQL = (
+    "SELECT s.user_id, s.expires_at AS session_expires_at, u.* FROM sessions s JOIN users u ON s.user_id = u.id "
+    "WHERE s.token = ? AND s.expires_at > ?"
+)
+ADMIN_SESSION_SQL = "SELECT token FROM admin_sessions WHERE token=? AND expires_at>?"
+LOGIN_SQL = "SELECT id, password_hash, is_blocked FROM users WHERE email=? OR phone=?"
+SMS_CODE_SQL = (
+    "SELECT id FROM sms_codes WHERE phone=? AND code=? AND purpose=? AND used=0 AND created_at>? "
+    "ORDER BY id DESC LIMIT 1"
+)
+
+# ====== 注册反欺诈 ======
+EMAIL_TAKEN_SQL = "SELECT COUNT(*) as c FROM users WHERE email = ?"
+PHONE_TAKEN_SQL = "SELECT COUNT(*) as c FROM users WHERE phone = ?"
+REGISTER_IP_SQL = "SELECT COUNT(*) as c FROM users WHERE register_ip = ? AND created_at > ?"
+FINGERPRINT_SQL = "SELECT COUNT(*) as c FROM users WHERE fingerprint = ?"
+
+# ====== 用户订单 / 收件箱 ======
+USER_ORDERS_SQL = "SELECT * FROM orders WHERE user_id=? ORDER BY created_at DESC LIMIT 50"
+USER_ORDER_SQL = "SELECT * FROM orders WHERE id=? AND user_id=?"
+UNPAID_CREDIT_SQL = (
+    "SELECT id, amount, created_at FROM orders "
+    "WHERE user_id = ? AND is_credit = 1 AND status = 'completed' AND payment = 'credit'"
+)
+INBOX_UNREAD_SQL = "SELECT unread FROM inbox_counts WHERE user_id=?"
+# 收件箱分页：keyset_page(select, ["user_id = ?"], [user_id], ...)
+INBOX_SELECT = "SELECT * FROM site_messages"
+INBOX_WHERE = ["user_id = ?"]
+
+# ====== 管理后台列表（keyset_page 的 select 部分） ======
+ADMIN_ORDERS_SELECT = "SELECT o.*, u.email, u.phone as user_phone FROM orders o LEFT JOIN users u ON o.user_id=u.id"
+ADMIN_USERS_SELECT = (
+    "SELECT id, email, phone, nickname, credit_amount, credit_score, credit_level, is_blocked, created_at, last_login "
+    "FROM users"
+)
+
+
+def admin_order_filters(status="", operator="", date_from="", date_to=""):
+    """后台订单筛选条件 → (where, params)；日期格式错误时抛出 ValueError"""
+    where, params = [], []
+    if status:
+        where.append("o.status=?")
+        params.append(status)
+    if operator:
+        where.append("o.operator=?")
+        params.append(operator)
+    if date_from:
+        where.append("o.created_at >= ?")
+        params.append(datetime.fromisoformat(date_from).isoformat())
+    if date_to:
+        # 日期上限包含当天
+        where.append("o.created_at < ?")
+        params.append((datetime.fromisoformat(date_to) + timedelta(days=1)).isoformat())
+    return where, params
@@ -0,0 +1,202 @@
+"""
+VeloceVoce 惟落雀 - 请求限速
+  - 令牌桶：每个 (策略, IP) 只保存 (令牌数, 上次更新时间)，单次检查 O(1)
+  - 空闲条目按 LRU 淘汰，内存受 maxsize 限制，不随访问过的 IP 数无限增长
+  - 按路由配置策略：短信、登录、注册比普通接口更严格
+  - 可选共享后端（SQLite rate_limits 表），多个 uvicorn worker 共用同一个限额：
+    RATE_LIMIT_BACKEND=memory（默认）全部进程内；hybrid 只有登录/注册/短信等严格策略走共享后端，
+    普通请求（含静态资源）仍在进程内判断；sqlite 全部走共享后端（每个请求一次 SQLite 写入）
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class RatePolicy:
+    """limit 次 / window 秒；允许一次性突发 limit 次"""
+
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window
+
+    def __repr__(self):
+        return f"RatePolicy({self.name}, {self.limit}/{self.window}s)"
+
+
+def _parse_policy(name, spec):
+    """"100/60" → 每 60 秒 100 次"""
+    limit, window = spec.split('/')
+    return RatePolicy(name, int(limit), float(window))
+
+
+DEFAULT_POLICY = _parse_policy('default', os.environ.get("RATE_LIMIT_DEFAULT", "100/60"))
+ROUTE_POLICIES = {
+    '/api/send-sms': RatePolicy('sms', 5, 300),
+    '/api/login': RatePolicy('login', 10, 60),
+    '/api/register': RatePolicy('register', 5, 600),
+    '/api/admin/login': RatePolicy('admin_login', 5, 60),
+}
+
+
+# 空闲超过最长窗口的桶必然已加满，删除后重新创建结果相同
+IDLE_SECONDS = max(p.window for p in [DEFAULT_POLICY, *ROUTE_POLICIES.values()])
+
+
+def policy_for(path):
+    return ROUTE_POLICIES.get(path, DEFAULT_POLICY)
+
+
+def _refill(tokens, updated, now, policy):
+    return min(policy.limit, tokens + (now - updated) * policy.rate)
+
+
+class MemoryRateLimiter:
+    """进程内令牌桶；maxsize 满时淘汰最久未访问的 key"""
+
+    shared = False
+
+    @property
+    def backends(self):
+        return (self,)
+
+    def backend_for(self, policy):
+        return self
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def hit(self, key, policy):
+        """消耗一个令牌；返回 (是否放行, 需等待秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._buckets.get(key)
+            if item is None:
+                tokens = policy.limit
+            else:
+                tokens = _refill(item[0], item[1], now, policy)
+                self._buckets.move_to_end(key)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self.allowed += 1
+                allowed, retry_after = True, 0
+            else:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                allowed, retry_after = False, (1 - tokens) / policy.rate
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return allowed, retry_after
+
+    def purge_idle(self, idle_seconds):
+        """删除长期未访问的 key；桶早已加满，删除不影响限速结果"""
+        cutoff = time.monotonic() - idle_seconds
+        removed = 0
+        with self._lock:
+            while self._buckets:
+                key, (_, updated) = next(iter(self._buckets.items()))
+                if updated > cutoff:
+                    break
+                self._buckets.popitem(last=False)
+                removed += 1
+        return removed
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "keys": len(self._buckets),
+            "maxsize": self.maxsize,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteRateLimiter:
+    """共享令牌桶：一条 UPSERT … RETURNING 完成补充、判断和扣减，多进程间原子；
+    hit/purge_idle 通过 run_db 调用，由连接池提交"""
+
+    shared = True
+
+    def __init__(self):
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def backends(self):
+        return (self,)
+
+    def backend_for(self, policy):
+        return self
+
+    def hit(self, db, key, policy):
+        now = time.time()
+        refill = "MIN(:limit, rate_limits.tokens + (:now - rate_limits.updated_at) * :rate)"
+        row = db.execute(f"""
+            INSERT INTO rate_limits (key, tokens, updated_at, allowed) VALUES (:key, :limit - 1, :now, 1)
+            ON CONFLICT(key) DO UPDATE SET
+                allowed = {refill} >= 1,
+                tokens = CASE WHEN {refill} >= 1 THEN {refill} - 1 ELSE {refill} END,
+                updated_at = :now
+            RETURNING tokens, allowed
+        """, {"key": key, "limit": policy.limit, "rate": policy.rate, "now": now}).fetchone()
+        if row['allowed']:
+            self.allowed += 1
+            return True, 0
+        self.rejected += 1
+        return False, (1 - row['tokens']) / policy.rate
+
+    def purge_idle(self, db, idle_seconds):
+        return db.execute("DELETE FROM rate_limits WHERE updated_at < ?",
+                          (time.time() - idle_seconds,)).rowcount
+
+    def stats(self):
+        return {
+            "backend": "sqlite",
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+class HybridRateLimiter:
+    """shared_policies 中的低频严格策略走共享后端，跨 worker 共用限额；
+    其余策略用进程内令牌桶，每个 worker 各自计数"""
+
+    def __init__(self, local, shared, shared_policies):
+        self.local = local
+        self.shared_backend = shared
+        self.shared_policies = frozenset(shared_policies)
+
+    @property
+    def backends(self):
+        return (self.local, self.shared_backend)
+
+    def backend_for(self, policy):
+        return self.shared_backend if policy.name in self.shared_policies else self.local
+
+    def stats(self):
+        return {
+            "backend": "hybrid",
+            "shared_policies": sorted(self.shared_policies),
+            "local": self.local.stats(),
+            "shared": self.shared_backend.stats(),
+        }
+
+
+def create_limiter(backend=None):
+    backend = backend or os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    if backend == 'sqlite':
+        return SQLiteRateLimiter()
+    local = MemoryRateLimiter(int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000")))
+    if backend == 'hybrid':
+        return HybridRateLimiter(local, SQLiteRateLimiter(), [p.name for p in ROUTE_POLICIES.values()])
+    return local
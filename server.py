@@ -6,27 +6,40 @@ VeloceVoce 惟落雀 - 意大利手机充值系统 v2.0
 """
 
 from fastapi import FastAPI, HTTPException, Request, Depends
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 import sqlite3
-import hashlib
 import secrets
 import uuid
 import time
-import json
 import os
-import re
 import random
 import hmac
 import base64
-import urllib.parse
 import logging
 import asyncio
 from datetime import datetime, timedelta
-from contextlib import contextmanager
-from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from database import get_db, run_db, run_blocking, db_stats, DBTimeout
+from migrations import migrate, schema_ready
+from cache import TTLCache, InvalidationListener, SettingsCache, publish_invalidation
+from events import publish_order_event, publish_order_events, notify_dispatcher
+from order_queue import lease_active, make_worker_id
+from notify import NotificationService, enqueue
+from ratelimit import create_limiter, policy_for, IDLE_SECONDS
+from static import AssetStore, MEDIA_TYPES, HTML_TYPE, serve
+from pagination import keyset_page, row_count, InvalidCursor, MAX_PER_PAGE
+import queries
+from stats import dashboard
+from stream import StreamHub, TooManyStreams, issue_ticket, redeem_ticket
+from passwords import PasswordService, create_hasher
+from maintenance import trim_user_sessions
+from credit import CREDIT_LEVELS, get_credit_level, get_next_level, record_order
+from phones import (OPERATOR_PREFIXES, validate_italian_phone, check_operator_match,
+                    validate_batch, summarize_batch)
 
 # ====== 日志 ======
 logging.basicConfig(
@@ -43,19 +56,35 @@ logger = logging.getLogger('recharge')
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID", "")
 
-async def send_telegram(msg: str):
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return
-    try:
-        import urllib.request
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        data = json.dumps({"chat_id": TELEGRAM_CHAT_ID, "text": msg, "parse_mode": "HTML"}).encode('utf-8')
-        req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-        urllib.request.urlopen(req, timeout=5)
-    except Exception as e:
-        logger.error(f"[TELEGRAM ERROR] {e}")
+NOTIFY_CREDENTIALS = {'telegram': {'token': TELEGRAM_BOT_TOKEN, 'chat_id': TELEGRAM_CHAT_ID}}
+
+notifier = NotificationService(NOTIFY_CREDENTIALS, make_worker_id('server'))
+
+stream_hub = StreamHub(
+    max_streams=int(os.environ.get("STREAM_MAX_CONNECTIONS", "2000")),
+    max_per_user=int(os.environ.get("STREAM_MAX_PER_USER", "5")),
+)
 
-app = FastAPI(title="VeloceVoce 惟落雀")
+def notify_admin(db, msg: str):
+    """在当前事务中登记 Telegram 通知，由本进程的投递服务异步发送；未配置时不登记"""
+    enqueue(db, 'telegram', NOTIFY_CREDENTIALS['telegram'], msg)
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.ready = False
+    if not await run_db(schema_ready):
+        raise RuntimeError("数据库结构版本过旧，请先执行迁移")
+    await run_db(settings.refresh)
+    tasks = [asyncio.create_task(notifier.run_forever()),
+             asyncio.create_task(stream_hub.run_forever())]
+    app.state.ready = True
+    logger.info(f"[SERVER] worker pid={os.getpid()} ready")
+    yield
+    app.state.ready = False
+    for task in tasks:
+        task.cancel()
+
+app = FastAPI(title="VeloceVoce 惟落雀", lifespan=lifespan)
 
 ALLOWED_ORIGINS = os.environ.get("ALLOWED_ORIGINS", "*").split(",")
 app.add_middleware(
@@ -65,25 +94,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-rate_limit_store = defaultdict(list)
-RATE_LIMIT_MAX = 100
-RATE_LIMIT_WINDOW = 60
+rate_limiter = create_limiter()
+
+# 密码哈希线程池，默认每个进程 CPU 核数个线程；多 worker 时可用 PASSWORD_HASH_THREADS 调小
+passwords = PasswordService(create_hasher(), int(os.environ.get("PASSWORD_HASH_THREADS", "0")) or None)
+_next_rate_purge = 0.0
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
+    global _next_rate_purge
     client_ip = request.client.host if request.client else "unknown"
-    now = time.time()
-    rate_limit_store[client_ip] = [t for t in rate_limit_store[client_ip] if now - t < RATE_LIMIT_WINDOW]
-    if len(rate_limit_store[client_ip]) >= RATE_LIMIT_MAX:
-        return JSONResponse(status_code=429, content={"detail": "请求过于频繁，请稍后再试"})
-    rate_limit_store[client_ip].append(now)
+    policy = policy_for(request.url.path)
+    key = f"{policy.name}:{client_ip}"
+    now = time.monotonic()
+    backend = rate_limiter.backend_for(policy)
+    try:
+        if now >= _next_rate_purge:
+            _next_rate_purge = now + 60
+            for store in rate_limiter.backends:
+                if store.shared:
+                    await run_db(store.purge_idle, IDLE_SECONDS)
+                else:
+                    store.purge_idle(IDLE_SECONDS)
+        if backend.shared:
+            allowed, retry_after = await run_db(backend.hit, key, policy, timeout=2)
+        else:
+            allowed, retry_after = backend.hit(key, policy)
+    except (DBTimeout, sqlite3.Error) as e:
+        # 共享后端不可用时放行，不因限速故障拒绝服务
+        logger.error(f"[RATE_LIMIT] backend error: {e}")
+        allowed, retry_after = True, 0
+    if not allowed:
+        return JSONResponse(status_code=429, content={"detail": "请求过于频繁，请稍后再试"},
+                            headers={"Retry-After": str(int(retry_after) + 1)})
     response = await call_next(request)
     return response
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # 管理员密码通过环境变量配置，默认值仅用于本地开发
 ADMIN_PASSWORD = os.environ.get("RECHARGE_ADMIN_PWD", "recharge2025")
-DB_FILE = os.path.join(BASE_DIR, "recharge.db")
 NEW_USER_CREDIT = 10.0
 FIXED_AMOUNTS = [5, 10, 15, 20, 25, 30, 50]
 
@@ -103,139 +152,28 @@ SMS_CODE_LENGTH = 6
 CAPTCHA_APP_ID = os.environ.get("CAPTCHA_APP_ID", "")
 CAPTCHA_APP_SECRET = os.environ.get("CAPTCHA_APP_SECRET", "")
 
-OPERATOR_PREFIXES = {
-    "TIM": ["330", "331", "333", "334", "335", "336", "337", "338", "339", "360", "361", "362", "363", "366", "368"],
-    "Vodafone": ["340", "341", "342", "343", "344", "345", "346", "347", "348", "349", "383"],
-    "WindTre": ["320", "322", "323", "324", "325", "326", "327", "328", "329", "380", "388", "389", "390", "391", "392", "393", "397"],
-    "Iliad": ["351", "352", "353"],
-    "Very": ["370", "371"],
-    "Lycamobile": ["373"],
-    "CMLink": ["350"],
-    "DailyTelecom": ["375"],
-    "ho.": ["377", "378"],
-    "Kena": ["354", "355"],
-}
-
-@contextmanager
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    finally:
-        conn.close()
-
 def init_db():
+    """单进程模式在导入时迁移；多 worker 模式由主进程迁移一次，
+    worker 看到 RECHARGE_SCHEMA_READY=1 后跳过，只在启动时检查版本"""
+    if os.environ.get("RECHARGE_SCHEMA_READY") == "1":
+        return
     with get_db() as db:
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                email TEXT UNIQUE,
-                phone TEXT UNIQUE,
-                password_hash TEXT NOT NULL,
-                nickname TEXT DEFAULT '',
-                phone_model TEXT DEFAULT '',
-                register_ip TEXT DEFAULT '',
-                user_agent TEXT DEFAULT '',
-                fingerprint TEXT DEFAULT '',
-                credit_used INTEGER DEFAULT 0,
-                credit_amount REAL DEFAULT 0,
-                is_blocked INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL,
-                last_login TEXT
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                operator TEXT NOT NULL,
-                amount REAL NOT NULL,
-                bonus REAL DEFAULT 0,
-                total REAL DEFAULT 0,
-                payment TEXT DEFAULT '',
-                status TEXT DEFAULT 'pending',
-                is_credit INTEGER DEFAULT 0,
-                message TEXT DEFAULT '',
-                created_at TEXT NOT NULL,
-                updated_at TEXT DEFAULT '',
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                token TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                expires_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS admin_sessions (
-                token TEXT PRIMARY KEY,
-                created_at TEXT NOT NULL,
-                expires_at TEXT NOT NULL
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS sms_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone TEXT NOT NULL,
-                code TEXT NOT NULL,
-                purpose TEXT DEFAULT 'register',
-                ip TEXT DEFAULT '',
-                created_at TEXT NOT NULL,
-                used INTEGER DEFAULT 0
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS site_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                type TEXT DEFAULT 'info',
-                title TEXT NOT NULL,
-                content TEXT DEFAULT '',
-                order_id TEXT DEFAULT '',
-                is_read INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('online_count', '0')")
-        db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('cny_active', '1')")
-
-        for col in ['address', 'city', 'postal_code', 'region', 'country']:
-            try:
-                db.execute(f"ALTER TABLE users ADD COLUMN {col} TEXT DEFAULT ''")
-            except Exception:
-                pass
-
-        credit_cols = {
-            'credit_score': 'INTEGER DEFAULT 0',
-            'credit_level': "TEXT DEFAULT '新手'",
-            'total_spent': 'REAL DEFAULT 0',
-            'consecutive_success': 'INTEGER DEFAULT 0',
-            'unpaid_order_id': "TEXT DEFAULT ''",
-            'milestone_100': 'INTEGER DEFAULT 0',
-            'milestone_300': 'INTEGER DEFAULT 0',
-        }
-        for col, col_type in credit_cols.items():
-            try:
-                db.execute(f"ALTER TABLE users ADD COLUMN {col} {col_type}")
-            except Exception:
-                pass
+        migrate(db)
 
 init_db()
 
+# 数据库调用超时（秒）；管理后台的统计和列表查询允许更久
+DB_TIMEOUT = 10
+DB_TIMEOUT_ADMIN = 30
+
+async def db_call(fn, *args, timeout=DB_TIMEOUT):
+    """在数据库线程池中执行 fn(db, *args)，避免阻塞事件循环"""
+    try:
+        return await run_db(fn, *args, timeout=timeout)
+    except DBTimeout as e:
+        logger.error(f"[DB TIMEOUT] {e}")
+        raise HTTPException(503, "服务繁忙，请稍后再试")
+
 # ====== Pydantic Models ======
 
 class UserRegister(BaseModel):
@@ -262,6 +200,9 @@ class OrderCreate(BaseModel):
     amount: float
     is_credit: Optional[bool] = False
 
+class BulkOrderCreate(BaseModel):
+    orders: list[OrderCreate]
+
 class OrderUpdate(BaseModel):
     status: str
     message: Optional[str] = ""
@@ -271,44 +212,9 @@ class AdminLogin(BaseModel):
 
 # ====== Helpers ======
 
-def hash_pw(pw):
-    salt = secrets.token_hex(16)
-    hashed = hashlib.sha256((salt + pw).encode()).hexdigest()
-    return f"{salt}${hashed}"
-
-def verify_pw(pw, stored_hash):
-    if '$' in stored_hash:
-        salt, hashed = stored_hash.split('$', 1)
-        return hashlib.sha256((salt + pw).encode()).hexdigest() == hashed
-    return hashlib.sha256(pw.encode()).hexdigest() == stored_hash
-
 def gen_token():
     return secrets.token_hex(32)
 
-def validate_italian_phone(phone):
-    phone = re.sub(r'\D', '', phone)
-    if len(phone) == 12 and phone.startswith('39'):
-        phone = phone[2:]
-    if len(phone) == 13 and phone.startswith('+39'):
-        phone = phone[3:]
-    if len(phone) != 10:
-        return None, "号码必须是10位数字"
-    if not phone.startswith('3'):
-        return None, "意大利手机号必须3开头"
-    return phone, None
-
-def check_operator_match(phone, operator):
-    prefix3 = phone[:3]
-    matched_ops = []
-    for op, prefixes in OPERATOR_PREFIXES.items():
-        if prefix3 in prefixes:
-            matched_ops.append(op)
-    if not matched_ops:
-        return True, None
-    if operator in matched_ops:
-        return True, None
-    return False, matched_ops[0]
-
 def get_cny_bonus(amount):
     if amount >= 50:
         return 20
@@ -316,91 +222,72 @@ def get_cny_bonus(amount):
         return 10
     return 0
 
-def get_user_from_token(token, db):
-    if not token:
-        return None
-    row = db.execute(
-        "SELECT s.user_id, u.* FROM sessions s JOIN users u ON s.user_id = u.id WHERE s.token = ? AND s.expires_at > ?",
-        (token, datetime.now().isoformat())
-    ).fetchone()
-    return dict(row) if row else None
-
-CREDIT_LEVELS = [
-    {"name": "新手", "icon": "🌱", "min_score": 0,   "credit_limit": 10,  "discount": 1.0, "bonus": 0},
-    {"name": "铜牌", "icon": "🥉", "min_score": 50,  "credit_limit": 15,  "discount": 1.0, "bonus": 0},
-    {"name": "银牌", "icon": "🥈", "min_score": 150, "credit_limit": 25,  "discount": 1.0, "bonus": 5},
-    {"name": "金牌", "icon": "🥇", "min_score": 300, "credit_limit": 50,  "discount": 0.9, "bonus": 0},
-    {"name": "钻石", "icon": "💎", "min_score": 500, "credit_limit": 100, "discount": 0.8, "bonus": 10},
-]
-
-def get_credit_level(score):
-    level = CREDIT_LEVELS[0]
-    for lv in CREDIT_LEVELS:
-        if score >= lv["min_score"]:
-            level = lv
-    return level
-
-def get_next_level(score):
-    for lv in CREDIT_LEVELS:
-        if score < lv["min_score"]:
-            return lv
-    return None
+# ====== 会话缓存 ======
+# token → (用户行, 会话过期时间)。本进程内的写操作直接失效；
+# 其他进程的写操作通过 cache_invalidations 表在 INVALIDATION_POLL 秒内同步。
+SESSION_CACHE_TTL = 30
+SESSION_CACHE_SIZE = 10000
+INVALIDATION_POLL = 1.0
 
-def update_credit_score(db, user_id, order_amount, is_credit_order=False):
-    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    if not user:
+session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+invalidations = InvalidationListener(interval=INVALIDATION_POLL)
+
+def _drop_user_sessions(user_id):
+    # '*'：批量修改了所有用户（如 python credit.py recompute）
+    if user_id == '*':
+        session_cache.clear()
         return
-    user = dict(user)
+    session_cache.remove_where(lambda entry: entry[0]['id'] == user_id)
 
-    score = user.get('credit_score', 0) or 0
-    total = user.get('total_spent', 0) or 0
-    streak = user.get('consecutive_success', 0) or 0
-    m100 = user.get('milestone_100', 0) or 0
-    m300 = user.get('milestone_300', 0) or 0
-
-    if order_amount >= 30:
-        points = 20
-    elif order_amount >= 15:
-        points = 10
-    else:
-        points = 5
-
-    if is_credit_order:
-        points += 15
-
-    streak += 1
-    if streak >= 3 and streak % 3 == 0:
-        points += 30
-        logger.info(f"[CREDIT] user={user_id} streak={streak} bonus +30")
-
-    score += points
-    total += order_amount
-
-    if total >= 100 and not m100:
-        score += 50
-        m100 = 1
-        logger.info(f"[CREDIT] user={user_id} milestone 100€ bonus +50")
-    if total >= 300 and not m300:
-        score += 100
-        m300 = 1
-        logger.info(f"[CREDIT] user={user_id} milestone 300€ bonus +100")
-
-    old_level = get_credit_level(user.get('credit_score', 0) or 0)
-    new_level = get_credit_level(score)
-
-    db.execute("""
-        UPDATE users SET credit_score = ?, credit_level = ?, total_spent = ?,
-        consecutive_success = ?, milestone_100 = ?, milestone_300 = ?,
-        credit_amount = ?
-        WHERE id = ?
-    """, (score, new_level["name"], total, streak, m100, m300,
-          new_level["credit_limit"], user_id))
-
-    if new_level["name"] != old_level["name"] and new_level["bonus"] > 0:
-        logger.info(f"[CREDIT] user={user_id} LEVEL UP: {old_level['name']} → {new_level['name']}, bonus €{new_level['bonus']}")
-
-    logger.info(f"[CREDIT] user={user_id} +{points}pts, total={score}, level={new_level['name']}")
-    return {"points_added": points, "new_score": score, "new_level": new_level}
+invalidations.subscribe('user', _drop_user_sessions)
+invalidations.subscribe('session', session_cache.pop)
+
+SETTINGS_SCHEMA = {
+    'cny_active': (bool, False),
+    'online_count': (int, 0),
+}
+settings = SettingsCache(SETTINGS_SCHEMA, invalidations)
+
+def load_settings(db):
+    """在数据库线程中调用；距上次检查不足 INVALIDATION_POLL 秒时不查库"""
+    if settings.needs_refresh():
+        settings.refresh(db)
+    return settings
+
+async def current_settings():
+    if settings.needs_refresh():
+        await db_call(settings.refresh)
+    return settings
+
+def invalidate_user(db, user_id):
+    """users 行变更后调用（封禁、积分、登录等）"""
+    _drop_user_sessions(user_id)
+    publish_invalidation(db, 'user', user_id)
+
+def invalidate_session(db, token):
+    session_cache.pop(token)
+    publish_invalidation(db, 'session', token)
+
+def get_user_from_token(token, db):
+    if not token:
+        return None
+    invalidations.poll(db)
+    now = datetime.now().isoformat()
+    entry = session_cache.get(token)
+    if entry is not None:
+        user, expires_at = entry
+        if expires_at > now:
+            return dict(user)
+        session_cache.pop(token)
+        return None
+    generation = session_cache.generation
+    row = db.execute(queries.SESSION_USER_SQL, (token, now)).fetchone()
+    if not row:
+        return None
+    user = dict(row)
+    expires_at = user.pop('session_expires_at')
+    session_cache.set(token, (user, expires_at), generation=generation)
+    return dict(user)
 
 def get_credit_discount(user):
     score = user.get('credit_score', 0) or 0
@@ -408,10 +295,7 @@ def get_credit_discount(user):
     return level["discount"]
 
 def check_unpaid_order(db, user_id):
-    unpaid = db.execute(
-        "SELECT id, amount, created_at FROM orders WHERE user_id = ? AND is_credit = 1 AND status = 'completed' AND payment = 'credit'",
-        (user_id,)
-    ).fetchone()
+    unpaid = db.execute(queries.UNPAID_CREDIT_SQL, (user_id,)).fetchone()
     if unpaid:
         return dict(unpaid)
     return None
@@ -419,26 +303,20 @@ def check_unpaid_order(db, user_id):
 def check_anti_fraud(db, email=None, phone=None, ip=None, fingerprint=None):
     reasons = []
     if email:
-        existing = db.execute("SELECT COUNT(*) as c FROM users WHERE email = ?", (email,)).fetchone()
+        existing = db.execute(queries.EMAIL_TAKEN_SQL, (email,)).fetchone()
         if existing['c'] > 0:
             reasons.append("该邮箱已注册")
     if phone:
-        existing = db.execute("SELECT COUNT(*) as c FROM users WHERE phone = ?", (phone,)).fetchone()
+        existing = db.execute(queries.PHONE_TAKEN_SQL, (phone,)).fetchone()
         if existing['c'] > 0:
             reasons.append("该手机号已注册")
     if ip:
         since = (datetime.now() - timedelta(hours=24)).isoformat()
-        ip_count = db.execute(
-            "SELECT COUNT(*) as c FROM users WHERE register_ip = ? AND created_at > ?",
-            (ip, since)
-        ).fetchone()
+        ip_count = db.execute(queries.REGISTER_IP_SQL, (ip, since)).fetchone()
         if ip_count['c'] >= 3:
             reasons.append("注册过于频繁，请稍后再试")
     if fingerprint and fingerprint != '':
-        fp_count = db.execute(
-            "SELECT COUNT(*) as c FROM users WHERE fingerprint = ?",
-            (fingerprint,)
-        ).fetchone()
+        fp_count = db.execute(queries.FINGERPRINT_SQL, (fingerprint,)).fetchone()
         if fp_count['c'] >= 2:
             reasons.append("该设备已注册过账号")
     return reasons
@@ -471,10 +349,7 @@ def send_sms_code(phone, purpose, ip=""):
 def verify_sms_code(phone, code, purpose):
     with get_db() as db:
         expire_time = (datetime.now() - timedelta(minutes=SMS_CODE_EXPIRE)).isoformat()
-        row = db.execute(
-            "SELECT id FROM sms_codes WHERE phone=? AND code=? AND purpose=? AND used=0 AND created_at>? ORDER BY id DESC LIMIT 1",
-            (phone, code, purpose, expire_time)
-        ).fetchone()
+        row = db.execute(queries.SMS_CODE_SQL, (phone, code, purpose, expire_time)).fetchone()
         if not row:
             return False
         db.execute("UPDATE sms_codes SET used=1 WHERE id=?", (row['id'],))
@@ -482,68 +357,43 @@ def verify_sms_code(phone, code, purpose):
 
 # ====== API Routes ======
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    f = os.path.join(BASE_DIR, "index.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>VeloceVoce</h1>")
-
-@app.get("/admin", response_class=HTMLResponse)
-async def admin_page():
-    f = os.path.join(BASE_DIR, "admin.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>Admin</h1>")
-
-@app.get("/help", response_class=HTMLResponse)
-async def help_page():
-    f = os.path.join(BASE_DIR, "help.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>Help</h1>")
-
-@app.get("/cookies", response_class=HTMLResponse)
-async def cookies_page():
-    f = os.path.join(BASE_DIR, "cookies.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>Cookies</h1>")
-
-@app.get("/legal", response_class=HTMLResponse)
-async def legal_page():
-    f = os.path.join(BASE_DIR, "legal.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>Legal</h1>")
-
-@app.get("/privacy", response_class=HTMLResponse)
-async def privacy_page():
-    f = os.path.join(BASE_DIR, "privacy.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>Privacy</h1>")
-
-@app.get("/terms", response_class=HTMLResponse)
-async def terms_page():
-    f = os.path.join(BASE_DIR, "terms.html")
-    if os.path.exists(f):
-        return HTMLResponse(open(f, encoding='utf-8').read())
-    return HTMLResponse("<h1>Terms</h1>")
+assets = AssetStore(BASE_DIR)
+
+PAGES = {
+    "/": ("index.html", "<h1>VeloceVoce</h1>"),
+    "/admin": ("admin.html", "<h1>Admin</h1>"),
+    "/help": ("help.html", "<h1>Help</h1>"),
+    "/cookies": ("cookies.html", "<h1>Cookies</h1>"),
+    "/legal": ("legal.html", "<h1>Legal</h1>"),
+    "/privacy": ("privacy.html", "<h1>Privacy</h1>"),
+    "/terms": ("terms.html", "<h1>Terms</h1>"),
+}
+
+def make_page_route(filename, fallback):
+    async def page(request: Request):
+        asset = assets.get(filename, HTML_TYPE)
+        if asset is None:
+            return HTMLResponse(fallback)
+        return serve(request, asset)
+    return page
+
+for path, (filename, fallback) in PAGES.items():
+    app.add_api_route(path, make_page_route(filename, fallback), methods=["GET"],
+                      response_class=HTMLResponse, name=filename.split('.')[0])
 
 @app.get("/app.js")
-async def serve_appjs():
-    f = os.path.join(BASE_DIR, "app.js")
-    if os.path.exists(f):
-        return FileResponse(f, media_type="application/javascript")
-    raise HTTPException(404)
+async def serve_appjs(request: Request):
+    asset = assets.get("app.js", MEDIA_TYPES["app.js"])
+    if asset is None:
+        raise HTTPException(404)
+    return serve(request, asset)
 
 @app.get("/style.css")
-async def serve_css():
-    f = os.path.join(BASE_DIR, "style.css")
-    if os.path.exists(f):
-        return FileResponse(f, media_type="text/css")
-    raise HTTPException(404)
+async def serve_css(request: Request):
+    asset = assets.get("style.css", MEDIA_TYPES["style.css"])
+    if asset is None:
+        raise HTTPException(404)
+    return serve(request, asset)
 
 # ------ Auth ------
 
@@ -554,7 +404,9 @@ async def register(data: UserRegister, request: Request):
         raise HTTPException(400, "请提供邮箱或手机号")
     if len(data.password) < 6:
         raise HTTPException(400, "密码至少6位")
-    with get_db() as db:
+    password_hash = await passwords.hash(data.password)
+
+    def query(db):
         fraud = check_anti_fraud(db, email=data.email, phone=data.phone, ip=ip, fingerprint=data.fingerprint)
         if fraud:
             raise HTTPException(400, fraud[0])
@@ -564,7 +416,7 @@ async def register(data: UserRegister, request: Request):
             db.execute("""
                 INSERT INTO users (id, email, phone, password_hash, nickname, register_ip, user_agent, fingerprint, credit_amount, created_at)
                 VALUES (?,?,?,?,?,?,?,?,?,?)
-            """, (user_id, data.email, data.phone, hash_pw(data.password),
+            """, (user_id, data.email, data.phone, password_hash,
                   data.name or "", ip, "", data.fingerprint or "", NEW_USER_CREDIT, now))
         except sqlite3.IntegrityError:
             raise HTTPException(400, "该账号已注册")
@@ -575,38 +427,56 @@ async def register(data: UserRegister, request: Request):
         send_site_message(db, user_id, "欢迎加入 VeloceVoce！",
                           f"注册成功，获得 €{NEW_USER_CREDIT} 信用额度，祝您使用愉快！", "success")
         logger.info(f"[REGISTER] user={user_id} email={data.email} phone={data.phone} ip={ip}")
-    return {"token": token, "user_id": user_id}
+        return {"token": token, "user_id": user_id}
+
+    return await db_call(query)
 
 @app.post("/api/login")
 async def login(data: UserLogin, request: Request):
     ip = request.client.host if request.client else ""
-    with get_db() as db:
-        row = db.execute(
-            "SELECT * FROM users WHERE email=? OR phone=?",
-            (data.account, data.account)
-        ).fetchone()
+
+    def lookup(db):
+        row = db.execute(queries.LOGIN_SQL, (data.account, data.account)).fetchone()
         if not row:
             raise HTTPException(401, "账号不存在")
-        user = dict(row)
-        if user.get('is_blocked'):
+        if row['is_blocked']:
             raise HTTPException(403, "该账号已被封禁")
-        if not verify_pw(data.password, user['password_hash']):
-            raise HTTPException(401, "密码错误")
+        return row['id'], row['password_hash']
+
+    user_id, stored_hash = await db_call(lookup)
+    # 密码校验在独立线程池中进行，不占用数据库连接
+    ok, new_hash = await passwords.verify(data.password, stored_hash)
+    if not ok:
+        raise HTTPException(401, "密码错误")
+
+    def query(db):
         token = gen_token()
         now = datetime.now().isoformat()
         expires = (datetime.now() + timedelta(days=30)).isoformat()
         db.execute("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)",
-                   (token, user['id'], now, expires))
-        db.execute("UPDATE users SET last_login=? WHERE id=?", (now, user['id']))
-        logger.info(f"[LOGIN] user={user['id']} ip={ip}")
-    return {"token": token, "user_id": user['id']}
+                   (token, user_id, now, expires))
+        db.execute("UPDATE users SET last_login=? WHERE id=?", (now, user_id))
+        for old_token in trim_user_sessions(db, user_id):
+            invalidate_session(db, old_token)
+        if new_hash:
+            # 旧格式或旧参数的哈希升级为当前算法；期间密码被改过则不覆盖
+            db.execute("UPDATE users SET password_hash=? WHERE id=? AND password_hash=?",
+                       (new_hash, user_id, stored_hash))
+            logger.info(f"[LOGIN] user={user_id} password rehashed")
+        invalidate_user(db, user_id)
+        logger.info(f"[LOGIN] user={user_id} ip={ip}")
+        return {"token": token, "user_id": user_id}
+
+    return await db_call(query)
 
 @app.post("/api/logout")
 async def logout(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
     if token:
-        with get_db() as db:
+        def query(db):
             db.execute("DELETE FROM sessions WHERE token=?", (token,))
+            invalidate_session(db, token)
+        await db_call(query)
     return {"ok": True}
 
 @app.post("/api/send-sms")
@@ -618,7 +488,11 @@ async def send_sms(request: Request):
     phone, err = validate_italian_phone(phone)
     if err:
         raise HTTPException(400, err)
-    ok, result = send_sms_code(phone, purpose, ip)
+    try:
+        ok, result = await run_blocking(send_sms_code, phone, purpose, ip, timeout=DB_TIMEOUT)
+    except DBTimeout as e:
+        logger.error(f"[DB TIMEOUT] {e}")
+        raise HTTPException(503, "服务繁忙，请稍后再试")
     if not ok:
         raise HTTPException(500, result)
     return {"ok": True}
@@ -626,17 +500,18 @@ async def send_sms(request: Request):
 @app.get("/api/me")
 async def get_me(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
+
+    def query(db):
         user = get_user_from_token(token, db)
         if not user:
             raise HTTPException(401, "未登录")
-        unread = db.execute(
-            "SELECT COUNT(*) as c FROM site_messages WHERE user_id=? AND is_read=0",
-            (user['id'],)
-        ).fetchone()['c']
-        score = user.get('credit_score', 0) or 0
-        level = get_credit_level(score)
-        next_lv = get_next_level(score)
+        row = db.execute(queries.INBOX_UNREAD_SQL, (user['id'],)).fetchone()
+        return user, row['unread'] if row else 0
+
+    user, unread = await db_call(query)
+    score = user.get('credit_score', 0) or 0
+    level = get_credit_level(score)
+    next_lv = get_next_level(score)
     return {
         "id": user['id'],
         "email": user.get('email'),
@@ -658,125 +533,241 @@ async def get_operators():
 async def get_amounts():
     return {"amounts": FIXED_AMOUNTS}
 
-@app.post("/api/orders")
-async def create_order(data: OrderCreate, request: Request):
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        user = get_user_from_token(token, db)
-        if not user:
-            raise HTTPException(401, "未登录")
-        if user.get('is_blocked'):
-            raise HTTPException(403, "账号已封禁")
+def prepare_order(data: OrderCreate, user, cny_active, unpaid, now):
+    """校验一笔下单请求并返回待插入的行；不合法时抛出 HTTPException(400)"""
+    phone, err = validate_italian_phone(data.phone)
+    if err:
+        raise HTTPException(400, err)
 
-        phone, err = validate_italian_phone(data.phone)
-        if err:
-            raise HTTPException(400, err)
+    match, suggested = check_operator_match(phone, data.operator)
+    if not match:
+        raise HTTPException(400, f"号码前缀与运营商不匹配，建议选择 {suggested}")
 
-        match, suggested = check_operator_match(phone, data.operator)
-        if not match:
-            raise HTTPException(400, f"号码前缀与运营商不匹配，建议选择 {suggested}")
+    if data.amount not in FIXED_AMOUNTS:
+        raise HTTPException(400, "无效金额")
 
-        if data.amount not in FIXED_AMOUNTS:
-            raise HTTPException(400, "无效金额")
+    bonus = get_cny_bonus(data.amount) if cny_active else 0
 
-        cny_active = db.execute("SELECT value FROM settings WHERE key='cny_active'").fetchone()
-        bonus = get_cny_bonus(data.amount) if (cny_active and cny_active['value'] == '1') else 0
+    credit_limit = user.get('credit_amount', 0)
+    if data.is_credit:
+        if unpaid:
+            raise HTTPException(400, f"您有未支付的赊账订单 #{unpaid['id'][:8]}，请先结清")
+        if data.amount > credit_limit:
+            raise HTTPException(400, f"超出信用额度 €{credit_limit}")
 
-        credit_limit = user.get('credit_amount', 0)
-        if data.is_credit:
-            unpaid = check_unpaid_order(db, user['id'])
-            if unpaid:
-                raise HTTPException(400, f"您有未支付的赊账订单 #{unpaid['id'][:8]}，请先结清")
-            if data.amount > credit_limit:
-                raise HTTPException(400, f"超出信用额度 €{credit_limit}")
+    order_id = str(uuid.uuid4())
+    payment = 'credit' if data.is_credit else ''
+    return (order_id, user['id'], phone, data.operator, data.amount, bonus,
+            data.amount + bonus, payment, 'charged', 1 if data.is_credit else 0, now)
 
-        order_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
-        status = 'charged' if not data.is_credit else 'charged'
-        payment = 'credit' if data.is_credit else ''
+INSERT_ORDER_SQL = """
+    INSERT INTO orders (id, user_id, phone, operator, amount, bonus, total, payment, status, is_credit, created_at)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+def order_user(token, db):
+    user = get_user_from_token(token, db)
+    if not user:
+        raise HTTPException(401, "未登录")
+    if user.get('is_blocked'):
+        raise HTTPException(403, "账号已封禁")
+    return user
 
-        db.execute("""
-            INSERT INTO orders (id, user_id, phone, operator, amount, bonus, total, payment, status, is_credit, created_at)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?)
-        """, (order_id, user['id'], phone, data.operator, data.amount, bonus,
-              data.amount + bonus, payment, status, 1 if data.is_credit else 0, now))
+def cny_is_active(db):
+    return load_settings(db).get('cny_active')
+
+@app.post("/api/orders")
+async def create_order(data: OrderCreate, request: Request):
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+
+    def query(db):
+        user = order_user(token, db)
+        unpaid = check_unpaid_order(db, user['id']) if data.is_credit else None
+        row = prepare_order(data, user, cny_is_active(db), unpaid, datetime.now().isoformat())
+        order_id, phone, status = row[0], row[2], row[8]
+        db.execute(INSERT_ORDER_SQL, row)
+        publish_order_event(db, order_id, status)
+        notify_admin(db, f"🆕 新订单\n用户: {user.get('email') or user.get('phone')}\n号码: {phone}\n运营商: {data.operator}\n金额: €{data.amount}")
 
         logger.info(f"[ORDER] id={order_id} user={user['id']} phone={phone} operator={data.operator} amount={data.amount} credit={data.is_credit}")
-        asyncio.create_task(send_telegram(
-            f"🆕 新订单\n用户: {user.get('email') or user.get('phone')}\n号码: {phone}\n运营商: {data.operator}\n金额: €{data.amount}"
-        ))
+        return order_id, status
 
+    order_id, status = await db_call(query)
+    notify_dispatcher()
+    stream_hub.wake()
     return {"order_id": order_id, "status": status}
 
+BULK_ORDER_MAX = 500
+
+@app.post("/api/orders/bulk")
+async def create_orders_bulk(data: BulkOrderCreate, request: Request):
+    """批量下单：一次鉴权、一次读取配置，合法的订单在同一事务中插入，逐项返回结果"""
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    if not data.orders:
+        raise HTTPException(400, "订单列表为空")
+    if len(data.orders) > BULK_ORDER_MAX:
+        raise HTTPException(400, f"单次最多 {BULK_ORDER_MAX} 笔订单")
+
+    def query(db):
+        user = order_user(token, db)
+        cny_active = cny_is_active(db)
+        unpaid = check_unpaid_order(db, user['id']) if any(o.is_credit for o in data.orders) else None
+        now = datetime.now().isoformat()
+        rows, results = [], []
+        for i, item in enumerate(data.orders):
+            try:
+                row = prepare_order(item, user, cny_active, unpaid, now)
+            except HTTPException as e:
+                results.append({"index": i, "ok": False, "error": e.detail})
+                continue
+            rows.append(row)
+            results.append({"index": i, "ok": True, "order_id": row[0], "status": row[8]})
+        if rows:
+            db.executemany(INSERT_ORDER_SQL, rows)
+            publish_order_events(db, [(row[0], row[8]) for row in rows])
+            total = sum(row[4] for row in rows)
+            lines = [f"{row[2]} {row[3]} €{row[4]}" for row in rows[:10]]
+            if len(rows) > 10:
+                lines.append(f"… 另有 {len(rows) - 10} 单")
+            notify_admin(db, f"🆕 批量新订单 {len(rows)} 单\n用户: {user.get('email') or user.get('phone')}\n"
+                             f"合计: €{total}\n" + "\n".join(lines))
+        logger.info(f"[ORDER] bulk user={user['id']} accepted={len(rows)} rejected={len(data.orders) - len(rows)}")
+        return len(rows), results
+
+    accepted, results = await db_call(query)
+    if accepted:
+        notify_dispatcher()
+        stream_hub.wake()
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
 @app.get("/api/orders")
 async def list_orders(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
+
+    def query(db):
         user = get_user_from_token(token, db)
         if not user:
             raise HTTPException(401, "未登录")
-        rows = db.execute(
-            "SELECT * FROM orders WHERE user_id=? ORDER BY created_at DESC LIMIT 50",
-            (user['id'],)
-        ).fetchall()
-    return {"orders": [dict(r) for r in rows]}
+        rows = db.execute(queries.USER_ORDERS_SQL, (user['id'],)).fetchall()
+        return {"orders": [dict(r) for r in rows]}
+
+    return await db_call(query)
 
 @app.get("/api/orders/{order_id}")
 async def get_order(order_id: str, request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
+
+    def query(db):
         user = get_user_from_token(token, db)
         if not user:
             raise HTTPException(401, "未登录")
-        row = db.execute("SELECT * FROM orders WHERE id=? AND user_id=?", (order_id, user['id'])).fetchone()
+        row = db.execute(queries.USER_ORDER_SQL, (order_id, user['id'])).fetchone()
         if not row:
             raise HTTPException(404, "订单不存在")
-    return dict(row)
+        return dict(row)
+
+    return await db_call(query)
 
 @app.get("/api/promotions")
 async def get_promotions():
-    with get_db() as db:
-        cny = db.execute("SELECT value FROM settings WHERE key='cny_active'").fetchone()
+    cfg = await current_settings()
     return {
-        "cny_active": cny['value'] == '1' if cny else False,
+        "cny_active": cfg.get('cny_active'),
         "bonuses": {"50": 20, "20": 10}
     }
 
 @app.get("/api/online-count")
 async def online_count():
-    with get_db() as db:
-        row = db.execute("SELECT value FROM settings WHERE key='online_count'").fetchone()
-    return {"count": int(row['value']) if row else 0}
+    cfg = await current_settings()
+    return {"count": cfg.get('online_count')}
+
+@app.get("/api/health")
+async def health():
+    """存活检查：进程能响应即可"""
+    return {"ok": True, "pid": os.getpid()}
+
+@app.get("/api/ready")
+async def ready():
+    """就绪检查：启动流程完成且数据库可用；负载均衡/部署脚本据此放量"""
+    if not getattr(app.state, 'ready', False):
+        return JSONResponse(status_code=503, content={"ready": False})
+    try:
+        await db_call(lambda db: db.execute("SELECT 1").fetchone(), timeout=2)
+    except HTTPException:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True, "pid": os.getpid()}
 
 @app.post("/api/heartbeat")
 async def heartbeat():
     return {"ok": True}
 
+def sse_response(sub, request: Request):
+    return StreamingResponse(stream_hub.events(sub, request.is_disconnected),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/stream/ticket")
+async def user_stream_ticket(request: Request):
+    """换取一次性连接票据：EventSource 不能带请求头，URL 中只放票据，不放会话 token"""
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+
+    def query(db):
+        user = get_user_from_token(token, db)
+        if not user:
+            raise HTTPException(401, "未登录")
+        return issue_ticket(db, user['id'])
+
+    return {"ticket": await db_call(query)}
+
+@app.get("/api/stream")
+async def user_stream(request: Request, ticket: str = ""):
+    """订单状态和站内消息的实时推送；ticket 来自 POST /api/stream/ticket，只能使用一次"""
+    valid, user_id = await db_call(redeem_ticket, ticket)
+    if not valid:
+        raise HTTPException(401, "连接票据无效或已过期")
+    try:
+        sub = stream_hub.subscribe(user_id)
+    except TooManyStreams as e:
+        raise HTTPException(429, str(e))
+    return sse_response(sub, request)
+
 @app.get("/api/messages")
-async def get_messages(request: Request):
+async def get_messages(request: Request, cursor: Optional[str] = None, per_page: int = 20):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
+
+    def query(db):
         user = get_user_from_token(token, db)
         if not user:
             raise HTTPException(401, "未登录")
-        rows = db.execute(
-            "SELECT * FROM site_messages WHERE user_id=? ORDER BY created_at DESC LIMIT 20",
-            (user['id'],)
-        ).fetchall()
-        db.execute("UPDATE site_messages SET is_read=1 WHERE user_id=?", (user['id'],))
-    return {"messages": [dict(r) for r in rows]}
+        try:
+            rows, next_cursor = keyset_page(
+                db, queries.INBOX_SELECT, queries.INBOX_WHERE, [user['id']], page_size(per_page), cursor)
+        except InvalidCursor:
+            raise HTTPException(400, "无效的分页游标")
+        # 只标记本次返回的消息；未返回的旧消息保持未读
+        unread = [r['id'] for r in rows if not r['is_read']]
+        if unread:
+            db.execute(f"UPDATE site_messages SET is_read=1 WHERE id IN ({','.join('?' * len(unread))})", unread)
+        row = db.execute(queries.INBOX_UNREAD_SQL, (user['id'],)).fetchone()
+        return {"messages": [dict(r) for r in rows], "unread": row['unread'] if row else 0,
+                "next_cursor": next_cursor}
+
+    return await db_call(query)
 
 @app.get("/api/credit-info")
 async def credit_info(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
+
+    def query(db):
         user = get_user_from_token(token, db)
         if not user:
             raise HTTPException(401, "未登录")
-        score = user.get('credit_score', 0) or 0
-        level = get_credit_level(score)
-        next_lv = get_next_level(score)
-        unpaid = check_unpaid_order(db, user['id'])
+        return user, check_unpaid_order(db, user['id'])
+
+    user, unpaid = await db_call(query)
+    score = user.get('credit_score', 0) or 0
+    level = get_credit_level(score)
+    next_lv = get_next_level(score)
     return {
         "credit_amount": user.get('credit_amount', 0),
         "credit_used": user.get('credit_used', 0),
@@ -792,12 +783,13 @@ async def credit_info(request: Request):
 def get_admin_from_token(token, db):
     if not token:
         return None
-    row = db.execute(
-        "SELECT token FROM admin_sessions WHERE token=? AND expires_at>?",
-        (token, datetime.now().isoformat())
-    ).fetchone()
+    row = db.execute(queries.ADMIN_SESSION_SQL, (token, datetime.now().isoformat())).fetchone()
     return row is not None
 
+def require_admin(token, db):
+    if not get_admin_from_token(token, db):
+        raise HTTPException(401, "未授权")
+
 @app.post("/api/admin/login")
 async def admin_login(data: AdminLogin):
     if not hmac.compare_digest(data.password, ADMIN_PASSWORD):
@@ -805,155 +797,242 @@ async def admin_login(data: AdminLogin):
     token = gen_token()
     now = datetime.now().isoformat()
     expires = (datetime.now() + timedelta(hours=8)).isoformat()
-    with get_db() as db:
+
+    def query(db):
         db.execute("INSERT INTO admin_sessions (token, created_at, expires_at) VALUES (?,?,?)",
                    (token, now, expires))
+
+    await db_call(query)
     return {"token": token}
 
 @app.post("/api/admin/logout")
 async def admin_logout(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
     if token:
-        with get_db() as db:
+        def query(db):
             db.execute("DELETE FROM admin_sessions WHERE token=?", (token,))
+        await db_call(query)
     return {"ok": True}
 
+def page_size(per_page):
+    return max(1, min(per_page, MAX_PER_PAGE))
+
 @app.get("/api/admin/orders")
-async def admin_orders(request: Request, status: str = "", page: int = 1, per_page: int = 20):
+async def admin_orders(request: Request, status: str = "", operator: str = "", date_from: str = "",
+                       date_to: str = "", cursor: str = "", per_page: int = 20):
+    """游标分页；只按状态筛选（或不筛选）时 total 来自维护型计数，否则为 null"""
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
-        offset = (page - 1) * per_page
-        if status:
-            rows = db.execute(
-                "SELECT o.*, u.email, u.phone as user_phone FROM orders o LEFT JOIN users u ON o.user_id=u.id WHERE o.status=? ORDER BY o.created_at DESC LIMIT ? OFFSET ?",
-                (status, per_page, offset)
-            ).fetchall()
-            total = db.execute("SELECT COUNT(*) as c FROM orders WHERE status=?", (status,)).fetchone()['c']
-        else:
-            rows = db.execute(
-                "SELECT o.*, u.email, u.phone as user_phone FROM orders o LEFT JOIN users u ON o.user_id=u.id ORDER BY o.created_at DESC LIMIT ? OFFSET ?",
-                (per_page, offset)
-            ).fetchall()
-            total = db.execute("SELECT COUNT(*) as c FROM orders").fetchone()['c']
-    return {"orders": [dict(r) for r in rows], "total": total, "page": page}
+
+    def query(db):
+        require_admin(token, db)
+        try:
+            where, params = queries.admin_order_filters(status, operator, date_from, date_to)
+        except ValueError:
+            raise HTTPException(400, "日期格式应为 YYYY-MM-DD")
+        try:
+            rows, next_cursor = keyset_page(
+                db, queries.ADMIN_ORDERS_SELECT, where, params, page_size(per_page), cursor, alias='o')
+        except InvalidCursor:
+            raise HTTPException(400, "无效的分页游标")
+        total = None
+        if not (operator or date_from or date_to):
+            total = row_count(db, f"orders:{status}" if status else "orders")
+        return {"orders": [dict(r) for r in rows], "total": total, "next_cursor": next_cursor}
+
+    return await db_call(query, timeout=DB_TIMEOUT_ADMIN)
 
 @app.put("/api/admin/orders/{order_id}")
 async def admin_update_order(order_id: str, data: OrderUpdate, request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
+
+    def query(db):
+        require_admin(token, db)
         order = db.execute("SELECT * FROM orders WHERE id=?", (order_id,)).fetchone()
         if not order:
             raise HTTPException(404, "订单不存在")
         order = dict(order)
+        if data.status == 'processing' and lease_active(order):
+            raise HTTPException(409, "订单正在充值中，请等待完成或租约过期")
         now = datetime.now().isoformat()
-        db.execute("UPDATE orders SET status=?, message=?, updated_at=? WHERE id=?",
+        # 清除租约：持有该订单的 worker 之后写回结果会被拒绝，不会覆盖管理员的操作
+        db.execute("UPDATE orders SET status=?, message=?, updated_at=?, claimed_by='', lease_expires_at='' WHERE id=?",
                    (data.status, data.message, now, order_id))
-        if data.status == 'completed':
-            update_credit_score(db, order['user_id'], order['amount'], bool(order['is_credit']))
+        publish_order_event(db, order_id, data.status)
+        # 重复提交同一状态只更新备注，不重复计分和发送消息
+        changed = data.status != order['status']
+        if changed and data.status == 'completed':
+            # 每个订单在账本中只记一次（credit_events.order_id 唯一），完成→失败→完成也不会重复计分
+            if record_order(db, order['user_id'], order_id, order['amount'], bool(order['is_credit'])):
+                invalidate_user(db, order['user_id'])
             send_site_message(db, order['user_id'],
                               f"充值成功 €{order['amount']}",
                               f"号码 {order['phone']} 充值 €{order['amount']} 已完成。",
                               "success", order_id)
-            asyncio.create_task(send_telegram(
-                f"✅ 订单完成\n#{order_id[:8]}\n号码: {order['phone']}\n金额: €{order['amount']}"
-            ))
-        elif data.status == 'failed':
+            notify_admin(db, f"✅ 订单完成\n#{order_id[:8]}\n号码: {order['phone']}\n金额: €{order['amount']}")
+        elif changed and data.status == 'failed':
             send_site_message(db, order['user_id'],
                               f"充值失败 €{order['amount']}",
                               f"号码 {order['phone']} 充值失败，原因：{data.message or '未知'}",
                               "error", order_id)
         logger.info(f"[ADMIN] order={order_id} status={data.status}")
+
+    await db_call(query)
+    notify_dispatcher()
+    stream_hub.wake()
     return {"ok": True}
 
 @app.get("/api/admin/stats")
 async def admin_stats(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
-        total_users = db.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
-        total_orders = db.execute("SELECT COUNT(*) as c FROM orders").fetchone()['c']
-        completed = db.execute("SELECT COUNT(*) as c FROM orders WHERE status='completed'").fetchone()['c']
-        pending = db.execute("SELECT COUNT(*) as c FROM orders WHERE status IN ('pending','charged','processing')").fetchone()['c']
-        revenue = db.execute("SELECT COALESCE(SUM(amount),0) as s FROM orders WHERE status='completed'").fetchone()['s']
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_orders = db.execute(
-            "SELECT COUNT(*) as c FROM orders WHERE created_at LIKE ?",
-            (today + '%',)
-        ).fetchone()['c']
-    return {
-        "total_users": total_users,
-        "total_orders": total_orders,
-        "completed_orders": completed,
-        "pending_orders": pending,
-        "total_revenue": revenue,
-        "today_orders": today_orders,
-    }
+
+    def query(db):
+        require_admin(token, db)
+        return dashboard(db, datetime.now().strftime('%Y-%m-%d'))
+
+    return await db_call(query, timeout=DB_TIMEOUT_ADMIN)
 
 @app.get("/api/admin/users")
-async def admin_users(request: Request, page: int = 1, per_page: int = 20):
+async def admin_users(request: Request, cursor: str = "", per_page: int = 20):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
-        offset = (page - 1) * per_page
-        rows = db.execute(
-            "SELECT id, email, phone, nickname, credit_amount, credit_score, credit_level, is_blocked, created_at, last_login FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?",
-            (per_page, offset)
-        ).fetchall()
-        total = db.execute("SELECT COUNT(*) as c FROM users").fetchone()['c']
-    return {"users": [dict(r) for r in rows], "total": total}
+
+    def query(db):
+        require_admin(token, db)
+        try:
+            rows, next_cursor = keyset_page(
+                db, queries.ADMIN_USERS_SELECT, [], [], page_size(per_page), cursor)
+        except InvalidCursor:
+            raise HTTPException(400, "无效的分页游标")
+        return {"users": [dict(r) for r in rows], "total": row_count(db, "users"), "next_cursor": next_cursor}
+
+    return await db_call(query, timeout=DB_TIMEOUT_ADMIN)
 
 @app.post("/api/admin/users/{user_id}/block")
 async def admin_block_user(user_id: str, request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
+
+    def query(db):
+        require_admin(token, db)
         db.execute("UPDATE users SET is_blocked=1 WHERE id=?", (user_id,))
+        invalidate_user(db, user_id)
         logger.info(f"[ADMIN] blocked user={user_id}")
+
+    await db_call(query)
     return {"ok": True}
 
 @app.post("/api/admin/users/{user_id}/unblock")
 async def admin_unblock_user(user_id: str, request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
+
+    def query(db):
+        require_admin(token, db)
         db.execute("UPDATE users SET is_blocked=0 WHERE id=?", (user_id,))
+        invalidate_user(db, user_id)
         logger.info(f"[ADMIN] unblocked user={user_id}")
+
+    await db_call(query)
     return {"ok": True}
 
 @app.post("/api/admin/confirm-payment/{order_id}")
 async def admin_confirm_payment(order_id: str, request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
+
+    def query(db):
+        require_admin(token, db)
         order = db.execute("SELECT * FROM orders WHERE id=?", (order_id,)).fetchone()
         if not order:
             raise HTTPException(404, "订单不存在")
-        order = dict(order)
         now = datetime.now().isoformat()
-        db.execute("UPDATE orders SET status='processing', updated_at=? WHERE id=?", (now, order_id))
+        cur = db.execute(
+            "UPDATE orders SET status='processing', updated_at=? WHERE id=? AND status NOT IN ('processing','paying','completed')",
+            (now, order_id)
+        )
+        if cur.rowcount == 0:
+            raise HTTPException(409, f"订单当前状态为 {order['status']}，无法确认付款")
+        publish_order_event(db, order_id, 'processing')
         logger.info(f"[ADMIN] confirmed payment for order={order_id}")
+
+    await db_call(query)
+    notify_dispatcher()
+    stream_hub.wake()
     return {"ok": True}
 
 @app.post("/api/admin/toggle-cny")
 async def admin_toggle_cny(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    with get_db() as db:
-        if not get_admin_from_token(token, db):
-            raise HTTPException(401, "未授权")
+
+    def query(db):
+        require_admin(token, db)
         row = db.execute("SELECT value FROM settings WHERE key='cny_active'").fetchone()
-        new_val = '0' if (row and row['value'] == '1') else '1'
-        db.execute("UPDATE settings SET value=? WHERE key='cny_active'", (new_val,))
-    return {"cny_active": new_val == '1'}
+        new_val = not (row and row['value'] == '1')
+        settings.set(db, 'cny_active', new_val)
+        return new_val
+
+    new_val = await db_call(query)
+    return {"cny_active": new_val}
+
+@app.post("/api/admin/stream/ticket")
+async def admin_stream_ticket(request: Request):
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+
+    def query(db):
+        require_admin(token, db)
+        return issue_ticket(db, '', is_admin=True)
+
+    return {"ticket": await db_call(query)}
+
+@app.get("/api/admin/stream")
+async def admin_stream(request: Request, ticket: str = ""):
+    """全部订单状态变更的实时推送；ticket 来自 POST /api/admin/stream/ticket"""
+    valid, _ = await db_call(redeem_ticket, ticket, True)
+    if not valid:
+        raise HTTPException(401, "连接票据无效或已过期")
+    try:
+        sub = stream_hub.subscribe(None, is_admin=True)
+    except TooManyStreams as e:
+        raise HTTPException(429, str(e))
+    return sse_response(sub, request)
+
+PHONE_BATCH_MAX = 100000
+
+@app.post("/api/admin/phones/validate")
+async def admin_validate_phones(request: Request):
+    """批量校验号码：{"phones": [...]} → 每个号码的规范化结果、运营商和统计"""
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    await db_call(lambda db: require_admin(token, db))
+    body = await request.json()
+    phones = body.get("phones") or []
+    if not isinstance(phones, list) or not all(isinstance(p, str) for p in phones):
+        raise HTTPException(400, "phones 必须是字符串列表")
+    if len(phones) > PHONE_BATCH_MAX:
+        raise HTTPException(400, f"单次最多 {PHONE_BATCH_MAX} 个号码")
+    # 纯 CPU 计算，放在默认线程池，不占用数据库线程池的工作线程
+    results = await asyncio.get_running_loop().run_in_executor(None, validate_batch, phones)
+    return {
+        "summary": summarize_batch(results),
+        "results": [{"input": raw, "phone": phone, "operator": operator, "error": error}
+                    for raw, (phone, operator, error) in zip(phones, results)],
+    }
+
+@app.get("/api/admin/metrics")
+async def admin_metrics(request: Request):
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    await db_call(lambda db: require_admin(token, db))
+    return {"db": db_stats(), "session_cache": session_cache.stats(), "notifications": notifier.stats(),
+            "rate_limit": rate_limiter.stats(), "static": assets.stats(),
+            "settings": settings.stats(), "stream": stream_hub.stats(), "passwords": passwords.stats()}
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=False)
+    parser = argparse.ArgumentParser(description="VeloceVoce 惟落雀 服务")
+    parser.add_argument("--host", default=os.environ.get("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVER_WORKERS", "1")))
+    args = parser.parse_args()
+    if args.workers > 1:
+        # 主进程已在导入时完成迁移；worker 继承环境变量，跳过迁移。
+        # 登录/注册/短信限额改为各 worker 共享，普通请求仍在进程内限速，不为每个请求写一次 SQLite
+        os.environ["RECHARGE_SCHEMA_READY"] = "1"
+        os.environ.setdefault("RATE_LIMIT_BACKEND", "hybrid")
+        logger.info(f"[SERVER] starting {args.workers} workers on {args.host}:{args.port}")
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, reload=False)
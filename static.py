@@ -0,0 +1,158 @@
+"""
+VeloceVoce 惟落雀 - 页面与静态资源
+  - 文件只在首次访问或磁盘上发生变化时读取，内容常驻内存
+  - 预先生成 gzip（安装了 brotli 时还有 br）压缩版本，按 Accept-Encoding 选择
+  - 强 ETag + If-None-Match → 304
+  - HTML 中的 /style.css、/app.js 改写为带内容指纹的 URL（?v=…），
+    指纹 URL 长期缓存（immutable），HTML 本身每次用 ETag 校验
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import threading
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESS_MIN_SIZE = 512
+
+MEDIA_TYPES = {
+    'style.css': 'text/css; charset=utf-8',
+    'app.js': 'application/javascript; charset=utf-8',
+}
+HTML_TYPE = 'text/html; charset=utf-8'
+
+
+class StaticAsset:
+    def __init__(self, body, media_type, stat_key, deps=None):
+        self.media_type = media_type
+        self.stat_key = stat_key
+        self.deps = deps or {}
+        digest = hashlib.sha256(body).hexdigest()
+        self.fingerprint = digest[:12]
+        self.etag = f'"{digest[:32]}"'
+        self.variants = {'identity': body}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=11)
+
+    def choose(self, accept_encoding):
+        accepted = {part.split(';')[0].strip() for part in accept_encoding.lower().split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return 'identity'
+
+    def etag_for(self, encoding):
+        # 不同编码是不同表示，强 ETag 必须不同
+        return self.etag if encoding == 'identity' else f'{self.etag[:-1]}-{encoding}"'
+
+
+class AssetStore:
+    """按文件名缓存资源；每个文件最多每 check_interval 秒 stat 一次"""
+
+    def __init__(self, base_dir, fingerprinted=('style.css', 'app.js'), check_interval=2.0):
+        self.base_dir = base_dir
+        self.fingerprinted = fingerprinted
+        self.check_interval = check_interval
+        self._assets = {}
+        self._checked = {}
+        # HTML 加载时会递归加载其引用的 CSS/JS
+        self._lock = threading.RLock()
+        self.loads = 0
+
+    def _stat(self, name):
+        try:
+            st = os.stat(os.path.join(self.base_dir, name))
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self, name, media_type, stat_key):
+        with open(os.path.join(self.base_dir, name), 'rb') as f:
+            body = f.read()
+        deps = {}
+        if media_type.startswith('text/html'):
+            for dep in self.fingerprinted:
+                ref = f'"/{dep}"'.encode()
+                if ref not in body:
+                    continue
+                asset = self.get(dep, MEDIA_TYPES[dep])
+                if asset is None:
+                    continue
+                deps[dep] = asset.fingerprint
+                body = body.replace(ref, f'"/{dep}?v={asset.fingerprint}"'.encode())
+        self.loads += 1
+        return StaticAsset(body, media_type, stat_key, deps)
+
+    def _stale(self, name, asset):
+        now = time.monotonic()
+        if now - self._checked.get(name, 0) < self.check_interval:
+            return False
+        self._checked[name] = now
+        if self._stat(name) != asset.stat_key:
+            return True
+        # 引用的 CSS/JS 变了，HTML 中的指纹也要更新
+        for dep in asset.deps:
+            self.get(dep, MEDIA_TYPES[dep])
+        return self._deps_changed(asset)
+
+    def _deps_changed(self, asset):
+        for dep, fp in asset.deps.items():
+            current = self._assets.get(dep)
+            if current is None or current.fingerprint != fp:
+                return True
+        return False
+
+    def get(self, name, media_type):
+        """返回 StaticAsset；文件不存在时返回 None"""
+        asset = self._assets.get(name)
+        if asset is not None and not self._stale(name, asset):
+            return asset
+        with self._lock:
+            stat_key = self._stat(name)
+            if stat_key is None:
+                self._assets.pop(name, None)
+                return None
+            asset = self._assets.get(name)
+            if asset is None or asset.stat_key != stat_key or self._deps_changed(asset):
+                asset = self._load(name, media_type, stat_key)
+                self._assets[name] = asset
+                self._checked[name] = time.monotonic()
+            return asset
+
+    def stats(self):
+        return {
+            "assets": len(self._assets),
+            "loads": self.loads,
+            "bytes": {name: {enc: len(body) for enc, body in a.variants.items()}
+                      for name, a in self._assets.items()},
+        }
+
+
+def serve(request, asset):
+    """按请求头返回 304 或合适编码的内容"""
+    fingerprinted = request.query_params.get('v') == asset.fingerprint
+    encoding = asset.choose(request.headers.get('accept-encoding', ''))
+    headers = {
+        'ETag': asset.etag_for(encoding),
+        'Cache-Control': IMMUTABLE if fingerprinted else REVALIDATE,
+        'Vary': 'Accept-Encoding',
+    }
+    if_none_match = request.headers.get('if-none-match', '')
+    if if_none_match:
+        tags = {t.strip().removeprefix('W/') for t in if_none_match.split(',')}
+        if '*' in tags or headers['ETag'] in tags:
+            return Response(status_code=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
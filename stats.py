@@ -0,0 +1,151 @@
+"""
+VeloceVoce 惟落雀 - 订单统计汇总表
+由触发器在每次订单写入时增量维护（见 migrations._m010_order_rollups）：
+  - row_counts：总数、按状态的订单数和金额
+  - order_stats_daily：按 创建日期 × 状态 × 运营商 的订单数和金额
+  - order_completions_daily：按 完成日期 × 运营商 的完成订单数和金额
+后台统计和每日报告只读汇总表，耗时与订单总量无关。
+
+命令行：
+  python stats.py check     # 对比汇总表与 orders 实时聚合，列出不一致（只读；库未迁移到最新版本时报错退出）
+  python stats.py rebuild   # 先执行迁移，再从 orders/users 全量重建汇总表
+"""
+
+import sys
+import logging
+
+from database import get_db
+from migrations import migrate, schema_ready, current_version, LATEST_VERSION
+
+logger = logging.getLogger('stats')
+
+ROLLUP_TABLES = ('row_counts', 'order_stats_daily', 'order_completions_daily')
+
+# 完成日期：updated_at 为空的历史订单退回到创建日期
+COMPLETED_DAY = "substr(COALESCE(NULLIF({row}.updated_at, ''), {row}.created_at), 1, 10)"
+
+_ACTUAL = {
+    'row_counts': """
+        SELECT 'orders' AS k, COUNT(*) AS n, COALESCE(SUM(amount), 0) AS amount FROM orders
+        UNION ALL
+        SELECT 'orders:' || status, COUNT(*), COALESCE(SUM(amount), 0) FROM orders GROUP BY status
+        UNION ALL
+        SELECT 'users', COUNT(*), 0 FROM users
+    """,
+    'order_stats_daily': """
+        SELECT substr(created_at, 1, 10) || '|' || status || '|' || operator AS k,
+               COUNT(*) AS n, COALESCE(SUM(amount), 0) AS amount
+        FROM orders GROUP BY 1
+    """,
+    'order_completions_daily': f"""
+        SELECT {COMPLETED_DAY.format(row='orders')} || '|' || operator AS k,
+               COUNT(*) AS n, COALESCE(SUM(amount), 0) AS amount
+        FROM orders WHERE status = 'completed' GROUP BY 1
+    """,
+}
+
+_STORED = {
+    'row_counts': "SELECT name AS k, n, amount FROM row_counts",
+    'order_stats_daily': "SELECT day || '|' || status || '|' || operator AS k, orders AS n, amount FROM order_stats_daily",
+    'order_completions_daily': "SELECT day || '|' || operator AS k, orders AS n, amount FROM order_completions_daily",
+}
+
+
+def rebuild_rollups(db):
+    """全量重建（迁移回填、修复不一致时使用）；由调用方提交"""
+    for table in ROLLUP_TABLES:
+        db.execute(f"DELETE FROM {table}")
+    db.execute(f"INSERT INTO row_counts (name, n, amount) {_ACTUAL['row_counts']}")
+    db.execute("""
+        INSERT INTO order_stats_daily (day, status, operator, orders, amount)
+        SELECT substr(created_at, 1, 10), status, operator, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM orders GROUP BY 1, 2, 3
+    """)
+    db.execute(f"""
+        INSERT INTO order_completions_daily (day, operator, orders, amount)
+        SELECT {COMPLETED_DAY.format(row='orders')}, operator, COUNT(*), COALESCE(SUM(amount), 0)
+        FROM orders WHERE status = 'completed' GROUP BY 1, 2
+    """)
+
+
+def check_rollups(db):
+    """返回不一致列表 [(表, 键, 汇总值, 实际值)]；汇总表中计数为 0 的行视为不存在"""
+    problems = []
+    for table in ROLLUP_TABLES:
+        stored = {r['k']: (r['n'], round(r['amount'], 2)) for r in db.execute(_STORED[table])}
+        actual = {r['k']: (r['n'], round(r['amount'], 2)) for r in db.execute(_ACTUAL[table])}
+        for key in sorted(set(stored) | set(actual)):
+            s = stored.get(key, (0, 0))
+            a = actual.get(key, (0, 0))
+            if s != a:
+                problems.append((table, key, s, a))
+    return problems
+
+
+def _status_totals(db, status):
+    row = db.execute("SELECT n, amount FROM row_counts WHERE name=?", (f"orders:{status}",)).fetchone()
+    return (row['n'], row['amount']) if row else (0, 0)
+
+
+def dashboard(db, today):
+    """/api/admin/stats 使用的汇总"""
+    total_users = db.execute("SELECT n FROM row_counts WHERE name='users'").fetchone()
+    total_orders = db.execute("SELECT n FROM row_counts WHERE name='orders'").fetchone()
+    completed, revenue = _status_totals(db, 'completed')
+    pending = sum(_status_totals(db, s)[0] for s in ('pending', 'charged', 'processing'))
+    today_orders = db.execute(
+        "SELECT COALESCE(SUM(orders), 0) FROM order_stats_daily WHERE day=?", (today,)
+    ).fetchone()[0]
+    return {
+        "total_users": total_users['n'] if total_users else 0,
+        "total_orders": total_orders['n'] if total_orders else 0,
+        "completed_orders": completed,
+        "pending_orders": pending,
+        "total_revenue": revenue,
+        "today_orders": today_orders,
+    }
+
+
+def daily_report(db, day):
+    """payment_bot 每日报告使用的汇总"""
+    total_orders = db.execute(
+        "SELECT COALESCE(SUM(orders), 0) FROM order_stats_daily WHERE day=?", (day,)
+    ).fetchone()[0]
+    completed = db.execute(
+        "SELECT COALESCE(SUM(orders), 0) AS n, COALESCE(SUM(amount), 0) AS amount "
+        "FROM order_completions_daily WHERE day=?", (day,)
+    ).fetchone()
+    return {
+        "total_orders": total_orders,
+        "completed": completed['n'],
+        "awaiting_payment": _status_totals(db, 'awaiting_payment')[0],
+        "revenue": completed['amount'],
+    }
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    command = argv[1] if len(argv) > 1 else 'check'
+    with get_db() as db:
+        if command == 'rebuild':
+            migrate(db)
+            db.execute("BEGIN IMMEDIATE")
+            rebuild_rollups(db)
+            logger.info("[STATS] rollups rebuilt")
+            return 0
+        if command == 'check':
+            if not schema_ready(db):
+                logger.error(f"[STATS] schema version {current_version(db)} < {LATEST_VERSION}, "
+                             f"run migrations (or `python stats.py rebuild`) first")
+                return 2
+            problems = check_rollups(db)
+            for table, key, stored, actual in problems:
+                logger.warning(f"[STATS] {table} {key}: stored={stored} actual={actual}")
+            logger.info(f"[STATS] {len(problems)} mismatches")
+            return 1 if problems else 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
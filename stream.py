@@ -0,0 +1,214 @@
+"""
+VeloceVoce 惟落雀 - 实时推送（Server-Sent Events）
+  - StreamHub：每个 server 进程一个轮询任务，按 id 增量读取 order_events（所有进程的订单状态变更都写在这里）
+    和 site_messages，再按用户分发给已连接的客户端；数据库查询次数与连接数无关
+  - 用户连接只收到自己的订单和消息，管理员连接收到全部订单事件
+  - 连接数限制：总数和每个用户各有上限，超出返回 429
+  - 背压：每个连接有固定长度的队列，客户端读得太慢导致队列满时发送 resync 并断开，
+    客户端重连后重新拉取完整列表
+  - 认证：EventSource 不能带请求头，客户端先用 Authorization 头换一张 TICKET_TTL 秒内有效的一次性票据，
+    连接 URL 中只带票据；会话 token 不会出现在访问日志、代理日志和浏览器历史里
+"""
+
+import json
+import secrets
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from database import run_db
+
+logger = logging.getLogger('stream')
+
+QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+POLL_INTERVAL = 1.0
+BATCH_LIMIT = 500
+TICKET_TTL = 30
+
+ISSUE_TICKET_SQL = "INSERT INTO stream_tickets (ticket, user_id, is_admin, expires_at) VALUES (?,?,?,?)"
+# 取出即删除：同一张票据只能建立一次连接
+REDEEM_TICKET_SQL = "DELETE FROM stream_tickets WHERE ticket=? AND is_admin=? RETURNING user_id, expires_at"
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+def issue_ticket(db, user_id, is_admin=False):
+    """登记一张一次性连接票据，随调用方事务提交"""
+    ticket = secrets.token_urlsafe(32)
+    expires = (datetime.now() + timedelta(seconds=TICKET_TTL)).isoformat()
+    db.execute(ISSUE_TICKET_SQL, (ticket, user_id, int(is_admin), expires))
+    return ticket
+
+
+def redeem_ticket(db, ticket, is_admin=False):
+    """核销票据，返回 (是否有效, user_id)；过期的票据同样被删除"""
+    if not ticket:
+        return False, None
+    row = db.execute(REDEEM_TICKET_SQL, (ticket, int(is_admin))).fetchone()
+    if not row or row['expires_at'] <= datetime.now().isoformat():
+        return False, None
+    return True, row['user_id']
+
+
+class Subscriber:
+    def __init__(self, user_id, is_admin=False):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, event, data):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # 丢弃积压，只保留一条 resync，客户端收到后重连并全量刷新
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(('resync', {}))
+
+
+def _fetch_since(db, last_order_event, last_message):
+    orders = db.execute("""
+        SELECT e.id, e.order_id, e.status, e.created_at, o.user_id, o.phone, o.operator, o.amount, o.message
+        FROM order_events e JOIN orders o ON o.id = e.order_id
+        WHERE e.id > ? ORDER BY e.id LIMIT ?
+    """, (last_order_event, BATCH_LIMIT)).fetchall()
+    messages = db.execute("""
+        SELECT id, user_id, type, title, content, order_id, created_at
+        FROM site_messages WHERE id > ? ORDER BY id LIMIT ?
+    """, (last_message, BATCH_LIMIT)).fetchall()
+    return [dict(r) for r in orders], [dict(r) for r in messages]
+
+
+def _latest_ids(db):
+    return (db.execute("SELECT COALESCE(MAX(id), 0) FROM order_events").fetchone()[0],
+            db.execute("SELECT COALESCE(MAX(id), 0) FROM site_messages").fetchone()[0])
+
+
+class StreamHub:
+    def __init__(self, max_streams=2000, max_per_user=5, poll_interval=POLL_INTERVAL):
+        self.max_streams = max_streams
+        self.max_per_user = max_per_user
+        self.poll_interval = poll_interval
+        self._users = {}
+        self._admins = set()
+        self._wake = asyncio.Event()
+        self._cursor = None
+        self.polls = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.rejected = 0
+
+    @property
+    def connections(self):
+        return sum(len(subs) for subs in self._users.values()) + len(self._admins)
+
+    def subscribe(self, user_id, is_admin=False):
+        if self.connections >= self.max_streams:
+            self.rejected += 1
+            raise TooManyStreams("连接数已满，请稍后再试")
+        sub = Subscriber(user_id, is_admin)
+        if is_admin:
+            self._admins.add(sub)
+        else:
+            subs = self._users.setdefault(user_id, set())
+            if len(subs) >= self.max_per_user:
+                self.rejected += 1
+                raise TooManyStreams("同一账号的实时连接过多")
+            subs.add(sub)
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        if sub.is_admin:
+            self._admins.discard(sub)
+            return
+        subs = self._users.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._users[sub.user_id]
+        if sub.overflowed:
+            self.overflows += 1
+
+    def wake(self):
+        """本进程写入订单/消息后调用，立即轮询而不等待 poll_interval"""
+        self._wake.set()
+
+    def _dispatch(self, event, data, user_id):
+        for sub in self._users.get(user_id, ()):
+            sub.push(event, data)
+            self.delivered += 1
+        if event == 'order':
+            for sub in self._admins:
+                sub.push(event, data)
+                self.delivered += 1
+
+    async def poll_once(self):
+        if self._cursor is None:
+            # 首个连接建立前的事件已体现在客户端首次拉取的列表中
+            self._cursor = await run_db(_latest_ids)
+            return
+        orders, messages = await run_db(_fetch_since, *self._cursor)
+        self.polls += 1
+        last_order, last_message = self._cursor
+        for row in orders:
+            last_order = row.pop('id')
+            self._dispatch('order', row, row['user_id'])
+        for row in messages:
+            last_message = row['id']
+            self._dispatch('message', row, row['user_id'])
+        self._cursor = (last_order, last_message)
+        if len(orders) == BATCH_LIMIT or len(messages) == BATCH_LIMIT:
+            self._wake.set()
+
+    async def run_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self.connections:
+                # 无人订阅时不查库；下次有连接时从最新位置开始
+                self._cursor = None
+                continue
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"[STREAM] poll error: {e}")
+
+    async def events(self, sub, is_disconnected):
+        """SSE 文本流；客户端断开或背压溢出时结束"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(sub.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        return
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                if event == 'resync':
+                    return
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "users": len(self._users),
+            "admins": len(self._admins),
+            "polls": self.polls,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "rejected": self.rejected,
+        }
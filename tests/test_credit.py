@@ -0,0 +1,224 @@
+"""
+信用积分一致性测试：同一随机订单流上，record_order 每一笔的返回值和用户积分状态都必须与
+重构前的 update_credit_score（下方原样复制，只去掉日志）一致；增量结果与 recompute_all / check_all
+从 credit_baseline + credit_events 聚合重算的结果一致；规则调整后 SQL 重算与旧实现逐笔回放一致；
+同一订单重复完成只计一次分；check 不迁移库。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+from datetime import datetime
+
+import credit
+from database import connect
+from migrations import migrate
+
+USERS = 200
+EVENTS = 2000
+
+LEGACY_LEVELS = [
+    {"name": "新手", "icon": "🌱", "min_score": 0,   "credit_limit": 10,  "discount": 1.0, "bonus": 0},
+    {"name": "铜牌", "icon": "🥉", "min_score": 50,  "credit_limit": 15,  "discount": 1.0, "bonus": 0},
+    {"name": "银牌", "icon": "🥈", "min_score": 150, "credit_limit": 25,  "discount": 1.0, "bonus": 5},
+    {"name": "金牌", "icon": "🥇", "min_score": 300, "credit_limit": 50,  "discount": 0.9, "bonus": 0},
+    {"name": "钻石", "icon": "💎", "min_score": 500, "credit_limit": 100, "discount": 0.8, "bonus": 10},
+]
+
+
+# 重构前 server.py 的实现；连胜奖励分数提成参数，供规则调整测试使用
+def legacy_get_credit_level(score):
+    level = LEGACY_LEVELS[0]
+    for lv in LEGACY_LEVELS:
+        if score >= lv["min_score"]:
+            level = lv
+    return level
+
+
+def legacy_update_credit_score(db, user_id, order_amount, is_credit_order=False, streak_points=30):
+    user = db.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not user:
+        return
+    user = dict(user)
+
+    score = user.get('credit_score', 0) or 0
+    total = user.get('total_spent', 0) or 0
+    streak = user.get('consecutive_success', 0) or 0
+    m100 = user.get('milestone_100', 0) or 0
+    m300 = user.get('milestone_300', 0) or 0
+
+    if order_amount >= 30:
+        points = 20
+    elif order_amount >= 15:
+        points = 10
+    else:
+        points = 5
+
+    if is_credit_order:
+        points += 15
+
+    streak += 1
+    if streak >= 3 and streak % 3 == 0:
+        points += streak_points
+
+    score += points
+    total += order_amount
+
+    if total >= 100 and not m100:
+        score += 50
+        m100 = 1
+    if total >= 300 and not m300:
+        score += 100
+        m300 = 1
+
+    new_level = legacy_get_credit_level(score)
+
+    db.execute("""
+        UPDATE users SET credit_score = ?, credit_level = ?, total_spent = ?,
+        consecutive_success = ?, milestone_100 = ?, milestone_300 = ?,
+        credit_amount = ?
+        WHERE id = ?
+    """, (score, new_level["name"], total, streak, m100, m300,
+          new_level["credit_limit"], user_id))
+
+    return {"points_added": points, "new_score": score, "new_level": new_level}
+
+
+class CreditConsistencyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rng = random.Random(25)
+        self.baseline = {}
+        for i in range(USERS):
+            # 一部分用户带着启用账本前的积分状态，与迁移 14 的快照一致
+            if i % 3:
+                total = self.rng.choice([0, 40, 95, 150, 299, 320])
+                state = (self.rng.randint(0, 400), total, self.rng.randint(0, 7),
+                         int(total >= 100), int(total >= 300))
+            else:
+                state = (0, 0, 0, 0, 0)
+            self.baseline[f"user-{i:04d}"] = state
+        self.events = [(f"user-{self.rng.randrange(USERS):04d}", f"order-{n:05d}",
+                        self.rng.choice([5, 10, 15, 20, 30, 50]), self.rng.random() < 0.3)
+                       for n in range(EVENTS)]
+        self.db = self.seeded_db('credit.db')
+        self.legacy = self.seeded_db('legacy.db')
+        # 每一笔：(事件, record_order 返回值, 旧实现返回值, 新库用户行, 旧库用户行)
+        self.trace = []
+        for event in self.events:
+            user_id, _, amount, is_credit = event
+            result = credit.record_order(self.db, *event)
+            expected = legacy_update_credit_score(self.legacy, user_id, amount, is_credit)
+            self.trace.append((event, result, expected, self.user_row(self.db, user_id),
+                               self.user_row(self.legacy, user_id)))
+        self.db.commit()
+        self.legacy.commit()
+
+    def tearDown(self):
+        self.db.close()
+        self.legacy.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def seeded_db(self, name):
+        db = connect(os.path.join(self.tmpdir, name))
+        migrate(db)
+        for user_id, state in self.baseline.items():
+            db.execute(f"""
+                INSERT INTO users (id, password_hash, created_at, {', '.join(credit.STATE_COLUMNS)})
+                VALUES (?,?,?,?,?,?,?,?)
+            """, (user_id, 'x', datetime.now().isoformat(), *state))
+            if any(state):
+                db.execute("""
+                    INSERT INTO credit_baseline (user_id, score, total_spent, streak, milestone_100, milestone_300)
+                    VALUES (?,?,?,?,?,?)
+                """, (user_id, *state))
+        db.commit()
+        return db
+
+    @staticmethod
+    def user_row(db, user_id):
+        row = db.execute(f"SELECT {', '.join(credit.STATE_COLUMNS)}, credit_level, credit_amount "
+                         f"FROM users WHERE id = ?", (user_id,)).fetchone()
+        return tuple(row)
+
+    @staticmethod
+    def states(db):
+        return {row['id']: tuple(row[col] for col in credit.STATE_COLUMNS)
+                for row in db.execute(f"SELECT id, {', '.join(credit.STATE_COLUMNS)} FROM users")}
+
+    def stored(self):
+        return self.states(self.db)
+
+    def legacy_replay(self, streak_points=30):
+        """在新的库上用旧实现从 baseline 逐笔回放，返回各用户的积分状态"""
+        db = self.seeded_db(f'legacy-{streak_points}.db')
+        try:
+            for user_id, _, amount, is_credit in self.events:
+                legacy_update_credit_score(db, user_id, amount, is_credit, streak_points)
+            return self.states(db)
+        finally:
+            db.close()
+
+    def test_record_order_matches_legacy_per_event(self):
+        for n, (event, result, expected, row, legacy_row) in enumerate(self.trace):
+            with self.subTest(n=n, event=event):
+                self.assertIsNotNone(result)
+                self.assertEqual(result['points_added'], expected['points_added'])
+                self.assertEqual(result['new_score'], expected['new_score'])
+                self.assertEqual(result['new_level']['name'], expected['new_level']['name'])
+                self.assertEqual(row, legacy_row)
+        self.assertEqual(self.stored(), self.states(self.legacy))
+
+    def test_incremental_matches_recompute(self):
+        self.assertEqual(credit.check_all(self.db), [])
+        self.assertEqual(credit.recompute_all(self.db), 0)
+        self.assertEqual(self.stored(), self.states(self.legacy))
+        for row in self.db.execute("SELECT credit_score, credit_level, credit_amount FROM users"):
+            level = credit.get_credit_level(row['credit_score'])
+            self.assertEqual((row['credit_level'], row['credit_amount']), (level['name'], level['credit_limit']))
+
+    def test_recompute_after_rule_change_matches_legacy_replay(self):
+        with mock.patch.object(credit, 'STREAK_POINTS', credit.STREAK_POINTS + 10):
+            self.assertGreater(len(credit.check_all(self.db)), 0)
+            self.assertGreater(credit.recompute_all(self.db), 0)
+            self.assertEqual(self.stored(), self.legacy_replay(credit.STREAK_POINTS))
+            self.assertEqual(credit.check_all(self.db), [])
+
+    def test_order_is_scored_once(self):
+        user_id, order_id, amount, is_credit = self.events[0]
+        before = self.stored()[user_id]
+        self.assertIsNone(credit.record_order(self.db, user_id, order_id, amount, is_credit))
+        self.assertEqual(self.stored()[user_id], before)
+        count = self.db.execute("SELECT COUNT(*) FROM credit_events WHERE order_id=?", (order_id,)).fetchone()[0]
+        self.assertEqual(count, 1)
+        self.assertEqual(credit.check_all(self.db), [])
+
+    def test_level_lookup_matches_linear_scan(self):
+        def linear(score):
+            level = credit.CREDIT_LEVELS[0]
+            for lv in credit.CREDIT_LEVELS:
+                if score >= lv['min_score']:
+                    level = lv
+            return level
+        for score in range(-10, 700):
+            self.assertIs(credit.get_credit_level(score), linear(score))
+            self.assertEqual(credit.get_credit_level(score)['name'], legacy_get_credit_level(score)['name'])
+
+    def test_check_does_not_migrate(self):
+        db = connect(os.path.join(self.tmpdir, 'empty.db'))
+        try:
+            with mock.patch.object(credit, 'get_db', lambda: contextlib.nullcontext(db)):
+                self.assertEqual(credit.main(['credit.py', 'check']), 2)
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0], 0)
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
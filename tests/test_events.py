@@ -0,0 +1,45 @@
+"""
+调度器唤醒测试：收到 UDP 通知立即返回；端口被占用时退化为按 poll_interval 轮询，
+不会一直睡到下一次对账。
+
+运行：python -m unittest discover tests
+"""
+
+import time
+import socket
+import unittest
+
+from events import EventWaiter, notify_dispatcher
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class EventWaiterTest(unittest.TestCase):
+    def test_notification_wakes_waiter(self):
+        waiter = EventWaiter(free_udp_port())
+        self.addCleanup(waiter.close)
+        self.assertFalse(waiter.polling)
+        notify_dispatcher(waiter.port)
+        start = time.monotonic()
+        self.assertTrue(waiter.wait(5))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertFalse(waiter.wait(0.05))
+
+    def test_bind_failure_falls_back_to_poll_interval(self):
+        holder = EventWaiter(free_udp_port())
+        self.addCleanup(holder.close)
+        with self.assertLogs('events', 'WARNING') as logs:
+            waiter = EventWaiter(holder.port, poll_interval=0.1)
+        self.assertTrue(waiter.polling)
+        self.assertIn('polling mode', logs.output[0])
+        start = time.monotonic()
+        self.assertFalse(waiter.wait(60))
+        self.assertLess(time.monotonic() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+"""
+通知投递测试：TELEGRAM_API / PUSHPLUS_URL 指向 httpx.MockTransport 模拟的服务端，
+NotificationService 从发件箱领取消息：积压的消息合并为摘要；429 按 retry_after 等待，5xx 指数退避重试；
+超过 MAX_ATTEMPTS 次后标记为 failed，不再发送。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime
+
+import httpx
+
+import notify
+import database
+from database import connect, ConnectionPool
+from migrations import migrate
+
+CREDENTIALS = {
+    'telegram': {'token': 'tg-token', 'chat_id': 'chat'},
+    'pushplus': {'token': 'pp-token', 'topic': ''},
+}
+
+
+class FakeServer:
+    """按顺序返回预设的响应，用完后一律返回成功"""
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+
+    def handler(self, request):
+        self.requests.append(request)
+        if self.responses:
+            return self.responses.pop(0)
+        if request.url.path.startswith('/pushplus'):
+            return httpx.Response(200, json={'code': 200, 'msg': '请求成功'})
+        return httpx.Response(200, json={'ok': True})
+
+
+class NotificationServiceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        db_file = os.path.join(self.tmpdir, 'notify.db')
+        self.db = connect(db_file)
+        migrate(self.db)
+        pool = ConnectionPool(db_file)
+        for name, value in (('TELEGRAM_API', 'http://notify.test/telegram'),
+                            ('PUSHPLUS_URL', 'http://notify.test/pushplus/send')):
+            patcher = mock.patch.object(notify, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(database, '_pool', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(pool.close_all)
+
+        self.server = FakeServer()
+        self.service = notify.NotificationService(CREDENTIALS, 'test-worker')
+        # 令牌桶放开，测试只关心服务端的响应
+        self.service.buckets = {c: notify.TokenBucket(1000, 1000) for c in self.service.channels}
+
+    async def asyncSetUp(self):
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(self.server.handler))
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def enqueue(self, channel, count, body='消息 {}'):
+        for i in range(count):
+            notify.enqueue(self.db, channel, CREDENTIALS[channel], body.format(i), f"标题 {i}")
+        self.db.commit()
+
+    def notifications(self):
+        return [dict(row) for row in self.db.execute("SELECT * FROM notifications ORDER BY id")]
+
+    def make_due(self):
+        """跳过退避等待"""
+        self.db.execute("UPDATE notifications SET next_attempt_at=? WHERE status='pending'",
+                        (datetime.now().isoformat(),))
+        self.db.commit()
+
+    def assertRetryIn(self, row, seconds):
+        wait = datetime.fromisoformat(row['next_attempt_at']) - datetime.now()
+        self.assertAlmostEqual(wait.total_seconds(), seconds, delta=5)
+
+    async def test_backlog_is_sent_as_digests(self):
+        self.enqueue('telegram', 25)
+        self.assertEqual(await self.service.deliver_once(self.client), 20)
+        self.assertEqual(await self.service.deliver_once(self.client), 5)
+        self.assertEqual(await self.service.deliver_once(self.client), 0)
+
+        self.assertEqual(len(self.server.requests), 2)
+        first = self.server.requests[0]
+        self.assertEqual(first.url, 'http://notify.test/telegram/bottg-token/sendMessage')
+        text = json.loads(first.content)['text']
+        self.assertTrue(text.startswith('📬 20 条通知汇总'))
+        self.assertIn('消息 0', text)
+        self.assertIn('消息 19', text)
+        self.assertEqual({row['status'] for row in self.notifications()}, {'sent'})
+        self.assertEqual(self.service.stats()['digests'], 2)
+
+    async def test_digest_respects_length_limit(self):
+        self.enqueue('pushplus', 3, body='{}' + 'x' * 2000)
+        self.assertEqual(await self.service.deliver_once(self.client), 1)
+        self.assertEqual(await self.service.deliver_once(self.client), 1)
+        self.assertEqual(await self.service.deliver_once(self.client), 1)
+        # 单条消息原样发送，保留自己的标题
+        payload = json.loads(self.server.requests[0].content)
+        self.assertEqual((payload['title'], payload['token']), ('标题 0', 'pp-token'))
+
+    async def test_server_error_retries_with_backoff(self):
+        self.enqueue('telegram', 1)
+        self.server.responses = [httpx.Response(502, text='Bad Gateway')]
+        with self.assertLogs('notify', 'ERROR'):
+            self.assertEqual(await self.service.deliver_once(self.client), 0)
+        row = self.notifications()[0]
+        self.assertEqual((row['status'], row['attempts']), ('pending', 1))
+        self.assertIn('502', row['last_error'])
+        self.assertRetryIn(row, notify.RETRY_BASE * 2)
+
+        # 未到重试时间不会再发
+        self.assertEqual(await self.service.deliver_once(self.client), 0)
+        self.assertEqual(len(self.server.requests), 1)
+        self.make_due()
+        self.assertEqual(await self.service.deliver_once(self.client), 1)
+        self.assertEqual(self.notifications()[0]['status'], 'sent')
+
+    async def test_rate_limited_waits_retry_after(self):
+        self.enqueue('telegram', 1)
+        self.server.responses = [httpx.Response(429, json={
+            'ok': False, 'error_code': 429, 'parameters': {'retry_after': 30}})]
+        with self.assertLogs('notify', 'ERROR'):
+            await self.service.deliver_once(self.client)
+        row = self.notifications()[0]
+        self.assertEqual((row['status'], row['attempts']), ('pending', 1))
+        self.assertRetryIn(row, 30)
+        # 渠道暂停：即使消息到期也不再请求
+        self.make_due()
+        self.assertEqual(await self.service.deliver_once(self.client), 0)
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.service.buckets['telegram'] = notify.TokenBucket(1000, 1000)
+        self.assertEqual(await self.service.deliver_once(self.client), 1)
+
+    async def test_retry_after_header(self):
+        self.enqueue('pushplus', 1)
+        self.server.responses = [httpx.Response(429, headers={'Retry-After': '120'}, text='slow down')]
+        with self.assertLogs('notify', 'ERROR'):
+            await self.service.deliver_once(self.client)
+        self.assertRetryIn(self.notifications()[0], 120)
+
+    async def test_pushplus_error_code_is_a_failure(self):
+        self.enqueue('pushplus', 1)
+        self.server.responses = [httpx.Response(200, json={'code': 903, 'msg': '无效的用户token'})]
+        with self.assertLogs('notify', 'ERROR'):
+            self.assertEqual(await self.service.deliver_once(self.client), 0)
+        row = self.notifications()[0]
+        self.assertEqual((row['status'], row['attempts']), ('pending', 1))
+        self.assertIn('903', row['last_error'])
+
+    async def test_gives_up_after_max_attempts(self):
+        self.enqueue('telegram', 1)
+        self.server.responses = [httpx.Response(500, text='error')] * (notify.MAX_ATTEMPTS + 1)
+        with self.assertLogs('notify', 'ERROR'):
+            for _ in range(notify.MAX_ATTEMPTS + 1):
+                self.make_due()
+                await self.service.deliver_once(self.client)
+        row = self.notifications()[0]
+        self.assertEqual((row['status'], row['attempts']), ('failed', notify.MAX_ATTEMPTS))
+        self.assertEqual(len(self.server.requests), notify.MAX_ATTEMPTS)
+        self.assertEqual(self.service.stats()['failures'], notify.MAX_ATTEMPTS)
+
+    async def test_other_credentials_are_not_claimed(self):
+        notify.enqueue(self.db, 'telegram', {'token': 'other', 'chat_id': 'chat'}, 'x')
+        self.db.commit()
+        self.assertEqual(await self.service.deliver_once(self.client), 0)
+        self.assertEqual(self.server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
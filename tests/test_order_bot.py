@@ -0,0 +1,218 @@
+"""
+充值机器人端到端测试：PATH 上放一个假的 adb（shell 会话直接交给 /bin/sh，monkey / input 是记录调用的脚本），
+DeviceWorker 走完 claim_order → perform_recharge → finish_claim，表单输入批量走一次会话往返；
+充值过程中租约丢失时：发起支付前丢失的订单交回队列，发起支付后丢失的订单转人工核对、不会被重新领取。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+import database
+import dispatcher
+import order_bot
+from database import connect, ConnectionPool
+from migrations import migrate
+from order_queue import claim_order, reclaim_expired_leases
+
+FAKE_ADB = """#!/bin/sh
+[ "$2" = "bad" ] && exit 1
+[ "$1" = "-s" ] && shift 2
+case "$1" in
+  get-state) echo device ;;
+  shell) shift; if [ $# -eq 0 ]; then exec /bin/sh; else sh -c "$*"; fi ;;
+  exec-out) printf 'PNGDATA' ;;
+esac
+exit 0
+"""
+DEVICE_COMMAND = """#!/bin/sh
+echo "$(basename "$0") $*" >> "$FAKE_ADB_LOG"
+"""
+
+# 各阶段的 sleep 用不同时长区分，测试在对应阶段注入租约过期
+PAGE_LOAD_WAIT = 0.01
+ACTION_DELAY = 0.02
+PAYMENT_RESULT_WAIT = 0.03
+
+CFG = {
+    'page_load_wait': PAGE_LOAD_WAIT,
+    'action_delay_min': ACTION_DELAY,
+    'action_delay_max': ACTION_DELAY,
+    'payment_result_wait': PAYMENT_RESULT_WAIT,
+    'accounts': [{'username': 'bench'}],
+    'recharge_form': {'phone_field': [540, 620], 'amount_field': [540, 900], 'pay_button': [540, 1650]},
+    'telegram_bot_token': 'token',
+    'telegram_chat_id': 'chat',
+}
+
+
+class OrderBotTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(bin_dir)
+        for name, script in (('adb', FAKE_ADB), ('monkey', DEVICE_COMMAND), ('input', DEVICE_COMMAND)):
+            path = os.path.join(bin_dir, name)
+            with open(path, 'w') as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+        self.device_log = os.path.join(self.tmpdir, 'device.log')
+        env = mock.patch.dict(os.environ, {'PATH': bin_dir + os.pathsep + os.environ['PATH'],
+                                           'FAKE_ADB_LOG': self.device_log})
+        env.start()
+        self.addCleanup(env.stop)
+
+        db_file = os.path.join(self.tmpdir, 'bot.db')
+        self.db = connect(db_file)
+        migrate(self.db)
+        pool = ConnectionPool(db_file)
+        patcher = mock.patch.object(database, '_pool', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(pool.close_all)
+        self.addCleanup(self.close_sessions)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    @staticmethod
+    def close_sessions():
+        for session in order_bot._sessions.values():
+            session.close()
+        order_bot._sessions.clear()
+
+    def insert_order(self, order_id):
+        self.db.execute("""
+            INSERT INTO orders (id, user_id, phone, operator, amount, status, created_at)
+            VALUES (?,?,?,?,?,?,?)
+        """, (order_id, 'user', '3331234567', 'TIM', 10, 'processing', datetime.now().isoformat()))
+        self.db.commit()
+
+    def order(self, order_id):
+        return dict(self.db.execute("SELECT * FROM orders WHERE id=?", (order_id,)).fetchone())
+
+    def device_commands(self):
+        if not os.path.exists(self.device_log):
+            return []
+        with open(self.device_log) as f:
+            return f.read().splitlines()
+
+    def session_round_trips(self, name):
+        return order_bot.adb_latency.snapshot().get(f"session:{name}", {}).get('count', 0)
+
+    def expire_lease(self):
+        self.db.execute("UPDATE orders SET lease_expires_at=? WHERE status='paying'",
+                        ((datetime.now() - timedelta(seconds=1)).isoformat(),))
+        self.db.commit()
+
+    def run_with_stall(self, worker, stage, during_stall):
+        """worker 在 stage 对应的 sleep 处卡住时执行 during_stall（模拟 worker 失联期间调度器和管理员的动作）"""
+        real_sleep = time.sleep
+
+        def sleep(seconds):
+            if seconds == stage:
+                during_stall()
+            else:
+                real_sleep(seconds)
+
+        with mock.patch.object(time, 'sleep', sleep):
+            return worker.process_one()
+
+    def test_claim_recharge_finish(self):
+        self.insert_order('order-1')
+        worker = order_bot.DeviceWorker(CFG)
+        round_trips = self.session_round_trips('input')
+        self.assertTrue(worker.process_one())
+        self.assertFalse(worker.process_one())
+
+        order = self.order('order-1')
+        self.assertEqual((order['status'], order['claimed_by'], order['lease_expires_at']), ('completed', '', ''))
+        self.assertNotEqual(order['payment_submitted_at'], '')
+        self.assertEqual(worker.completed, 1)
+        self.assertEqual(self.device_commands()[1:], [
+            'input tap 540 620', 'input text 3331234567', 'input tap 540 900', 'input text 10', 'input tap 540 1650'])
+        # 表单一次往返，支付按钮在登记支付后单独一次
+        self.assertEqual(self.session_round_trips('input') - round_trips, 2)
+        messages = self.db.execute("SELECT COUNT(*) FROM site_messages WHERE order_id='order-1'").fetchone()[0]
+        self.assertEqual(messages, 1)
+        titles = [row[0] for row in self.db.execute("SELECT title FROM notifications")]
+        self.assertEqual(titles, ['✅ 充值成功 €10'])
+
+    def test_device_failure_requeues(self):
+        self.insert_order('order-1')
+        worker = order_bot.DeviceWorker(CFG, serial='bad')
+        self.assertTrue(worker.process_one())
+        order = self.order('order-1')
+        self.assertEqual((order['status'], order['claimed_by'], order['payment_submitted_at']), ('processing', '', ''))
+        self.assertEqual(worker.consecutive_errors, 1)
+
+    def test_lease_lost_before_payment_is_not_paid(self):
+        self.insert_order('order-1')
+        worker = order_bot.DeviceWorker(CFG)
+
+        def reclaim():
+            self.expire_lease()
+            self.assertEqual(reclaim_expired_leases(self.db), ['order-1'])
+
+        with self.assertLogs('order_queue', 'ERROR'):
+            self.assertTrue(self.run_with_stall(worker, ACTION_DELAY, reclaim))
+        order = self.order('order-1')
+        self.assertEqual((order['status'], order['payment_submitted_at']), ('processing', ''))
+        self.assertEqual(worker.completed, 0)
+        self.assertNotIn('input tap 540 1650', self.device_commands())
+
+    def test_lease_lost_after_payment_goes_to_review(self):
+        self.insert_order('order-1')
+        worker = order_bot.DeviceWorker(CFG)
+
+        def dispatcher_reconcile():
+            self.expire_lease()
+            self.assertEqual(reclaim_expired_leases(self.db), [])
+            dispatcher.hold_paid_orders(self.db, CFG)
+            order = self.order('order-1')
+            self.assertEqual((order['status'], order['lease_expires_at']), ('paying', ''))
+            self.assertIsNone(claim_order(self.db, 'other-device'))
+
+        with self.assertLogs('order_queue', 'ERROR'):
+            self.run_with_stall(worker, PAYMENT_RESULT_WAIT, dispatcher_reconcile)
+        # 迟到的结果照常写回，不会丢弃
+        order = self.order('order-1')
+        self.assertEqual((order['status'], order['claimed_by']), ('completed', ''))
+        self.assertEqual(worker.completed, 1)
+        titles = [row[0] for row in self.db.execute("SELECT title FROM notifications ORDER BY id")]
+        self.assertEqual(titles, ['充值待核对', '✅ 充值成功 €10'])
+
+    def test_result_after_admin_takeover_is_reported(self):
+        self.insert_order('order-1')
+        worker = order_bot.DeviceWorker(CFG)
+
+        def admin_fails_order():
+            self.expire_lease()
+            dispatcher.hold_paid_orders(self.db, CFG)
+            self.db.execute("UPDATE orders SET status='failed', message='操作取消', claimed_by='' WHERE id='order-1'")
+            self.db.commit()
+
+        with self.assertLogs('order_bot', 'ERROR'):
+            self.run_with_stall(worker, PAYMENT_RESULT_WAIT, admin_fails_order)
+        self.assertEqual(self.order('order-1')['status'], 'failed')
+        self.assertEqual(worker.completed, 0)
+        titles = [row[0] for row in self.db.execute("SELECT title FROM notifications ORDER BY id")]
+        self.assertEqual(titles, ['充值待核对', '充值结果待核对'])
+
+    def test_session_commands_do_not_read_the_script(self):
+        # 读 stdin 的命令（cat / read）拿到的是 /dev/null，不会吞掉结束标记和后面的命令
+        session = order_bot.get_adb_session('adb')
+        self.assertEqual(session.run('cat', 'echo after'), ('after', 0))
+        self.assertEqual(session.run('read line; echo "[$line]"'), ('[]', 0))
+        self.assertEqual(session.run('false'), ('', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+订单领取/租约协议测试：多个进程同时对同一个数据库调用 claim_order，
+每个订单只能被领取一次；过期租约被回收，未过期的不受影响。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from datetime import datetime, timedelta
+
+from database import connect
+from migrations import migrate
+from order_queue import claim_order, finish_claim, reclaim_expired_leases
+
+WORKERS = 4
+ORDERS = 200
+
+
+def insert_order(db, order_id, status='processing', claimed_by='', lease_expires_at=''):
+    db.execute("""
+        INSERT INTO orders (id, user_id, phone, operator, amount, status, created_at, claimed_by, lease_expires_at)
+        VALUES (?,?,?,?,?,?,?,?,?)
+    """, (order_id, 'user', '3331234567', 'TIM', 10, status, datetime.now().isoformat(),
+          claimed_by, lease_expires_at))
+
+
+def claim_all(db_file, worker_id, start, results):
+    """子进程：等所有 worker 就绪后一起开始，领取到队列为空为止"""
+    db = connect(db_file)
+    start.wait()
+    claimed = []
+    while True:
+        order = claim_order(db, worker_id)
+        if order is None:
+            break
+        claimed.append(order['id'])
+        # 模拟充值耗时，让各 worker 的领取交错进行
+        time.sleep(0.002)
+    db.close()
+    results.put((worker_id, claimed))
+
+
+class OrderQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmpdir, 'queue.db')
+        self.db = connect(self.db_file)
+        migrate(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_concurrent_claims_are_exclusive(self):
+        for i in range(ORDERS):
+            insert_order(self.db, f"order-{i:04d}")
+        self.db.commit()
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=claim_all, args=(self.db_file, f"worker-{n}", start, results))
+                 for n in range(WORKERS)]
+        for proc in procs:
+            proc.start()
+        start.set()
+        claims = dict(results.get(timeout=60) for _ in procs)
+        for proc in procs:
+            proc.join(timeout=10)
+            self.assertEqual(proc.exitcode, 0)
+
+        claimed = [order_id for ids in claims.values() for order_id in ids]
+        self.assertEqual(len(claimed), ORDERS)
+        self.assertEqual(len(set(claimed)), ORDERS)
+        self.assertGreater(sum(1 for ids in claims.values() if ids), 1)
+        rows = self.db.execute("SELECT id, status, claimed_by FROM orders").fetchall()
+        owner = {order_id: worker for worker, ids in claims.items() for order_id in ids}
+        for row in rows:
+            self.assertEqual(row['status'], 'paying')
+            self.assertEqual(row['claimed_by'], owner[row['id']])
+        events = self.db.execute("SELECT COUNT(*) FROM order_events WHERE status = 'paying'").fetchone()[0]
+        self.assertEqual(events, ORDERS)
+
+    def test_expired_lease_is_reclaimed(self):
+        now = datetime.now()
+        insert_order(self.db, 'expired', 'paying', 'crashed-worker', (now - timedelta(seconds=1)).isoformat())
+        insert_order(self.db, 'live', 'paying', 'busy-worker', (now + timedelta(minutes=2)).isoformat())
+        self.db.commit()
+
+        self.assertEqual(reclaim_expired_leases(self.db), ['expired'])
+        status = dict(self.db.execute("SELECT id, status FROM orders").fetchall())
+        self.assertEqual(status, {'expired': 'processing', 'live': 'paying'})
+
+        # 回收后原 worker 不能再写回结果，新 worker 可以重新领取
+        self.assertFalse(finish_claim(self.db, 'expired', 'crashed-worker', 'completed'))
+        order = claim_order(self.db, 'new-worker')
+        self.assertEqual((order['id'], order['claimed_by']), ('expired', 'new-worker'))
+        self.assertIsNone(claim_order(self.db, 'new-worker'))
+        self.assertTrue(finish_claim(self.db, 'live', 'busy-worker', 'completed'))
+        self.db.commit()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+热点查询的 EXPLAIN QUERY PLAN 检查：在 migrate() 建出的库中写入一批有代表性的数据并 ANALYZE 后，
+每条查询都必须走索引（SEARCH ... USING INDEX / PRIMARY KEY），不允许对表做全表扫描。
+语句直接取自 queries.py 和各模块的 SQL 常量，与线上执行的完全一致。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import queries
+import dispatcher
+import order_queue
+import notify
+import stream
+import maintenance
+import payment_bot
+from database import connect
+from migrations import migrate
+from pagination import keyset_sql, encode_cursor
+
+USERS = 500
+ORDERS = 20000
+STATUSES = ['completed'] * 12 + ['failed'] * 3 + ['awaiting_payment', 'charged', 'processing', 'paying', 'holding']
+
+
+def keyset(select, where, params, cursor=True, alias=''):
+    return keyset_sql(select, where, params, 20, encode_cursor('2026-01-01T00:00:00', 'id') if cursor else None, alias)
+
+
+def admin_orders(**filters):
+    where, params = queries.admin_order_filters(**filters)
+    return keyset(queries.ADMIN_ORDERS_SELECT, where, params, alias='o')
+
+
+NOW = 'now'
+HOT_QUERIES = {
+    # server.py
+    "session lookup": (queries.SESSION_USER_SQL, ('token', NOW)),
+    "admin session lookup": (queries.ADMIN_SESSION_SQL, ('token', NOW)),
+    "login by email or phone": (queries.LOGIN_SQL, ('a@b.c', '3331234567')),
+    "sms code": (queries.SMS_CODE_SQL, ('3331234567', '123456', 'register', NOW)),
+    "email registered": (queries.EMAIL_TAKEN_SQL, ('a@b.c',)),
+    "phone registered": (queries.PHONE_TAKEN_SQL, ('3331234567',)),
+    "register ip": (queries.REGISTER_IP_SQL, ('1.2.3.4', NOW)),
+    "fingerprint": (queries.FINGERPRINT_SQL, ('fp',)),
+    "user order list": (queries.USER_ORDERS_SQL, ('user-0001',)),
+    "user order detail": (queries.USER_ORDER_SQL, ('order', 'user-0001')),
+    "unpaid credit order": (queries.UNPAID_CREDIT_SQL, ('user-0001',)),
+    "inbox unread count": (queries.INBOX_UNREAD_SQL, ('user-0001',)),
+    "inbox first page": keyset(queries.INBOX_SELECT, queries.INBOX_WHERE, ['user-0001'], cursor=False),
+    "inbox next page": keyset(queries.INBOX_SELECT, queries.INBOX_WHERE, ['user-0001']),
+    "admin order list": admin_orders(),
+    "admin orders by status": admin_orders(status='processing'),
+    "admin orders by operator": admin_orders(operator='Iliad'),
+    "admin orders by date range": admin_orders(date_from='2025-06-01', date_to='2025-06-07'),
+    "admin orders by status and date": admin_orders(status='failed', date_from='2025-06-01', date_to='2025-06-07'),
+    "admin orders by operator and date": admin_orders(operator='TIM', date_from='2025-06-01'),
+    "admin user list": keyset(queries.ADMIN_USERS_SELECT, [], []),
+    # dispatcher.py
+    "charged orders": (dispatcher.PROCESS_CHARGED_SQL, (NOW,)),
+    "release holding orders": (dispatcher.RELEASE_HOLDING_SQL, (NOW,)),
+    "processing timeout": (dispatcher.STALE_STATUS_SQL, ('processing', NOW, NOW)),
+    "paying timeout": (dispatcher.STALE_STATUS_SQL, ('paying', NOW, NOW)),
+    # order_queue.py
+    "claim next processing": (order_queue.CLAIM_ORDER_SQL, (NOW, 'worker', NOW)),
+    "renew lease": (order_queue.RENEW_LEASE_SQL, (NOW, 'order', 'worker')),
+    "submit payment": (order_queue.SUBMIT_PAYMENT_SQL, (NOW, 'order', 'worker', NOW)),
+    "finish claim": (order_queue.FINISH_CLAIM_SQL, ('completed', '', NOW, 'order', 'worker')),
+    "expired leases": (order_queue.RECLAIM_EXPIRED_SQL, (NOW, NOW)),
+    "expired leases after payment": (order_queue.HOLD_PAID_EXPIRED_SQL, (NOW, NOW)),
+    # notify.py
+    "notification claim": (notify.CLAIM_BATCH_SQL, ('worker', NOW, 'telegram', 'key', NOW, 20)),
+    "notification purge": (notify.PURGE_NOTIFICATIONS_SQL, (NOW,)),
+    # stream.py
+    "redeem stream ticket": (stream.REDEEM_TICKET_SQL, ('ticket', 0)),
+    # payment_bot.py
+    "due reminders": (payment_bot.DUE_REMINDERS_SQL, (NOW, payment_bot.SWEEP_LIMIT)),
+    "claim reminder": (payment_bot.CLAIM_REMINDER_SQL, (1, NOW, NOW, 'order', 0)),
+    # maintenance.py
+    **{f"purge {table}": (sql, (NOW, maintenance.BATCH_SIZE)) for table, sql in maintenance.PURGE_SQL.items()},
+    "trim user sessions": (maintenance.TRIM_USER_SESSIONS_SQL, ('user-0001', 'user-0001', 10)),
+    "trim all sessions": (maintenance.SESSION_GROUPS_SQL, ('', maintenance.BATCH_SIZE)),
+    "archive messages": (maintenance.ARCHIVE_SELECT_SQL, (NOW, maintenance.BATCH_SIZE)),
+}
+
+
+def seed(db):
+    rng = random.Random(3)
+    start = datetime(2025, 1, 1)
+    users = [f"user-{i:04d}" for i in range(USERS)]
+    db.executemany("""
+        INSERT INTO users (id, email, phone, password_hash, register_ip, fingerprint, created_at)
+        VALUES (?,?,?,?,?,?,?)
+    """, [(u, f"{u}@example.com", f"333{i:07d}", 'x', f"10.0.{i % 50}.{i % 200}", f"fp{i}",
+           (start + timedelta(hours=i)).isoformat()) for i, u in enumerate(users)])
+    orders = []
+    for i in range(ORDERS):
+        created = (start + timedelta(minutes=30 * i)).isoformat()
+        status = rng.choice(STATUSES)
+        orders.append((f"order-{i:06d}", rng.choice(users), f"33{rng.randrange(10 ** 8):08d}",
+                       rng.choice(['TIM', 'Vodafone', 'WindTre', 'Iliad']), 10, status, int(status == 'awaiting_payment'),
+                       created, created))
+    db.executemany("""
+        INSERT INTO orders (id, user_id, phone, operator, amount, status, is_credit, created_at, updated_at)
+        VALUES (?,?,?,?,?,?,?,?,?)
+    """, orders)
+    now = datetime.now()
+    db.executemany("INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?,?,?,?)",
+                   [(f"token-{i}", rng.choice(users), (now - timedelta(days=i % 60)).isoformat(),
+                     (now + timedelta(days=30 - i % 60)).isoformat()) for i in range(5000)])
+    db.executemany("INSERT INTO admin_sessions (token, created_at, expires_at) VALUES (?,?,?)",
+                   [(f"admin-{i}", now.isoformat(), (now + timedelta(hours=8 - i)).isoformat()) for i in range(500)])
+    db.executemany("INSERT INTO stream_tickets (ticket, user_id, expires_at) VALUES (?,?,?)",
+                   [(f"ticket-{i}", rng.choice(users), (now + timedelta(seconds=30 - i)).isoformat()) for i in range(500)])
+    db.executemany("INSERT INTO sms_codes (phone, code, purpose, ip, created_at) VALUES (?,?,?,?,?)",
+                   [(f"333{i % 900:07d}", f"{i:06d}", 'register', '10.0.0.1',
+                     (now - timedelta(minutes=i)).isoformat()) for i in range(3000)])
+    db.executemany("INSERT INTO site_messages (user_id, type, title, is_read, created_at) VALUES (?,?,?,?,?)",
+                   [(rng.choice(users), 'info', 'm', int(rng.random() < 0.8),
+                     (start + timedelta(minutes=7 * i)).isoformat()) for i in range(20000)])
+    db.executemany("""
+        INSERT INTO notifications (channel, sender, title, body, status, attempts, next_attempt_at, created_at)
+        VALUES (?,?,?,?,?,0,?,?)
+    """, [(rng.choice(['telegram', 'pushplus']), f"key{i % 3}", '', 'x', rng.choice(['sent'] * 8 + ['pending', 'failed']),
+           now.isoformat(), (now - timedelta(minutes=i)).isoformat()) for i in range(5000)])
+    db.executemany("INSERT INTO cache_invalidations (kind, key, created_at) VALUES (?,?,?)",
+                   [('session', f"token-{i}", (now - timedelta(seconds=i)).isoformat()) for i in range(2000)])
+    db.commit()
+    db.execute("ANALYZE")
+    db.commit()
+
+
+class QueryPlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.db = connect(os.path.join(cls.tmpdir, 'plans.db'))
+        migrate(cls.db)
+        seed(cls.db)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def plan(self, sql, params):
+        return [row[3] for row in self.db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+    def test_hot_queries_use_indexes(self):
+        for name, (sql, params) in HOT_QUERIES.items():
+            with self.subTest(name):
+                steps = self.plan(sql, params)
+                # 子查询/CTE 的协程结果（CO-ROUTINE x / MATERIALIZE x）可以顺序扫描，表不行
+                subqueries = {s.split(' ', 1)[1] for s in steps if s.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+                scans = [s for s in steps if s.startswith('SCAN ') and ' USING ' not in s
+                         and s[len('SCAN '):] not in subqueries]
+                self.assertEqual(scans, [], f"{name}: {steps}")
+                self.assertTrue(any(' USING ' in s for s in steps), f"{name}: {steps}")
+
+    def test_statistics_collected(self):
+        tables = {row[0] for row in self.db.execute("SELECT DISTINCT tbl FROM sqlite_stat1")}
+        self.assertTrue({'orders', 'users', 'sessions', 'site_messages', 'sms_codes'} <= tables, tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
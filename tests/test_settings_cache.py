@@ -0,0 +1,88 @@
+"""
+settings 快照缓存测试：失效后在重新加载前继续返回上一份快照；
+set() 先提交再失效；加载过程中到达的失效不会被这次加载吞掉。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from database import connect
+from migrations import migrate
+from cache import InvalidationListener, SettingsCache
+
+SCHEMA = {
+    'cny_active': (bool, False),
+    'online_count': (int, 0),
+}
+
+
+class SettingsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmpdir, 'settings.db')
+        self.db = connect(self.db_file)
+        migrate(self.db)
+        self.db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('cny_active', '1')")
+        self.db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('online_count', '42')")
+        self.db.commit()
+        self.cache = SettingsCache(SCHEMA, InvalidationListener(interval=3600))
+        self.cache.refresh(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_unloaded_cache_refuses_defaults(self):
+        cache = SettingsCache(SCHEMA, InvalidationListener())
+        with self.assertRaises(RuntimeError):
+            cache.get('cny_active')
+
+    def test_stale_snapshot_is_served_until_reload(self):
+        self.cache._mark_stale('cny_active')
+        self.assertTrue(self.cache.needs_refresh())
+        self.assertIs(self.cache.get('cny_active'), True)
+        self.assertEqual(self.cache.get('online_count'), 42)
+
+    def test_set_commits_before_invalidating(self):
+        seen = []
+        other = connect(self.db_file)
+        self.addCleanup(other.close)
+        original = self.cache._mark_stale
+
+        def mark_stale(key=""):
+            # 失效时其他连接必须已经能读到新值，否则并发加载会把旧值当成新快照
+            seen.append(other.execute("SELECT value FROM settings WHERE key='cny_active'").fetchone()[0])
+            original(key)
+
+        self.cache._mark_stale = mark_stale
+        self.cache.set(self.db, 'cny_active', False)
+        self.assertEqual(seen, ['0'])
+        self.assertFalse(self.db.in_transaction)
+        self.cache.refresh(self.db)
+        self.assertIs(self.cache.get('cny_active'), False)
+
+    def test_invalidation_during_load_keeps_cache_stale(self):
+        cache = self.cache
+        cache._mark_stale()
+
+        class Racing:
+            def __init__(self, db):
+                self.db = db
+
+            def execute(self, sql, *args):
+                if sql.startswith("SELECT key, value FROM settings"):
+                    cache._mark_stale('cny_active')
+                return self.db.execute(sql, *args)
+
+        cache._load(Racing(self.db))
+        self.assertTrue(cache.needs_refresh())
+        cache.refresh(self.db)
+        self.assertFalse(cache._stale)
+
+
+if __name__ == '__main__':
+    unittest.main()
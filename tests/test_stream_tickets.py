@@ -0,0 +1,51 @@
+"""
+SSE 连接票据测试：票据只能核销一次，过期或用错端点（用户/管理员）的票据无效。
+
+运行：python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+import stream
+from database import connect
+from migrations import migrate
+
+
+class StreamTicketTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = connect(os.path.join(self.tmpdir, 'tickets.db'))
+        migrate(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_ticket_is_single_use(self):
+        ticket = stream.issue_ticket(self.db, 'user-1')
+        self.assertEqual(stream.redeem_ticket(self.db, ticket), (True, 'user-1'))
+        self.assertEqual(stream.redeem_ticket(self.db, ticket), (False, None))
+
+    def test_expired_ticket_is_rejected_and_removed(self):
+        ticket = stream.issue_ticket(self.db, 'user-1')
+        later = datetime.now() + timedelta(seconds=stream.TICKET_TTL + 1)
+        with mock.patch.object(stream, 'datetime', mock.Mock(now=mock.Mock(return_value=later))):
+            self.assertEqual(stream.redeem_ticket(self.db, ticket), (False, None))
+        self.assertIsNone(self.db.execute("SELECT 1 FROM stream_tickets WHERE ticket=?", (ticket,)).fetchone())
+
+    def test_user_and_admin_tickets_are_separate(self):
+        user_ticket = stream.issue_ticket(self.db, 'user-1')
+        admin_ticket = stream.issue_ticket(self.db, '', is_admin=True)
+        self.assertEqual(stream.redeem_ticket(self.db, user_ticket, is_admin=True), (False, None))
+        self.assertEqual(stream.redeem_ticket(self.db, admin_ticket), (False, None))
+        self.assertEqual(stream.redeem_ticket(self.db, admin_ticket, is_admin=True), (True, ''))
+        self.assertEqual(stream.redeem_ticket(self.db, ''), (False, None))
+
+
+if __name__ == '__main__':
+    unittest.main()